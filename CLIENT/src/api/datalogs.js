@@ -1,11 +1,17 @@
-import { getApiUrl } from "../lib/backend";
+import { authHeaders, getApiUrl } from "../lib/backend";
 
-export async function fetchDatalogs({ start, end, batteryId } = {}) {
+export async function fetchDatalogs({ start, end, batteryId, sinceId, sinceTs, maxPoints, reducer } = {}) {
   const params = new URLSearchParams();
 
   if (start) params.append("start", start); // expects YYYY-MM-DD
   if (end) params.append("end", end); // expects YYYY-MM-DD
   if (batteryId && batteryId !== "All") params.append("battery_id", batteryId);
+  // Downsampled fetch: returns { resolution, reducer, data } with min/max/avg/last per bucket
+  if (maxPoints) params.append("max_points", maxPoints);
+  if (maxPoints && reducer) params.append("reducer", reducer);
+  // Delta fetch: returns { data, watermark, reset } instead of a plain list
+  if (sinceId != null) params.append("since_id", sinceId);
+  else if (sinceTs) params.append("since_ts", sinceTs); // ISO timestamp
 
   const url = `${getApiUrl()}/datalogs?${params.toString()}`;
 
@@ -14,6 +20,7 @@ export async function fetchDatalogs({ start, end, batteryId } = {}) {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
+        ...authHeaders(),
       },
     });
 
@@ -27,3 +34,40 @@ export async function fetchDatalogs({ start, end, batteryId } = {}) {
     throw err;
   }
 }
+
+/**
+ * Fetch datalogs in the packed binary format and decode them into typed arrays.
+ * Layout: "BMS1", uint32 count, float64 timestamps (ms), int32 battery ids,
+ * float32 voltage, current, temperature (all little-endian).
+ */
+export async function fetchDatalogsBinary({ start, end, batteryId } = {}) {
+  const params = new URLSearchParams({ format: "binary" });
+
+  if (start) params.append("start", start);
+  if (end) params.append("end", end);
+  if (batteryId && batteryId !== "All") params.append("battery_id", batteryId);
+
+  const res = await fetch(`${getApiUrl()}/datalogs?${params.toString()}`, {
+    headers: authHeaders(),
+  });
+  if (!res.ok) {
+    throw new Error(`Failed to fetch datalogs: ${res.status}`);
+  }
+
+  const buf = await res.arrayBuffer();
+  const count = new DataView(buf).getUint32(4, true);
+  let offset = 8;
+  const take = (Type) => {
+    const arr = new Type(buf, offset, count);
+    offset += count * Type.BYTES_PER_ELEMENT;
+    return arr;
+  };
+
+  return {
+    timestamp: take(Float64Array),
+    batteryId: take(Int32Array),
+    voltage: take(Float32Array),
+    current: take(Float32Array),
+    temperature: take(Float32Array),
+  };
+}
@@ -1,12 +1,15 @@
 import axios from "axios";
-import { getApiUrl } from "../lib/backend";
+import { authHeaders, getApiUrl } from "../lib/backend";
 
 const API_BASE = getApiUrl();
 
 // ---------------- GET ALL FAULT LOGS ----------------
 export const getFaultLogs = async (params) => {
   try {
-    const res = await axios.get(`${API_BASE}/fault-logs`, { params });
+    const res = await axios.get(`${API_BASE}/fault-logs`, {
+      params,
+      headers: authHeaders(),
+    });
     return res.data;
   } catch (err) {
     console.error("Error fetching fault logs:", err);
@@ -14,7 +17,37 @@ export const getFaultLogs = async (params) => {
   }
 };
 
+// ---------------- SUMMARY COUNTS ----------------
+// Counts by fault type, severity, battery and time bucket, aggregated server-side
+export const getFaultLogsSummary = async (params) => {
+  try {
+    const res = await axios.get(`${API_BASE}/fault-logs/summary`, {
+      params,
+      headers: authHeaders(),
+    });
+    return res.data;
+  } catch (err) {
+    console.error("Error fetching fault log summary:", err);
+    throw err;
+  }
+};
+
 // ---------------- DOWNLOAD CSV ----------------
-export const getFaultLogsCSV = () => {
-  return `${API_BASE}/fault-logs/csv`;
+// Fetched with the bearer token (a plain link cannot send it) and saved as a blob
+export const downloadFaultLogsCSV = async (params = {}) => {
+  const query = new URLSearchParams(
+    Object.entries(params).filter(([, v]) => v)
+  ).toString();
+  const res = await fetch(`${API_BASE}/fault-logs/csv${query ? `?${query}` : ""}`, {
+    headers: authHeaders(),
+  });
+  if (!res.ok) throw new Error(`Failed to download fault logs: ${res.status}`);
+
+  const link = document.createElement("a");
+  link.href = URL.createObjectURL(await res.blob());
+  link.setAttribute("download", "fault_logs.csv");
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
+  URL.revokeObjectURL(link.href);
 };
@@ -1,5 +1,5 @@
 // src/api/graph.js
-import { getApiUrl } from "../lib/backend";
+import { authHeaders, getApiUrl } from "../lib/backend";
 
 export const fetchGraphData = async ({ batteryId = "All", start, end }) => {
   const url = new URL(`${getApiUrl()}/graph`);
@@ -10,7 +10,7 @@ export const fetchGraphData = async ({ batteryId = "All", start, end }) => {
   if (start) url.searchParams.append("start", start);
   if (end) url.searchParams.append("end", end);
 
-  const res = await fetch(url);
+  const res = await fetch(url, { headers: authHeaders() });
   if (!res.ok) {
     throw new Error(`Failed to fetch graph data: ${res.statusText}`);
   }
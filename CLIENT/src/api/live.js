@@ -0,0 +1,36 @@
+import { io } from "socket.io-client";
+import { getBackendOrigin } from "../lib/backend";
+
+// Order of values in each pushed reading (matches READING_FIELDS on the server)
+const FIELDS = ["batteryId", "timestampMs", "voltage", "current", "temperature"];
+
+/**
+ * Subscribe to live readings for the given battery ids.
+ * onReadings receives an array of { batteryId, timestampMs, voltage, current, temperature }.
+ * onReconnect is called after the socket reconnects, so the caller can fetch
+ * what was pushed while it was down.
+ * Returns a function that closes the socket.
+ */
+export function subscribeTelemetry({ batteryIds = [], maxRate, token, onReconnect }, onReadings) {
+  const socket = io(`${getBackendOrigin()}/telemetry`, {
+    auth: token ? { token } : undefined,
+    transports: ["websocket"],
+  });
+
+  let connectedBefore = false;
+  socket.on("connect", () => {
+    socket.emit("subscribe", { battery_ids: batteryIds, max_rate: maxRate });
+    if (connectedBefore && onReconnect) onReconnect();
+    connectedBefore = true;
+  });
+
+  socket.on("readings", (rows) => {
+    onReadings(
+      rows.map((row) =>
+        Object.fromEntries(FIELDS.map((field, i) => [field, row[i]]))
+      )
+    );
+  });
+
+  return () => socket.disconnect();
+}
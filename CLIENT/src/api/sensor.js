@@ -1,12 +1,12 @@
-import { getApiUrl } from "../lib/backend";
+import { authHeaders, getApiUrl } from "../lib/backend";
 
 export async function fetchSensorData() {
-  const res = await fetch(`${getApiUrl()}/sensor`);
+  const res = await fetch(`${getApiUrl()}/sensor`, { headers: authHeaders() });
   if (!res.ok) throw new Error("Failed to fetch sensor data");
   return await res.json();
 }
 export async function fetchSensorLogs() {
-  const res = await fetch(`${getApiUrl()}/sensor/logs`);
+  const res = await fetch(`${getApiUrl()}/sensor/logs`, { headers: authHeaders() });
   if (!res.ok) throw new Error("Failed to fetch sensor logs");
   return await res.json();
 }
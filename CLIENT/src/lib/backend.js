@@ -11,3 +11,9 @@ export function getApiUrl() {
   const origin = getBackendOrigin();
   return `${origin}/api`;
 }
+
+// Bearer header for the signed-in user; tenant-scoped routes reject requests without it
+export function authHeaders() {
+  const token = localStorage.getItem("token");
+  return token ? { Authorization: `Bearer ${token}` } : {};
+}
@@ -1,10 +1,42 @@
-import React, { useEffect, useState, useCallback, useMemo } from "react";
+import React, { useEffect, useState, useCallback, useMemo, useRef } from "react";
 import Card from "../components/Card";
 import Graph from "../components/Graph";
 import { fetchDatalogs } from "../api/datalogs.js";
+import { subscribeTelemetry } from "../api/live.js";
+
+// Points kept on the charts while live readings stream in
+const MAX_LOGS = 5000;
+// Ranges long enough that the server buckets the history instead of sending every row
+const DOWNSAMPLED_RANGES = new Set(["1day", "1month", "6months", "1year"]);
+// Buckets per battery asked for on a downsampled range
+const CHART_POINTS = 500;
+
+/** 🔹 Downsampled buckets -> the reading shape the charts use */
+const fromBuckets = (buckets) =>
+  (buckets || []).map((b) => ({
+    timestamp: b.timestamp,
+    batteryId: b.batteryId,
+    voltage: b.voltage_avg,
+    current: b.current_avg,
+    temperature: b.temperature_avg,
+  }));
+
+const logKey = (l) => `${l.batteryId}:${l.timestampMs}`;
+
+/** 🔹 Append readings, skipping ones already shown, and keep the newest MAX_LOGS */
+const mergeLogs = (prev, fresh) => {
+  const seen = new Set(prev.map(logKey));
+  const added = fresh.filter((l) => !seen.has(logKey(l)));
+  if (!added.length) return prev;
+  return [...prev, ...added]
+    .sort((a, b) => (a.timestampMs || 0) - (b.timestampMs || 0))
+    .slice(-MAX_LOGS);
+};
 
 const Dashboard = () => {
   const [logs, setLogs] = useState([]);
+  // Where a catch-up after a reconnect starts: since_id once the server sent one, else the newest timestamp
+  const watermark = useRef({ sinceId: null, sinceTs: null });
   const [batteryId, setBatteryId] = useState("All");
   const [batteryIds, setBatteryIds] = useState([]);
   const [timeRange, setTimeRange] = useState("1hr");
@@ -57,18 +89,30 @@ const Dashboard = () => {
   /** 🔹 Fetch and process data */
   const loadLogs = useCallback(async () => {
     try {
-      const rawData = await fetchDatalogs({ batteryId });
-      const normalized = normalizeLogs(rawData);
       const cutoff = getCutoff();
-      const cutoffMs = cutoff?.getTime();
-
-      const filtered =
-        cutoffMs && normalized.length
-          ? normalized.filter((log) => log.timestampMs >= cutoffMs)
-          : normalized;
+      let normalized;
+      let filtered;
+      if (DOWNSAMPLED_RANGES.has(timeRange)) {
+        // Bucketed server-side over the range; all history when the range is empty
+        const fetchBuckets = async (start) =>
+          fromBuckets((await fetchDatalogs({ batteryId, start, maxPoints: CHART_POINTS })).data);
+        filtered = normalizeLogs(await fetchBuckets(cutoff.toISOString()));
+        normalized = filtered.length ? filtered : normalizeLogs(await fetchBuckets());
+      } else {
+        normalized = normalizeLogs(await fetchDatalogs({ batteryId }));
+        const cutoffMs = cutoff?.getTime();
+        filtered =
+          cutoffMs && normalized.length
+            ? normalized.filter((log) => log.timestampMs >= cutoffMs)
+            : normalized;
+      }
 
-      const usableLogs = filtered.length ? filtered : normalized;
+      const usableLogs = (filtered.length ? filtered : normalized).slice(-MAX_LOGS);
       setLogs(usableLogs);
+      watermark.current = {
+        sinceId: null,
+        sinceTs: usableLogs.length ? usableLogs[usableLogs.length - 1].timestamp : null,
+      };
       setBatteryIds([
         ...new Set(normalized.map((l) => l.batteryId).filter(Boolean)),
       ]);
@@ -86,13 +130,66 @@ const Dashboard = () => {
       console.error("Error loading logs:", err);
       setLogs([]);
     }
-  }, [batteryId, normalizeLogs, getCutoff]);
+  }, [batteryId, timeRange, normalizeLogs, getCutoff]);
 
   /** 🔹 Auto-load on dependency change */
   useEffect(() => {
     loadLogs();
   }, [loadLogs]);
 
+  /** 🔹 After a reconnect, fetch only what arrived while the socket was down */
+  const catchUp = useCallback(async () => {
+    const { sinceId, sinceTs } = watermark.current;
+    if (sinceId == null && !sinceTs) return loadLogs();
+    try {
+      const res = await fetchDatalogs({ batteryId, sinceId, sinceTs });
+      if (res.reset) return loadLogs();
+      watermark.current.sinceId = res.watermark?.since_id ?? sinceId;
+      const fresh = normalizeLogs(res.data);
+      if (fresh.length) setLogs((prev) => mergeLogs(prev, fresh));
+    } catch (err) {
+      console.error("Error catching up on logs:", err);
+    }
+    return undefined;
+  }, [batteryId, loadLogs, normalizeLogs]);
+
+  // The subscription below outlives catchUp's dependencies
+  const catchUpRef = useRef(catchUp);
+  catchUpRef.current = catchUp;
+
+  /** 🔹 Append pushed readings instead of re-fetching the history */
+  useEffect(() => {
+    const ids = batteryId === "All" ? batteryIds : [batteryId];
+    if (!ids.length) return undefined;
+
+    return subscribeTelemetry(
+      {
+        batteryIds: ids.map(Number),
+        token: localStorage.getItem("token"),
+        onReconnect: () => catchUpRef.current(),
+      },
+      (readings) => {
+        const fresh = readings.map((r) => ({
+          ...r,
+          batteryId: String(r.batteryId),
+          timestamp: new Date(r.timestampMs).toISOString(),
+        }));
+        setLogs((prev) => mergeLogs(prev, fresh));
+
+        const last = fresh[fresh.length - 1];
+        watermark.current.sinceTs = new Date(
+          Math.max(...fresh.map((r) => r.timestampMs))
+        ).toISOString();
+        setSensor({
+          voltage: last.voltage,
+          current: last.current,
+          temperature: last.temperature,
+          timestamp: last.timestamp,
+        });
+      }
+    );
+  }, [batteryId, batteryIds]);
+
   /** 🔹 Memoized chart labels */
   const labels = useMemo(
     () =>
@@ -1,5 +1,9 @@
 import React, { useEffect, useState } from "react";
-import { getFaultLogs, getFaultLogsCSV } from "../api/faultlogs";
+import {
+  getFaultLogs,
+  getFaultLogsSummary,
+  downloadFaultLogsCSV,
+} from "../api/faultlogs";
 
 export default function FaultLogs() {
   const [logs, setLogs] = useState([]);
@@ -7,17 +11,23 @@ export default function FaultLogs() {
   const [end, setEnd] = useState("");
   const [batteryId, setBatteryId] = useState("all");
   const [faultType, setFaultType] = useState("all");
+  const [summary, setSummary] = useState(null);
 
-  // Fetch Logs
+  // Fetch Logs and their summary counts with the same filters
   const fetchLogs = async () => {
+    const params = {
+      start,
+      end,
+      battery_id: batteryId,
+      fault_type: faultType,
+    };
     try {
-      const data = await getFaultLogs({
-        start,
-        end,
-        battery_id: batteryId,
-        fault_type: faultType,
-      });
+      const [data, counts] = await Promise.all([
+        getFaultLogs(params),
+        getFaultLogsSummary(params),
+      ]);
       setLogs(data);
+      setSummary(counts);
     } catch (err) {
       console.error(err);
     }
@@ -75,14 +85,47 @@ export default function FaultLogs() {
           Filter
         </button>
 
-        <a
-          href={getFaultLogsCSV()}
+        <button
+          onClick={() =>
+            downloadFaultLogsCSV({
+              start,
+              end,
+              battery_id: batteryId,
+              fault_type: faultType,
+            }).catch((err) => console.error(err))
+          }
           className="px-4 py-2 bg-green-600 rounded shadow"
         >
           Download CSV
-        </a>
+        </button>
       </div>
 
+      {/* Summary */}
+      {summary && (
+        <div className="flex flex-wrap gap-4 mb-6">
+          <div className="bg-slate-800 rounded p-4">
+            <div className="text-blue-300 text-sm">Total Faults</div>
+            <div className="text-2xl font-bold">{summary.total}</div>
+          </div>
+          <div className="bg-slate-800 rounded p-4">
+            <div className="text-blue-300 text-sm mb-1">By Severity</div>
+            {summary.by_severity.map((s) => (
+              <div key={s.severity ?? "none"} className="text-sm">
+                {s.severity ?? "unknown"}: {s.count}
+              </div>
+            ))}
+          </div>
+          <div className="bg-slate-800 rounded p-4">
+            <div className="text-blue-300 text-sm mb-1">By Fault Type</div>
+            {summary.by_fault_type.slice(0, 5).map((f) => (
+              <div key={f.fault_type ?? "none"} className="text-sm">
+                {f.fault_type ?? "unknown"}: {f.count}
+              </div>
+            ))}
+          </div>
+        </div>
+      )}
+
       {/* Table */}
       <div className="bg-slate-800 rounded p-4 overflow-auto">
         <table className="w-full text-left">
@@ -0,0 +1,240 @@
+"""
+Streaming per-battery anomaly detection on the ingest path.
+
+The fixed thresholds in fault_engine.py miss a battery slowly drifting
+away from its own normal. This detector keeps running statistics per
+battery and metric, updated in O(1) per sample, and never rescans history:
+
+- a slow baseline: exponentially weighted mean and variance (West/Finch
+  incremental form) with a time constant of ANOMALY_BASELINE_TAU seconds,
+  so irregular sampling does not change its memory. While the baseline
+  has seen fewer samples than that the weight is 1/n, which makes it
+  Welford's exact mean and variance.
+- a fast EWMA of the metric (ANOMALY_FAST_TAU), scored as a z-score
+  against the baseline. Smoothing means one noisy sample does not alert
+  but a sustained shift does.
+
+Once warmed up (ANOMALY_WARMUP samples), a sample more than ANOMALY_GATE
+baseline standard deviations out moves the baseline mean by at most that
+much and leaves the variance alone; otherwise a drift would widen the
+baseline as fast as it moved away from it and never score. A permanent
+shift still becomes the new normal, slowly.
+
+A battery/metric whose |z| exceeds ANOMALY_Z gets a batt_fault_log row
+with predicted_by='anomaly', then stays quiet for ANOMALY_COOLDOWN
+seconds.
+
+State is a fixed-size float64 array per battery. Every
+ANOMALY_CHECKPOINT_INTERVAL seconds the batteries that changed are
+written to batt_anomaly_state, and once more when the ingest worker
+stops; a battery's state is restored from there the first time it shows
+up after a restart. Run one detector per
+ingest stream: two processes feeding the same battery would each keep
+their own baseline.
+"""
+import logging
+import math
+import os
+import time
+from array import array
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, BattAnomalyState, BattFaultLog
+
+logger = logging.getLogger("bms.anomaly")
+
+ANOMALY_ENABLED = os.getenv('ANOMALY_ENABLED', 'True').lower() == 'true'
+# EWMA time constants in seconds
+ANOMALY_BASELINE_TAU = float(os.getenv('ANOMALY_BASELINE_TAU', 6 * 3600))
+ANOMALY_FAST_TAU = float(os.getenv('ANOMALY_FAST_TAU', 60))
+ANOMALY_WARMUP = int(os.getenv('ANOMALY_WARMUP', 500))
+ANOMALY_GATE = float(os.getenv('ANOMALY_GATE', 3.0))
+ANOMALY_Z = float(os.getenv('ANOMALY_Z', 6.0))
+ANOMALY_COOLDOWN = float(os.getenv('ANOMALY_COOLDOWN', 3600))
+ANOMALY_CHECKPOINT_INTERVAL = float(os.getenv('ANOMALY_CHECKPOINT_INTERVAL', 30))
+PREDICTED_BY = "anomaly"
+
+# Smallest standard deviation a z-score is divided by, so a perfectly flat
+# baseline does not turn sensor quantization into anomalies
+METRICS = {"voltage": 0.02, "current": 0.5, "temperature": 0.2}
+
+# Per metric in BatteryState.stats: baseline mean, baseline variance, fast mean, last alert (epoch s)
+MEAN, VAR, FAST, ALERTED = range(4)
+WIDTH = 4
+
+
+class BatteryState:
+    __slots__ = ("samples", "last_ts", "stats", "dirty")
+
+    def __init__(self, samples=0, last_ts=None, stats=None):
+        self.samples = samples
+        self.last_ts = last_ts
+        self.stats = stats if stats is not None else array("d", [0.0] * (WIDTH * len(METRICS)))
+        self.dirty = False
+
+
+def _epoch(ts):
+    # sqlite hands back naive datetimes; every stored ts is UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class AnomalyDetector:
+    def __init__(self, baseline_tau=ANOMALY_BASELINE_TAU, fast_tau=ANOMALY_FAST_TAU, warmup=ANOMALY_WARMUP,
+                 gate=ANOMALY_GATE, z_limit=ANOMALY_Z, cooldown=ANOMALY_COOLDOWN,
+                 checkpoint_interval=ANOMALY_CHECKPOINT_INTERVAL):
+        self.baseline_tau = baseline_tau
+        self.fast_tau = fast_tau
+        self.warmup = warmup
+        self.gate = gate
+        self.z_limit = z_limit
+        self.cooldown = cooldown
+        self.checkpoint_interval = checkpoint_interval
+        self._states = {}
+        self._last_checkpoint = time.monotonic()
+        self.samples = 0
+        self.anomalies = 0
+        self.checkpoints = 0
+
+    # ---------------- SCORING ----------------
+    def observe(self, state, ts, values):
+        """
+        Fold one sample at `ts` (epoch s, after state.last_ts) into `state`.
+
+        values  {metric: float or None}
+        Returns [(metric, z, baseline mean, baseline std)] for the metrics
+        that crossed the limit.
+        """
+        stats = state.stats
+        dt = ts - state.last_ts if state.last_ts is not None else 0.0
+        state.last_ts = ts
+        state.samples += 1
+        n = state.samples
+        # 1/n first: Welford's exact mean/variance while the baseline is young
+        alpha = max(-math.expm1(-dt / self.baseline_tau), 1.0 / n)
+        fast_alpha = max(-math.expm1(-dt / self.fast_tau), 1.0 / n)
+        warm = n > self.warmup
+        found = []
+
+        for k, (metric, min_std) in enumerate(METRICS.items()):
+            x = values.get(metric)
+            if x is None or not math.isfinite(x):
+                continue
+            base = k * WIDTH
+            mean, var = stats[base + MEAN], stats[base + VAR]
+            fast = stats[base + FAST] + fast_alpha * (x - stats[base + FAST]) if n > 1 else x
+
+            std = max(math.sqrt(var), min_std)
+            z = (fast - mean) / std
+            if warm and abs(z) > self.z_limit and ts - stats[base + ALERTED] >= self.cooldown:
+                stats[base + ALERTED] = ts
+                found.append((metric, z, mean, std))
+
+            diff = x - mean
+            if warm and abs(diff) > self.gate * std:
+                stats[base + MEAN] = mean + alpha * math.copysign(self.gate * std, diff)
+            else:
+                incr = alpha * diff
+                stats[base + MEAN] = mean + incr
+                stats[base + VAR] = (1.0 - alpha) * (var + diff * incr)
+            stats[base + FAST] = fast
+
+        state.dirty = True
+        return found
+
+    def update(self, rows):
+        """Ingest listener: score a committed batch of row dicts and record anomalies. Needs an app context."""
+        self._restore({row["battery_id"] for row in rows} - self._states.keys())
+
+        faults = []
+        for row in rows:
+            state = self._states[row["battery_id"]]
+            ts = _epoch(row["ts"])
+            # Replayed or out-of-order samples would distort the EWMAs
+            if state.last_ts is not None and ts <= state.last_ts:
+                continue
+            for metric, z, mean, std in self.observe(state, ts, row):
+                faults.append({
+                    "batt_uid": row["battery_id"],
+                    "company_id": row.get("company_id"),
+                    "fault_type": f"{metric.title()} Anomaly",
+                    "severity": "high" if abs(z) >= 2 * self.z_limit else "medium",
+                    "predicted_by": PREDICTED_BY,
+                    "detected_at": datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None),
+                    "note": f"{metric}={row[metric]:.3f}, z={z:.1f} (baseline {mean:.3f} +/- {std:.3f})",
+                })
+        self.samples += len(rows)
+
+        if faults:
+            db.session.execute(insert(BattFaultLog.__table__), faults)
+            db.session.commit()
+            self.anomalies += len(faults)
+            logger.info("Recorded %d anomalies", len(faults))
+
+        if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+        return faults
+
+    # ---------------- CHECKPOINTS ----------------
+    def _restore(self, battery_ids):
+        if not battery_ids:
+            return
+        for s in db.session.query(BattAnomalyState).filter(BattAnomalyState.battery_id.in_(battery_ids)):
+            stats = array("d")
+            stats.frombytes(s.stats)
+            # A checkpoint written with another metric set starts over
+            if len(stats) != WIDTH * len(METRICS):
+                continue
+            last_ts = _epoch(s.last_ts) if s.last_ts is not None else None
+            self._states[s.battery_id] = BatteryState(s.samples, last_ts, stats)
+        for battery_id in battery_ids - self._states.keys():
+            self._states[battery_id] = BatteryState()
+
+    def checkpoint(self):
+        """Write the state of every battery updated since the last checkpoint. Needs an app context."""
+        dirty = [(battery_id, state) for battery_id, state in self._states.items() if state.dirty]
+        self._last_checkpoint = time.monotonic()
+        if not dirty:
+            return 0
+
+        now = datetime.utcnow()
+        values = [{
+            "battery_id": battery_id,
+            "samples": state.samples,
+            "last_ts": datetime.fromtimestamp(state.last_ts, timezone.utc) if state.last_ts is not None else None,
+            "stats": state.stats.tobytes(),
+            "updated_at": now,
+        } for battery_id, state in dirty]
+
+        table = BattAnomalyState.__table__
+        stmt = (pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert)(table)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.battery_id],
+            set_={c: stmt.excluded[c] for c in ("samples", "last_ts", "stats", "updated_at")},
+        ), values)
+        db.session.commit()
+
+        for _, state in dirty:
+            state.dirty = False
+        self.checkpoints += 1
+        return len(values)
+
+    def stop(self):
+        """Write the final checkpoint once ingest has stopped. Needs an app context."""
+        return self.checkpoint()
+
+    def stats(self):
+        return {
+            "batteries": len(self._states),
+            "samples": self.samples,
+            "anomalies": self.anomalies,
+            "checkpoints": self.checkpoints,
+        }
+
+
+anomaly_detector = AnomalyDetector()
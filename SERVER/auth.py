@@ -1,20 +1,109 @@
-
-
-
+"""
+Authentication routes: password login/registration, Google sign-in and
+the token_required decorator used by protected views.
+"""
 import os
-from flask import Blueprint, request, jsonify, url_for, redirect, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, CompanyProfile, TblUser
-import jwt
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
-from flask_dance.contrib.google import make_google_blueprint, google
+from urllib.parse import quote_plus
+
+import jwt
+from authlib.integrations.base_client.errors import MismatchingStateError
+from flask import Blueprint, current_app, jsonify, redirect, request, session
+
+from extensions import oauth
+from identity_cache import identity_cache, resolve_identity
+from metrics import timed
+from models import db, CompanyProfile, TblUser
+from passwords import PASSWORD_RETRY_AFTER, PasswordPoolBusy, hash_password, verify_password
+
+auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
+
+JWT_SECRET = os.getenv('JWT_SECRET', 'dev_secret')
+JWT_EXPIRY_MINUTES = int(os.getenv('JWT_EXPIRY_MINUTES', 60))
+
+_google_lock = threading.Lock()
+
+
+def get_google():
+    """
+    Google OAuth client, registered on first use.
+
+    Registration is local; authlib fetches the discovery document on the
+    first authorize_redirect. Raises RuntimeError without credentials.
+    """
+    with _google_lock:
+        google = oauth.create_client('google')
+        if google is not None:
+            return google
+
+        config = current_app.config
+        if not config.get('GOOGLE_CLIENT_ID') or not config.get('GOOGLE_CLIENT_SECRET'):
+            raise RuntimeError("Google OAuth credentials not configured. Check your .env file.")
+
+        return oauth.register(
+            name='google',
+            client_id=config['GOOGLE_CLIENT_ID'],
+            client_secret=config['GOOGLE_CLIENT_SECRET'],
+            server_metadata_url=config['GOOGLE_DISCOVERY_URL'],
+            client_kwargs={
+                'scope': 'openid email profile',
+                'prompt': 'select_account'  # Always show account selector
+            },
+            authorize_params={
+                'access_type': 'offline'    # Get refresh token
+            }
+        )
+
+
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = None
+
+        # Get the token from Authorization header
+        if "Authorization" in request.headers:
+            parts = request.headers["Authorization"].split()
+            if len(parts) == 2 and parts[0].lower() == "bearer":
+                token = parts[1]
+
+        if not token:
+            return jsonify({"message": "Missing token"}), 401
+
+        try:
+            # ✅ Use JWT_SECRET (not SECRET_KEY)
+            # Verified claims + user/company snapshot, cached per token
+            with timed("auth"):
+                data, current_user = resolve_identity(token, JWT_SECRET)
+            if not current_user:
+                return jsonify({"message": "User not found"}), 404
+
+        except jwt.ExpiredSignatureError:
+            return jsonify({"message": "Token expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"message": "Invalid token"}), 401
+        except Exception as e:
+            return jsonify({"message": f"Token validation failed: {str(e)}"}), 401
+
+        return f(current_user, *args, **kwargs)
 
-auth_bp = Blueprint('auth', __name__)
+    return decorated
 
-JWT_SECRET = os.environ.get('JWT_SECRET', 'dev_secret')
-JWT_EXPIRY_MINUTES = int(os.environ.get('JWT_EXPIRY_MINUTES', 60))
 
+def company_required(f):
+    """token_required for tenant-scoped views: passes the caller's company_id instead of the user."""
+    @token_required
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if current_user.company_id is None:
+            return jsonify({"message": "No company assigned to this user"}), 403
+        return f(current_user.company_id, *args, **kwargs)
+
+    return decorated
+
+
+# ---------------- JWT Helper ----------------
 def create_jwt(user):
     payload = {
         'u_id': user.u_id,
@@ -24,16 +113,45 @@ def create_jwt(user):
     }
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
+
+def password_pool_busy():
+    return (
+        jsonify({'error': 'Server busy, please retry shortly'}),
+        503,
+        {'Retry-After': str(PASSWORD_RETRY_AFTER)},
+    )
+
+
+# ---------------- AUTH ROUTES ----------------
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     user = TblUser.query.filter_by(email=data.get('email')).first()
-    if user and check_password_hash(user.password, data.get('password')):
-        company_info = {
-            "company_id": user.company.company_id,
-            "company_name": user.company.company_name,
-        } if user.company else None
+
+    try:
+        with timed("auth"):
+            valid, new_hash = verify_password(user.password, data.get('password')) if user else (False, None)
+    except PasswordPoolBusy:
+        return password_pool_busy()
+
+    if valid:
         token = create_jwt(user)
+        # Stored hash used outdated parameters; replace it now that we know the password
+        if new_hash:
+            user.password = new_hash
+        user.last_login = datetime.utcnow()
+        db.session.commit()
+
+        company_info = None
+        if user.company:
+            company_info = {
+                "company_id": user.company.company_id,
+                "company_name": user.company.company_name,
+                "email": user.company.email,
+                "is_active": user.company.is_active,
+                "created_at": user.company.created_at.isoformat() if user.company.created_at else None,
+            }
+
         return jsonify({
             'message': 'Login successful',
             'token': token,
@@ -41,63 +159,306 @@ def login():
             'username': user.username,
             'email': user.email,
             'company': company_info
-        })
+        }), 200
+
     return jsonify({'error': 'Invalid credentials'}), 401
 
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No input data provided'}), 400
-    required_fields = ("username", "email", "password", "company_id")
+
+    required_fields = ("username", "email", "password")
     if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing fields'}), 400
-    if TblUser.query.filter((TblUser.username == data['username']) | (TblUser.email == data['email'])).first():
+        return jsonify({'error': 'Missing required fields'}), 400
+
+    if TblUser.query.filter(
+        (TblUser.username == data['username']) | (TblUser.email == data['email'])
+    ).first():
         return jsonify({'error': 'User already exists'}), 409
-    hashed_pw = generate_password_hash(data['password'])
-    user = TblUser()
-    user.username = data['username']
-    user.email = data['email']
-    user.password = hashed_pw
-    user.company_id = data['company_id']
-    user.security_qn = data.get('security_qn')
+
+    try:
+        hashed_pw = hash_password(data['password'])
+    except PasswordPoolBusy:
+        return password_pool_busy()
+
+    # Handle company_id
+    company_id = data.get("company_id")
+    company = None
+    if company_id:
+        company = CompanyProfile.query.get(company_id)
+        if not company:
+            return jsonify({'error': f'Company with ID {company_id} does not exist'}), 400
+    else:
+        company = CompanyProfile(company_name="Default Company", email="default@company.com")
+        db.session.add(company)
+        db.session.flush()
+        company_id = company.company_id
+
+    user = TblUser(
+        username=data['username'],
+        email=data['email'],
+        password=hashed_pw,
+        company_id=company_id,
+        phone=data.get('ph_no'),
+        security_qn=data.get('security_qn'),
+        security_ans=data.get('security_ans'),
+        role=data.get('role', 'user'),
+    )
+
     try:
         db.session.add(user)
         db.session.commit()
         token = create_jwt(user)
+        company_info = {
+            "company_id": company.company_id,
+            "company_name": company.company_name,
+            "email": company.email,
+            "is_active": company.is_active,
+            "created_at": company.created_at.isoformat() if company.created_at else None,
+        }
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Database error', 'details': str(e)}), 500
-    return jsonify({'message': 'User registered successfully', 'token': token}), 201
-
-# --- Google OAuth ---
-GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
-google_bp = make_google_blueprint(
-    client_id=GOOGLE_CLIENT_ID,
-    client_secret=GOOGLE_CLIENT_SECRET,
-    scope=["profile", "email"],
-    redirect_url="/auth/google/callback"
-)
+
+    return jsonify({
+        'message': 'User registered successfully',
+        'token': token,
+        'u_id': user.u_id,
+        'username': user.username,
+        'email': user.email,
+        'company': company_info
+    }), 201
+
 
 @auth_bp.route('/google')
 def google_login():
-    if not google.authorized:
-        return redirect(url_for("google.login"))
-    resp = google.get("/oauth2/v2/userinfo")
-    if not resp.ok:
-        return jsonify({'error': 'Failed to fetch user info from Google'}), 400
-    info = resp.json()
-    email = info.get('email')
+    # Always use the configured redirect URI
+    redirect_uri = os.getenv('OAUTH_REDIRECT_URI')
+    if not redirect_uri:
+        current_app.logger.error('OAUTH_REDIRECT_URI not configured!')
+        return jsonify({"error": "OAuth configuration error"}), 500
+        
+    current_app.logger.info('Starting Google OAuth, redirect_uri=%s', redirect_uri)
+    
+    try:
+        google = get_google()
+    except RuntimeError as e:
+        current_app.logger.error(str(e))
+        return jsonify({"error": "OAuth configuration error"}), 500
+
+    # Clear any existing session data
+    session.clear()
+    
+    # Log request details
+    current_app.logger.info('Request headers: %s', dict(request.headers))
+    current_app.logger.info('Initial session: %s', dict(session))
+    current_app.logger.info('Request cookies: %s', dict(request.cookies))
+    
+    # Create/update session
+    try:
+        session['oauth_initiated'] = True
+        session['oauth_start_time'] = datetime.utcnow().isoformat()
+        session.modified = True
+        current_app.logger.info('Session initialized - oauth_initiated=True, time=%s', session['oauth_start_time'])
+    except Exception as e:
+        current_app.logger.error('Failed to modify session: %s', str(e))
+
+    try:
+        # Get the response with the OAuth redirect
+        resp = google.authorize_redirect(redirect_uri)
+        
+        # Log full response details
+        current_app.logger.info('OAuth redirect response:')
+        current_app.logger.info('Status: %s', resp.status_code)
+        current_app.logger.info('Headers: %s', dict(resp.headers))
+        current_app.logger.info('Updated session after redirect: %s', dict(session))
+        
+        # Add CORS headers that might help with cookie handling
+        resp.headers['Access-Control-Allow-Credentials'] = 'true'
+        origins = current_app.config.get('CORS_ORIGINS', [
+            "http://localhost:5173",
+            "http://localhost:3000",
+            "http://127.0.0.1:5173",
+            "http://127.0.0.1:3000"
+        ])
+        if request.headers.get('Origin') in origins:
+            resp.headers['Access-Control-Allow-Origin'] = request.headers['Origin']
+            
+        return resp
+        
+    except Exception as e:
+        current_app.logger.error('Failed to create OAuth redirect: %s', str(e))
+        raise
+
+
+@auth_bp.route('/google/callback')
+def google_callback():
+    frontend = os.getenv('FRONTEND_URL', 'http://localhost:3000/')
+    
+    # Log full callback request details
+    current_app.logger.info('OAuth callback received:')
+    current_app.logger.info('URL: %s', request.url)
+    current_app.logger.info('Args: %s', request.args.to_dict())
+    current_app.logger.info('Headers: %s', dict(request.headers))
+    current_app.logger.info('Cookies: %s', dict(request.cookies))
+    
+    # Get the state and code from the request
+    callback_state = request.args.get('state')
+    callback_code = request.args.get('code')
+    
+    if not callback_state or not callback_code:
+        current_app.logger.error('Missing state or code in callback')
+        return redirect(f"{frontend}/qauth?error=invalid_callback")
+    
+    try:
+        google = get_google()
+    except RuntimeError as e:
+        current_app.logger.error(str(e))
+        return redirect(f"{frontend}/qauth?error=auth_failed")
+
+    try:
+        # First attempt - try normal flow
+        token = google.authorize_access_token()
+        current_app.logger.info('Successfully obtained token through normal flow')
+    except MismatchingStateError as mse:
+        current_app.logger.warning('Initial state mismatch, attempting recovery...')
+        
+        try:
+            # Clear any existing session
+            session.clear()
+            # Set the received state
+            session['oauth_state'] = callback_state
+            # Force session save
+            session.modified = True
+            
+            # Try to authorize again
+            token = google.authorize_access_token()
+            current_app.logger.info('Successfully recovered from state mismatch')
+        except Exception as e:
+            current_app.logger.error('Recovery failed: %s', str(e))
+            
+            # If we're in development, try one last time with a fresh session
+            if os.getenv('OAUTH_DEV_FALLBACK', 'False').lower() == 'true':
+                try:
+                    # Clear session and try one more time
+                    session.clear()
+                    session['oauth_state'] = callback_state
+                    session.modified = True
+                    
+                    token = google.authorize_access_token()
+                    current_app.logger.info('Dev fallback succeeded')
+                except Exception as e:
+                    current_app.logger.error('Dev fallback failed: %s', str(e))
+                    # Instead of redirecting to a new OAuth flow, redirect with the error
+                    return redirect(f"{frontend}/qauth?error=auth_failed&message={str(e)}")
+            else:
+                return redirect(f"{frontend}/qauth?error=auth_failed&message={str(e)}")
+
+    if not token:
+        return jsonify({"error": "Failed to get access token"}), 400
+
+    try:
+        userinfo = token.get('userinfo')
+        if not userinfo:
+            # Fallback to parsing ID token if userinfo not available
+            userinfo = google.parse_id_token(token, nonce=session.get('nonce'))
+        if not userinfo:
+            return jsonify({"error": "Failed to get user info"}), 400
+    except Exception as e:
+        current_app.logger.error(f"Failed to parse user info: {str(e)}")
+        return jsonify({"error": "Failed to parse user info"}), 400
+
+    email = str(userinfo.get('email', ''))
+    if not email:
+        return jsonify({"error": "No email in user info"}), 400
+
+    name = str(userinfo.get('name', ''))
+    username = name if name else email.split('@')[0]
+
+    user = TblUser.query.filter_by(email=email).first()
+
+    if user:
+        access_token = create_jwt(user)
+        # ✅ Send user back to frontend OAuth success route
+        redirect_url = f"http://localhost:3000/oauth-callback?token={quote_plus(access_token)}"
+        current_app.logger.info(f"Redirecting existing user to: {redirect_url}")
+        return redirect(redirect_url)
+    else:
+        # ✅ Redirect to register page with prefilled info
+        redirect_url = f"http://localhost:3000/register?email={quote_plus(email)}&name={quote_plus(username)}"
+        current_app.logger.info(f"Redirecting new user to: {redirect_url}")
+        return redirect(redirect_url)
+
+
+@auth_bp.route("/check-email", methods=["GET"])
+def check_email():
+    email = request.args.get("email")
+    if not email:
+        return jsonify({"error": "Email required"}), 400
+    user = TblUser.query.filter_by(email=email).first()
+    if user:
+        return jsonify({"exists": True, "user": {"u_id": user.u_id, "username": user.username, "email": user.email}}), 200
+    return jsonify({"exists": False}), 200
+
+
+@auth_bp.route("/forgot-password", methods=["POST"])
+def forgot_password():
+    data = request.get_json()
+    email = data.get("email")
+    if not email:
+        return jsonify({"error": "Email is required"}), 400
+
     user = TblUser.query.filter_by(email=email).first()
     if not user:
-        # Auto-register user with Google info (no password)
-        user = TblUser()
-        user.username = info.get('name', email)
-        user.email = email
-        user.password = generate_password_hash(os.urandom(16).hex())
-        user.company_id = None
-        db.session.add(user)
-        db.session.commit()
-    token = create_jwt(user)
-    return jsonify({'message': 'Google login successful', 'token': token, 'email': email, 'username': user.username})
\ No newline at end of file
+        return jsonify({"error": "User not found"}), 404
+
+    return jsonify({"security_qn": user.security_qn}), 200
+
+
+@auth_bp.route("/reset-password", methods=["POST"])
+def reset_password():
+    data = request.get_json()
+    email = data.get("email")
+    answer = data.get("security_ans")
+    new_password = data.get("new_password")
+
+    if not all([email, answer, new_password]):
+        return jsonify({"error": "All fields are required"}), 400
+
+    user = TblUser.query.filter_by(email=email).first()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    if user.security_ans.strip().lower() != answer.strip().lower():
+        return jsonify({"error": "Incorrect security answer"}), 400
+
+    try:
+        user.password = hash_password(new_password)
+    except PasswordPoolBusy:
+        return password_pool_busy()
+    db.session.commit()
+    # The update hook already does this; be explicit for password changes
+    identity_cache.invalidate_user(user.u_id)
+    return jsonify({"message": "Password reset successful"}), 200
+
+@auth_bp.route("/me", methods=["GET"])
+@token_required
+def get_me(current_user):
+    """Return current logged-in user details"""
+    return jsonify({
+        "u_id": current_user.u_id,
+        "username": current_user.username,
+        "email": current_user.email,
+        "ph_no": current_user.phone,
+        "role": current_user.role,
+        "security_qn": current_user.security_qn,
+        "ip": request.remote_addr,
+        "company": {
+            "company_name": current_user.company_name,
+            "email": current_user.company_email,
+            "is_active": current_user.company_is_active,
+        } if current_user.company_name is not None else None,
+    })
@@ -0,0 +1,9 @@
+"""
+Benchmarks for the server's hot paths.
+
+  python -m benchmarks.generate   synthetic fleet data into DATABASE_URL
+  python -m benchmarks.run        time the endpoints, write a JSON result file
+  python -m benchmarks.compare    diff two result files, fail on regressions
+
+Run from the SERVER directory.
+"""
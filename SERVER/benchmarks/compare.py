@@ -0,0 +1,77 @@
+"""
+Compare two benchmark result files.
+
+A scenario regresses when a latency percentile grows, or rows per second
+or peak RSS gets worse, by more than `--threshold` (a fraction) relative
+to the baseline. Exits 1 when anything regressed, so CI can gate on it.
+
+Run with:  python -m benchmarks.compare baseline.json current.json
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.run import RESULT_SCHEMA
+
+# metric path -> True when bigger is worse
+METRICS = {
+    ("latency_ms", "p50"): True,
+    ("latency_ms", "p95"): True,
+    ("latency_ms", "p99"): True,
+    ("rows_per_sec",): False,
+    ("peak_rss_mb",): True,
+    ("import_ms", "p50"): True,
+    ("create_app_ms", "p50"): True,
+    ("first_request_ms", "p50"): True,
+}
+
+
+def _lookup(result, path):
+    for key in path:
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(baseline, current, threshold=0.10):
+    """Return (rows, regressed); each row is (scenario, metric, old, new, change, worse)."""
+    for report in (baseline, current):
+        if report.get("schema") != RESULT_SCHEMA:
+            raise ValueError(f"Unsupported result schema: {report.get('schema')}")
+
+    rows, regressed = [], False
+    for name, result in current["results"].items():
+        old_result = baseline["results"].get(name)
+        if old_result is None:
+            continue
+        for path, bigger_is_worse in METRICS.items():
+            old, new = _lookup(old_result, path), _lookup(result, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if bigger_is_worse else change < -threshold
+            regressed |= worse
+            rows.append((name, ".".join(path), old, new, change, worse))
+    return rows, regressed
+
+
+# ---------------- RUN COMPARISON ----------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative change")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline["dataset"].get("rows") != current["dataset"].get("rows"):
+        print("warning: datasets differ, results may not be comparable", file=sys.stderr)
+
+    rows, regressed = compare(baseline, current, args.threshold)
+    for name, metric, old, new, change, worse in rows:
+        flag = "REGRESSION" if worse else ""
+        print(f"{name:<26} {metric:<16} {old:>12.2f} -> {new:>12.2f}  {change:>+7.1%}  {flag}")
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,245 @@
+"""
+Synthetic fleet data for benchmarks.
+
+Writes a company, a product, `--batteries` batteries and a login user, then
+`--days` of telemetry per battery at `--hz` samples per second, plus fault
+and health history. Each battery cycles between discharge and charge, so
+voltage, current and temperature move the way a real pack does, with
+sensor noise and the occasional spike for the fault rules to find.
+
+Everything is derived from `--seed`, so the same arguments always produce
+the same dataset.
+
+Run with:  python -m benchmarks.generate --batteries 50 --days 2 --hz 1
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from ingest import copy_rows, insert_rows
+from models import db, BattDescription, BattFaultLog, BattHealth, CompanyProfile, Product, TblUser
+from schema import create_schema, ensure_partitions, is_postgres
+
+logger = logging.getLogger("bms.bench")
+
+BENCH_COMPANY = "Benchmark Fleet"
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+# Rows per INSERT/COPY batch
+CHUNK_ROWS = 50000
+
+FAULT_TYPES = (
+    ("High Voltage", "high"),
+    ("Low Voltage", "high"),
+    ("Overheating", "critical"),
+    ("High Current", "high"),
+    ("Voltage Slew", "medium"),
+    ("Temperature Rise", "high"),
+    ("Sensor Stuck", "low"),
+)
+
+
+def bench_app(database_url):
+    """Bare Flask app bound to `database_url`: just the models, none of main.py's blueprints or hooks."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+# ---------------- SIGNALS ----------------
+def battery_signals(rng, t, capacity_ah=100.0, nominal_v=12.8):
+    """
+    Voltage, current and temperature for sample times `t` (seconds from start).
+
+    Current is positive while discharging. A cycle is a constant-current
+    discharge followed by a charge at twice the rate.
+    """
+    discharge_a = rng.uniform(5, 25)
+    cycle = 1.5 * capacity_ah * 0.8 / discharge_a * 3600
+    phase = (t + rng.uniform(0, cycle)) % cycle
+    discharging = phase < cycle / 1.5
+
+    current = np.where(discharging, discharge_a, -2 * discharge_a)
+    depth = np.where(discharging, phase / (cycle / 1.5), 1 - (phase - cycle / 1.5) / (cycle / 3))
+    soc = 0.95 - 0.8 * depth
+
+    voltage = nominal_v * (0.94 + 0.1 * soc) - 0.01 * current
+    temperature = 25 + 3 * np.sin(2 * np.pi * t / 86400) + 0.004 * current ** 2
+
+    voltage += rng.normal(0, 0.01, t.size)
+    current += rng.normal(0, 0.05, t.size)
+    temperature += rng.normal(0, 0.05, t.size)
+
+    # Rare spikes so the fault rules have something to report
+    spikes = rng.random(t.size) < 1e-5
+    voltage[spikes] += rng.choice([-3.0, 3.0], spikes.sum())
+
+    return np.round(voltage, 3), np.round(current, 3), np.round(temperature, 3)
+
+
+def telemetry_rows(battery_id, company_id, start, t, voltage, current, temperature):
+    device_id = f"dev-{battery_id}"
+    base = start.timestamp()
+    rows = []
+    for offset, v, i, temp in zip(t.tolist(), voltage.tolist(), current.tolist(), temperature.tolist()):
+        ts = datetime.fromtimestamp(base + offset, timezone.utc)
+        rows.append({
+            "ts": ts,
+            "device_id": device_id,
+            "battery_id": battery_id,
+            "company_id": company_id,
+            "voltage": v,
+            "current": i,
+            "temperature": temp,
+            "payload_json": {"battery_id": battery_id, "v": v, "i": i, "t": temp},
+        })
+    return rows
+
+
+def fault_rows(rng, battery_id, company_id, start, days, per_day):
+    count = rng.poisson(per_day * days)
+    offsets = np.sort(rng.uniform(0, days * 86400, count))
+    faults = []
+    for offset in offsets.tolist():
+        fault_type, severity = FAULT_TYPES[rng.integers(len(FAULT_TYPES))]
+        resolved = rng.random() < 0.6
+        faults.append({
+            "batt_uid": battery_id,
+            "company_id": company_id,
+            "fault_type": fault_type,
+            "severity": severity,
+            "predicted_by": "rules",
+            "detected_at": (start + timedelta(seconds=offset)).replace(tzinfo=None),
+            "resolve_text": "Inspected and cleared" if resolved else None,
+            "note": f"synthetic {fault_type.lower()}",
+        })
+    return faults
+
+
+def health_rows(battery_id, t, voltage, current, temperature, every):
+    step = max(1, int(np.searchsorted(t, every)))
+    rows = []
+    for k in range(0, t.size, step):
+        soc = float(np.clip((voltage[k] / 12.8 - 0.94) / 0.1, 0, 1))
+        remaining = timedelta(hours=soc * 100 / current[k]) if current[k] > 0.5 else None
+        rows.append({
+            "batt_uid": battery_id,
+            "batt_volt": float(voltage[k]),
+            "batt_current": float(current[k]),
+            "batt_temp": float(temperature[k]),
+            "soc": round(soc * 100, 2),
+            "batt_remaining_time": remaining,
+            "batt_severity": "critical" if soc < 0.1 else "normal",
+        })
+    return rows
+
+
+# ---------------- FLEET ----------------
+def ensure_fleet(batteries, first_battery):
+    """Company, product, batteries and the login user; reused when already present. Returns the company id."""
+    company = CompanyProfile.query.filter_by(company_name=BENCH_COMPANY).first()
+    if company is None:
+        company = CompanyProfile(company_name=BENCH_COMPANY, email=BENCH_EMAIL)
+        db.session.add(company)
+        db.session.flush()
+
+    product = Product.query.filter_by(company_id=company.company_id).first()
+    if product is None:
+        product = Product(company_id=company.company_id, total_capacity=100, total_voltage=12.8,
+                          no_of_batt=batteries, batt_type="LiFePO4")
+        db.session.add(product)
+        db.session.flush()
+
+    for battery_id in range(first_battery, first_battery + batteries):
+        if db.session.get(BattDescription, battery_id) is None:
+            db.session.add(BattDescription(
+                batt_uid=battery_id, product_sl_no=product.product_sl_no,
+                batt_voltage=12.8, batt_capacity=100, status="active",
+            ))
+
+    if TblUser.query.filter_by(email=BENCH_EMAIL).first() is None:
+        db.session.add(TblUser(
+            username="bench", email=BENCH_EMAIL, role="admin", company_id=company.company_id,
+            password=generate_password_hash(BENCH_PASSWORD),
+        ))
+    db.session.commit()
+    return company.company_id
+
+
+def generate(batteries=10, days=1.0, hz=1.0, start=None, first_battery=1000, seed=42,
+             faults_per_day=2.0, health_every=3600):
+    """Write the synthetic dataset; returns row counts. Must run inside an app context."""
+    start = start or datetime(2024, 1, 1, tzinfo=timezone.utc)
+    started = time.perf_counter()
+
+    create_schema()
+    ensure_partitions(since=start)
+    company_id = ensure_fleet(batteries, first_battery)
+    write = copy_rows if is_postgres() else insert_rows
+
+    counts = {"mqtt_data": 0, "batt_fault_log": 0, "batt_health": 0}
+    samples = int(days * 86400 * hz)
+
+    for battery_id in range(first_battery, first_battery + batteries):
+        rng = np.random.default_rng([seed, battery_id])
+        t = np.arange(samples) / hz
+        voltage, current, temperature = battery_signals(rng, t)
+
+        for lo in range(0, samples, CHUNK_ROWS):
+            hi = min(lo + CHUNK_ROWS, samples)
+            write(telemetry_rows(battery_id, company_id, start,
+                                 t[lo:hi], voltage[lo:hi], current[lo:hi], temperature[lo:hi]))
+        counts["mqtt_data"] += samples
+
+        faults = fault_rows(rng, battery_id, company_id, start, days, faults_per_day)
+        health = health_rows(battery_id, t, voltage, current, temperature, health_every)
+        if faults:
+            db.session.execute(BattFaultLog.__table__.insert(), faults)
+        if health:
+            db.session.execute(BattHealth.__table__.insert(), health)
+        db.session.commit()
+        counts["batt_fault_log"] += len(faults)
+        counts["batt_health"] += len(health)
+        logger.info("Battery %d: %d samples, %d faults", battery_id, samples, len(faults))
+
+    counts["seconds"] = round(time.perf_counter() - started, 3)
+    return counts
+
+
+# ---------------- RUN GENERATOR ----------------
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    parser = argparse.ArgumentParser(description="Generate a synthetic battery fleet")
+    parser.add_argument("--database-url", default=os.getenv('DATABASE_URL'))
+    parser.add_argument("--batteries", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1.0)
+    parser.add_argument("--hz", type=float, default=1.0, help="samples per second per battery")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first sample (ISO 8601, UTC)")
+    parser.add_argument("--first-battery", type=int, default=1000)
+    parser.add_argument("--faults-per-day", type=float, default=2.0)
+    parser.add_argument("--health-every", type=float, default=3600, help="seconds between batt_health rows")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+    start = args.start.replace(tzinfo=args.start.tzinfo or timezone.utc) if args.start else None
+
+    with bench_app(args.database_url).app_context():
+        print(generate(
+            batteries=args.batteries, days=args.days, hz=args.hz, start=start,
+            first_battery=args.first_battery, seed=args.seed,
+            faults_per_day=args.faults_per_day, health_every=args.health_every,
+        ))
@@ -0,0 +1,290 @@
+"""
+Endpoint benchmarks.
+
+Each scenario runs in its own spawned process against the real Flask app
+(through its test client, so no network noise), so peak RSS is measured
+per scenario rather than for the whole run. A scenario makes `--warmup`
+untimed requests, then `--iterations` timed ones, and reports latency
+percentiles, rows per second and peak RSS.
+
+The cold_start scenario runs in a fresh interpreter each time and times
+importing main, create_app() and the first request separately.
+
+Results are written as JSON (RESULT_SCHEMA) for benchmarks.compare.
+
+Run with:  python -m benchmarks.run [--scenario NAME] [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from benchmarks.generate import BENCH_EMAIL, BENCH_PASSWORD
+
+RESULT_SCHEMA = 1
+PERCENTILES = (50, 90, 95, 99)
+
+
+def _json_rows(body):
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get("data", [])
+    return len(data)
+
+
+def _csv_rows(body):
+    return max(body.count(b"\n") - 1, 0)
+
+
+def scenarios(battery_id, start, end):
+    """name -> request spec; `rows` counts the rows in a response body, `auth` sends the bench user's token."""
+    window = {"battery_id": battery_id, "start": start, "end": end}
+    return {
+        "get_datalogs": {
+            "method": "GET", "path": "/api/datalogs", "params": window, "rows": _json_rows, "auth": True,
+        },
+        "get_datalogs_page": {
+            "method": "GET", "path": "/api/datalogs",
+            "params": dict(window, limit=500), "rows": _json_rows, "auth": True,
+        },
+        "get_fault_logs": {
+            "method": "GET", "path": "/api/fault-logs", "params": {}, "rows": _json_rows, "auth": True,
+        },
+        "get_fault_logs_summary": {
+            "method": "GET", "path": "/api/fault-logs/summary", "params": {},
+            "rows": lambda body: json.loads(body)["total"], "auth": True,
+        },
+        "download_fault_logs_csv": {
+            "method": "GET", "path": "/api/fault-logs/csv", "params": {}, "rows": _csv_rows, "auth": True,
+        },
+        "login": {
+            "method": "POST", "path": "/api/auth/login",
+            "json": {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}, "rows": lambda body: 1,
+        },
+    }
+
+
+def _summary(ms):
+    ms = np.asarray(ms, dtype=np.float64)
+    summary = {"min": ms.min(), "mean": ms.mean(), "max": ms.max()}
+    summary.update({f"p{p}": np.percentile(ms, p) for p in PERCENTILES})
+    return {k: round(float(v), 3) for k, v in summary.items()}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_scenario(name, settings):
+    """Child-process entry point: time one scenario and return its result dict."""
+    from main import create_app
+    from passwords import hash_pool
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": settings["database_url"]})
+    spec = scenarios(settings["battery_id"], settings["start"], settings["end"])[name]
+    client = app.test_client()
+
+    headers = {"Authorization": f"Bearer {settings['token']}"} if spec.get("auth") else {}
+
+    def call():
+        response = client.open(spec["path"], method=spec["method"], headers=headers,
+                               query_string=spec.get("params"), json=spec.get("json"))
+        body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{name}: HTTP {response.status_code}: {body[:200]!r}")
+        return body
+
+    latencies, rows, size = [], 0, 0
+    try:
+        for _ in range(settings["warmup"]):
+            call()
+        baseline_rss = _peak_rss_mb()
+
+        for _ in range(settings["iterations"]):
+            started = time.perf_counter()
+            body = call()
+            latencies.append(time.perf_counter() - started)
+            rows = spec["rows"](body)
+            size = len(body)
+    finally:
+        # A multiprocessing child joins its children before atexit would stop the pool
+        hash_pool.shutdown()
+
+    ms = np.array(latencies) * 1000
+    return {
+        "iterations": len(latencies),
+        "latency_ms": _summary(ms),
+        "rows": rows,
+        "bytes": size,
+        "rows_per_sec": round(rows / (ms.mean() / 1000), 1) if rows else 0.0,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "warm_rss_mb": round(baseline_rss, 1),
+    }
+
+
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from main import create_app
+imported = time.perf_counter()
+app = create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[2], headers={"Authorization": "Bearer " + sys.argv[3]})
+response.get_data()
+done = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (done - created) * 1000,
+}))
+"""
+
+
+def run_cold_start(settings, runs):
+    """Import, create_app() and first-request latency, each in a new interpreter."""
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    url = f"/api/datalogs?battery_id={settings['battery_id']}&limit=1"
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, settings["database_url"], url, settings["token"]],
+            cwd=server_dir, check=True, capture_output=True, text=True,
+        ).stdout
+        sample = json.loads(out.strip().splitlines()[-1])
+        if sample["status"] != 200:
+            raise RuntimeError(f"cold_start: HTTP {sample['status']}")
+        samples.append(sample)
+
+    return {
+        "iterations": runs,
+        **{key: _summary([s[key] for s in samples]) for key in ("import_ms", "create_app_ms", "first_request_ms")},
+    }
+
+
+def dataset_info(database_url, window_hours):
+    """Row counts plus the battery and time window the datalog scenarios read."""
+    from sqlalchemy import create_engine, func, select
+    from models import BattFaultLog, BattHealth, MqttData, TblUser
+
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        counts = {
+            table.__tablename__: conn.execute(select(func.count()).select_from(table)).scalar()
+            for table in (MqttData, BattFaultLog, BattHealth)
+        }
+        battery_id = conn.execute(select(func.min(MqttData.battery_id))).scalar()
+        first_ts = conn.execute(
+            select(func.min(MqttData.ts)).where(MqttData.battery_id == battery_id)
+        ).scalar()
+        user = conn.execute(
+            select(TblUser.u_id, TblUser.username, TblUser.email).where(TblUser.email == BENCH_EMAIL)
+        ).first()
+    engine.dispose()
+
+    if first_ts is None or user is None:
+        raise SystemExit("mqtt_data is empty; run python -m benchmarks.generate first")
+    first_ts = first_ts.replace(tzinfo=None)
+    return {
+        "dialect": engine.dialect.name,
+        "rows": counts,
+        "battery_id": battery_id,
+        "start": first_ts.isoformat(),
+        "end": (first_ts + timedelta(hours=window_hours)).isoformat(),
+        "user": user,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(database_url, names=None, iterations=20, warmup=3, window_hours=24, cold_starts=5):
+    from auth import create_jwt
+
+    dataset = dataset_info(database_url, window_hours)
+    settings = {
+        "database_url": database_url,
+        "iterations": iterations,
+        "warmup": warmup,
+        "battery_id": dataset["battery_id"],
+        "start": dataset["start"],
+        "end": dataset["end"],
+        # Minted once so scenarios (and cold starts) time their own request, not a login
+        "token": create_jwt(dataset.pop("user")),
+    }
+    names = names or list(scenarios(None, None, None))
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        # Not multiprocessing.Pool: its daemonic workers cannot start the password hash pool
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[name] = pool.submit(_run_scenario, name, settings).result()
+        latency = results[name]["latency_ms"]
+        print(f"{name:<26} p50 {latency['p50']:>9.2f} ms  p99 {latency['p99']:>9.2f} ms  "
+              f"{results[name]['rows_per_sec']:>12.0f} rows/s  {results[name]['peak_rss_mb']:>7.1f} MB",
+              file=sys.stderr)
+
+    if cold_starts:
+        results["cold_start"] = run_cold_start(settings, cold_starts)
+        print(f"{'cold_start':<26} import p50 {results['cold_start']['import_ms']['p50']:.1f} ms  "
+              f"first request p50 {results['cold_start']['first_request_ms']['p50']:.1f} ms", file=sys.stderr)
+
+    return {
+        "schema": RESULT_SCHEMA,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "dataset": dataset,
+        "settings": {
+            "iterations": iterations, "warmup": warmup, "window_hours": window_hours, "cold_starts": cold_starts,
+        },
+        "results": results,
+    }
+
+
+# ---------------- RUN BENCHMARKS ----------------
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark the server's hot endpoints")
+    parser.add_argument("--database-url", default=os.getenv('DATABASE_URL'))
+    parser.add_argument("--scenario", action="append", choices=list(scenarios(None, None, None)))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--window-hours", type=float, default=24, help="time range read by get_datalogs")
+    parser.add_argument("--cold-starts", type=int, default=5, help="fresh-interpreter startups to time (0 skips)")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    report = run(args.database_url, args.scenario, args.iterations, args.warmup, args.window_hours,
+                 args.cold_starts)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
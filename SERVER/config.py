@@ -0,0 +1,68 @@
+import os
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+# Before anything reads os.environ at import time
+load_dotenv()
+
+# Connection pool per process; size it so processes x (size + overflow)
+# stays under Postgres max_connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+# Server-side cap on any one statement (Postgres only); 0 disables
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for `database_url` from the DB_* settings."""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if not database_url or database_url.startswith("sqlite"):
+        return options
+
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if database_url.startswith("postgres") and DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+class Config:
+    """Defaults for create_app(); values come from the environment (.env)."""
+
+    SECRET_KEY = os.getenv('SECRET_KEY', 'secret!')
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Session cookie settings
+    SESSION_COOKIE_SAMESITE = os.getenv('SESSION_COOKIE_SAMESITE', 'Lax')
+    SESSION_COOKIE_SECURE = os.getenv('SESSION_COOKIE_SECURE', 'False').lower() == 'true'
+    SESSION_COOKIE_HTTPONLY = True
+    # Make cookies work with OAuth flow
+    SESSION_COOKIE_PATH = '/'
+    # Increase session lifetime for OAuth flow
+    PERMANENT_SESSION_LIFETIME = timedelta(minutes=5)
+    # Session key prefix to avoid conflicts
+    SESSION_KEY_PREFIX = 'bms_auth_'
+
+    CORS_ORIGINS = [
+        os.getenv("CORS_ORIGIN1", "http://localhost:5173"),
+        os.getenv("CORS_ORIGIN2", "http://localhost:3000"),
+        os.getenv("CORS_ORIGIN3", "http://127.0.0.1:5173"),
+        os.getenv("CORS_ORIGIN4", "http://127.0.0.1:3000"),
+    ]
+
+    # Google OAuth; the client is registered on the first /api/auth/google hit
+    GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+    GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
+    GOOGLE_DISCOVERY_URL = os.getenv(
+        'GOOGLE_DISCOVERY_URL',
+        "https://accounts.google.com/.well-known/openid-configuration"
+    )
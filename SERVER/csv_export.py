@@ -0,0 +1,41 @@
+"""Streaming CSV exports shared by the telemetry and fault-log blueprints."""
+import csv
+import os
+from io import StringIO
+
+from flask import Response, stream_with_context
+
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', 5000))
+
+
+def stream_csv(query, columns, filename):
+    """
+    Stream a query as CSV without materializing it.
+
+    Rows come off a server-side cursor CSV_CHUNK_SIZE at a time as plain
+    tuples, and each chunk is flushed to the client as soon as it is written.
+    """
+    rows = (
+        query.with_entities(*[col for _, col in columns])
+        .execution_options(yield_per=CSV_CHUNK_SIZE)
+    )
+
+    def generate():
+        si = StringIO()
+        writer = csv.writer(si)
+        writer.writerow([name for name, _ in columns])
+
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % CSV_CHUNK_SIZE == 0:
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate(0)
+
+        yield si.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
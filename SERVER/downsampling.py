@@ -0,0 +1,185 @@
+from datetime import datetime
+import math
+import os
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
+
+from fastjson import timestamp_text
+from models import MqttData
+
+# Upper bound on points per battery a chart request may ask for
+DATALOG_MAX_POINTS = int(os.getenv('DATALOG_MAX_POINTS', 5000))
+# How many SQL buckets LTTB gets to choose from per output point
+LTTB_OVERSAMPLE = int(os.getenv('LTTB_OVERSAMPLE', 4))
+
+METRICS = ("voltage", "current", "temperature")
+
+# Bucket widths (seconds) we snap to, so charts get round time steps
+NICE_STEPS = (
+    1, 2, 5, 10, 15, 30,
+    60, 120, 300, 600, 900, 1800,
+    3600, 7200, 10800, 21600, 43200,
+    86400, 172800, 604800,
+)
+
+_UNITS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hr": 3600, "d": 86400, "day": 86400}
+
+
+def parse_resolution(value):
+    """Parse '30s', '5min', '1h', '1d' or a plain number of seconds."""
+    if value is None or value == "":
+        return None
+    value = str(value).strip().lower()
+    if value.isdigit():
+        seconds = int(value)
+    else:
+        digits = value.rstrip("abcdefghijklmnopqrstuvwxyz")
+        unit = value[len(digits):]
+        if not digits.isdigit() or unit not in _UNITS:
+            raise ValueError(f"Invalid resolution: {value}")
+        seconds = int(digits) * _UNITS[unit]
+    if seconds <= 0:
+        raise ValueError(f"Invalid resolution: {value}")
+    return seconds
+
+
+def pick_bucket_seconds(start, end, max_points):
+    """Smallest 'nice' bucket width that keeps (end - start) under max_points buckets."""
+    span = max((end - start).total_seconds(), 1)
+    target = span / max(max_points, 1)
+    for step in NICE_STEPS:
+        if step >= target:
+            return step
+    return int(math.ceil(target / 86400)) * 86400
+
+
+def _as_float(value):
+    return float(value) if value is not None else None
+
+
+def bucketed_datalogs(query, bucket_seconds):
+    """
+    Aggregate a filtered MqttData query into per-battery time buckets.
+
+    Runs as one GROUP BY in Postgres and returns min/max/avg/last of every
+    metric for each (battery, bucket) pair, ordered by battery then time.
+    """
+    # Inline the width so SELECT and GROUP BY render the identical expression
+    width = literal_column(str(int(bucket_seconds)))
+    bucket = func.to_timestamp(
+        func.floor(func.extract("epoch", MqttData.ts) / width) * width
+    ).label("bucket")
+
+    columns = [MqttData.battery_id, bucket, func.count().label("count")]
+    for name in METRICS:
+        col = getattr(MqttData, name)
+        columns += [
+            func.min(col).label(f"{name}_min"),
+            func.max(col).label(f"{name}_max"),
+            func.avg(col).label(f"{name}_avg"),
+            array_agg(aggregate_order_by(col, MqttData.ts.desc()))[1].label(f"{name}_last"),
+        ]
+
+    rows = (
+        query.with_entities(*columns)
+        .order_by(None)
+        .group_by(MqttData.battery_id, bucket)
+        .order_by(MqttData.battery_id, bucket)
+        .all()
+    )
+
+    data = []
+    for row in rows:
+        item = {
+            "timestamp": timestamp_text(row.bucket),
+            "batteryId": str(row.battery_id),
+            "count": row.count,
+        }
+        for name in METRICS:
+            for agg in ("min", "max", "avg", "last"):
+                key = f"{name}_{agg}"
+                item[key] = _as_float(getattr(row, key))
+        data.append(item)
+    return data
+
+
+def lttb_indices(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Takes x/y sequences sorted by x and returns the indices of at most
+    `threshold` points that best preserve the visual shape of the series.
+    The first and last points are always kept; with a threshold of 1 only
+    the last one.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][-threshold:] if threshold > 0 else []
+
+    indices = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        range_start = int(math.floor(i * every)) + 1
+        range_end = int(math.floor((i + 1) * every)) + 1
+
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+
+        indices.append(next_a)
+        a = next_a
+
+    indices.append(n - 1)
+    return indices
+
+
+def lttb_datalogs(buckets, max_points, field="voltage"):
+    """
+    Reduce bucketed rows to `max_points` per battery with LTTB on `<field>_avg`.
+
+    Buckets without a value for `field` are not scored. Where kept points
+    span such buckets, the first of them is kept too, so the chart shows a
+    gap instead of a line across it; a series with gaps gets half the
+    points to leave room for them.
+    """
+    if field not in METRICS:
+        raise ValueError(f"Invalid lttb field: {field}")
+    key = f"{field}_avg"
+
+    by_battery = {}
+    for item in buckets:
+        by_battery.setdefault(item["batteryId"], []).append(item)
+
+    data = []
+    for items in by_battery.values():
+        valid = [i for i, item in enumerate(items) if item[key] is not None]
+        threshold = max_points if len(valid) == len(items) else (max_points + 1) // 2
+        xs = [datetime.fromisoformat(items[i]["timestamp"]).timestamp() for i in valid]
+        ys = [items[i][key] for i in valid]
+        keep = [valid[j] for j in lttb_indices(xs, ys, threshold)]
+
+        chosen = []
+        for prev, i in zip([-1] + keep, keep):
+            gap = next((g for g in range(prev + 1, i) if items[g][key] is None), None)
+            if gap is not None and prev >= 0 and len(chosen) + 2 <= max_points:
+                chosen.append(gap)
+            chosen.append(i)
+        data.extend(items[i] for i in chosen)
+    return data
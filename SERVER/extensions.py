@@ -0,0 +1,7 @@
+import os
+
+from authlib.integrations.flask_client import OAuth
+from flask_socketio import SocketIO
+
+socketio = SocketIO(async_mode=os.getenv('SOCKETIO_ASYNC_MODE') or None)
+oauth = OAuth()
@@ -0,0 +1,46 @@
+"""
+JSON responses for large payloads.
+
+Uses orjson when it is installed (serializes datetimes natively and is an
+order of magnitude faster than flask.jsonify on big lists), falling back to
+the standard library otherwise.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response
+
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat(timespec="seconds")
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def timestamp_text(ts):
+    """The API's timestamp format: 'YYYY-MM-DD HH:MM:SS', plus the offset for aware datetimes."""
+    return ts.isoformat(sep=" ", timespec="seconds") if ts is not None else None
+
+
+def dumps(obj):
+    """Serialize to UTF-8 bytes."""
+    with timed("serialize"):
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_OMIT_MICROSECONDS)
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype="application/json")
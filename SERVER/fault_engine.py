@@ -0,0 +1,303 @@
+"""
+Batch fault detection over mqtt_data.
+
+Each battery is scanned from its checkpoint in windows of FAULT_WINDOW_ROWS
+samples. A window is loaded as NumPy arrays and every rule is evaluated
+with array operations (no per-sample Python). Consecutive violating samples
+collapse into one fault at the start of the run. A short tail of the
+previous window is carried over so rate and stuck-at rules see across
+window edges without reporting a run twice.
+
+Batteries are independent, so a backfill fans out over a process pool;
+workers talk to the database through plain SQLAlchemy Core and never import
+the Flask app.
+
+Run with:  python fault_engine.py [--workers N] [--battery ID]
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import Float, cast, create_engine, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import BattDescription, BattFaultLog, FaultScanCheckpoint, MqttData
+from tenants import battery_company_query
+
+logger = logging.getLogger("bms.faults")
+
+FAULT_WINDOW_ROWS = int(os.getenv('FAULT_WINDOW_ROWS', 200000))
+FAULT_WORKERS = int(os.getenv('FAULT_WORKERS', os.cpu_count() or 1))
+PREDICTED_BY = "rules"
+
+# Rule set; override any part with a JSON object in FAULT_RULES
+DEFAULT_RULES = {
+    "over_voltage": {"fault_type": "High Voltage", "severity": "high", "metric": "voltage", "max": 14.6},
+    "under_voltage": {"fault_type": "Low Voltage", "severity": "high", "metric": "voltage", "min": 10.5},
+    "over_temperature": {"fault_type": "Overheating", "severity": "critical", "metric": "temperature", "max": 60.0},
+    "overcurrent": {"fault_type": "High Current", "severity": "high", "metric": "current", "abs_max": 100.0},
+    "dv_dt": {"fault_type": "Voltage Slew", "severity": "medium", "metric": "voltage", "rate_max": 0.5},
+    "dT_dt": {"fault_type": "Temperature Rise", "severity": "high", "metric": "temperature", "rate_max": 0.2},
+    "stuck": {"fault_type": "Sensor Stuck", "severity": "low", "metrics": ["voltage", "current", "temperature"],
+              "samples": 300, "epsilon": 1e-6},
+}
+
+
+def load_rules():
+    rules = {name: dict(rule) for name, rule in DEFAULT_RULES.items()}
+    overrides = json.loads(os.getenv('FAULT_RULES', '{}') or '{}')
+    for name, rule in overrides.items():
+        if rule is None:
+            rules.pop(name, None)
+        else:
+            rules.setdefault(name, {}).update(rule)
+    return rules
+
+
+def lookback_rows(rules):
+    """Samples of history a window needs from its predecessor."""
+    stuck = max((r.get("samples", 0) for r in rules.values() if "metrics" in r), default=0)
+    return max(stuck, 2)
+
+
+# ---------------- RULE EVALUATION ----------------
+def _run_lengths(same):
+    """Length of the current run of True values ending at each index (vectorized)."""
+    idx = np.arange(same.size)
+    # Index of the latest False at or before each position (-1 before the first)
+    last_break = np.maximum.accumulate(np.where(same, -1, idx))
+    return idx - last_break
+
+
+def _rule_mask(rule, window):
+    if "metrics" in rule:
+        mask = np.zeros(window["ts"].size, dtype=bool)
+        for metric in rule["metrics"]:
+            x = window[metric]
+            same = np.zeros(x.size, dtype=bool)
+            same[1:] = np.abs(np.diff(x)) <= rule.get("epsilon", 0.0)
+            # run of N equal samples = N-1 consecutive "same" steps
+            mask |= _run_lengths(same) >= rule["samples"] - 1
+        return mask
+
+    x = window[rule["metric"]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if "rate_max" in rule:
+            mask = np.zeros(x.size, dtype=bool)
+            dt = np.diff(window["ts"])
+            rate = np.abs(np.diff(x)) / np.where(dt > 0, dt, np.nan)
+            mask[1:] = rate > rule["rate_max"]
+            return mask
+        if "abs_max" in rule:
+            return np.abs(x) > rule["abs_max"]
+        if "max" in rule:
+            return x > rule["max"]
+        return x < rule["min"]
+
+
+def evaluate(window, rules, skip=0):
+    """
+    Run every rule over one window of arrays (ts in epoch seconds).
+
+    Returns (index, rule_name) pairs for the first sample of each violating
+    run, ignoring runs that start inside the first `skip` carried-over rows.
+    """
+    events = []
+    for name, rule in rules.items():
+        mask = _rule_mask(rule, window)
+        starts = mask.copy()
+        starts[1:] &= ~mask[:-1]
+        for index in np.flatnonzero(starts):
+            if index >= skip:
+                events.append((int(index), name))
+    events.sort()
+    return events
+
+
+# ---------------- DATABASE ACCESS ----------------
+_engine = None
+
+
+def _init_worker(database_url):
+    global _engine
+    _engine = create_engine(database_url, pool_size=1, max_overflow=0)
+
+
+WINDOW_COLUMNS = (
+    MqttData.id,
+    MqttData.ts,
+    cast(MqttData.voltage, Float),
+    cast(MqttData.current, Float),
+    cast(MqttData.temperature, Float),
+)
+
+
+def _epoch(ts):
+    # SQLite hands back naive datetimes; mqtt_data.ts is always UTC
+    return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _to_window(rows):
+    n = len(rows)
+    window = {
+        "id": np.fromiter((r[0] for r in rows), dtype=np.int64, count=n),
+        "ts": np.fromiter((_epoch(r[1]) for r in rows), dtype=np.float64, count=n),
+    }
+    for i, metric in enumerate(("voltage", "current", "temperature"), start=2):
+        window[metric] = np.fromiter(
+            (np.nan if r[i] is None else r[i] for r in rows), dtype=np.float64, count=n
+        )
+    return window
+
+
+def _fault_rows(battery_id, window, events, rules, company_id=None):
+    faults = []
+    for index, name in events:
+        rule = rules[name]
+        metric = rule.get("metric") or "/".join(rule["metrics"])
+        value = window[rule["metric"]][index] if "metric" in rule else None
+        limit = next((rule[k] for k in ("max", "min", "abs_max", "rate_max", "samples") if k in rule), None)
+        note = f"{name}: {metric}" + (f"={value:.3f}" if value is not None else "") + f" (limit {limit})"
+        faults.append({
+            "batt_uid": battery_id,
+            "company_id": company_id,
+            "fault_type": rule["fault_type"],
+            "severity": rule["severity"],
+            "predicted_by": PREDICTED_BY,
+            "detected_at": datetime.fromtimestamp(window["ts"][index], timezone.utc).replace(tzinfo=None),
+            "note": note,
+        })
+    return faults
+
+
+def _save_checkpoint(conn, battery_id, last_ts, last_id):
+    values = {"battery_id": battery_id, "last_ts": last_ts, "last_id": last_id, "updated_at": datetime.utcnow()}
+    table = FaultScanCheckpoint.__table__
+    if conn.dialect.name == "postgresql":
+        stmt = pg_insert(table).values(**values)
+        conn.execute(stmt.on_conflict_do_update(index_elements=[table.c.battery_id], set_=values))
+    else:
+        conn.execute(table.delete().where(table.c.battery_id == battery_id))
+        conn.execute(table.insert().values(**values))
+
+
+def scan_battery(battery_id, rules=None, window_rows=FAULT_WINDOW_ROWS, engine=None):
+    """
+    Scan one battery from its checkpoint to the newest sample.
+
+    Each window's faults and the advanced checkpoint commit together, so a
+    crash resumes from the last finished window. Returns
+    (battery_id, samples, faults).
+    """
+    engine = engine or _engine
+    rules = rules or load_rules()
+    carry = lookback_rows(rules)
+    table = FaultScanCheckpoint.__table__
+    base = select(*WINDOW_COLUMNS).where(MqttData.battery_id == battery_id)
+
+    with engine.connect() as conn:
+        company_id = conn.execute(
+            battery_company_query().where(BattDescription.batt_uid == battery_id)
+        ).first()
+        company_id = company_id[1] if company_id else None
+        checkpoint = conn.execute(
+            select(table.c.last_ts, table.c.last_id).where(table.c.battery_id == battery_id)
+        ).first()
+        # History before the checkpoint so rate/stuck rules have context
+        tail = []
+        if checkpoint and checkpoint.last_ts is not None:
+            tail = conn.execute(
+                base.where(tuple_(MqttData.ts, MqttData.id) <= tuple_(checkpoint.last_ts, checkpoint.last_id))
+                .order_by(MqttData.ts.desc(), MqttData.id.desc())
+                .limit(carry)
+            ).all()[::-1]
+
+    samples = faults = 0
+    position = (checkpoint.last_ts, checkpoint.last_id) if checkpoint and checkpoint.last_ts else None
+
+    while True:
+        query = base.order_by(MqttData.ts, MqttData.id).limit(window_rows)
+        if position:
+            query = query.where(tuple_(MqttData.ts, MqttData.id) > tuple_(*position))
+
+        with engine.begin() as conn:
+            rows = conn.execute(query).all()
+            if not rows:
+                break
+
+            combined = tail + rows
+            window = _to_window(combined)
+            events = evaluate(window, rules, skip=len(tail))
+            found = _fault_rows(battery_id, window, events, rules, company_id)
+            if found:
+                conn.execute(insert(BattFaultLog.__table__), found)
+
+            last = rows[-1]
+            position = (last[1], last[0])
+            _save_checkpoint(conn, battery_id, last[1], last[0])
+
+        samples += len(rows)
+        faults += len(found)
+        tail = combined[-carry:]
+        if len(rows) < window_rows:
+            break
+
+    return battery_id, samples, faults
+
+
+def _scan_in_worker(battery_id):
+    return scan_battery(battery_id)
+
+
+def battery_ids(engine):
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(select(BattDescription.batt_uid).order_by(BattDescription.batt_uid))]
+
+
+def run_fault_scan(database_url, batteries=None, workers=FAULT_WORKERS):
+    """Scan every battery (or just `batteries`) across a process pool."""
+    started = time.perf_counter()
+    if batteries is None:
+        batteries = battery_ids(create_engine(database_url))
+
+    totals = {"batteries": 0, "samples": 0, "faults": 0}
+    if workers <= 1:
+        _init_worker(database_url)
+        results = (scan_battery(b) for b in batteries)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(database_url,))
+        futures = [pool.submit(_scan_in_worker, b) for b in batteries]
+        results = (f.result() for f in as_completed(futures))
+
+    try:
+        for battery_id, samples, faults in results:
+            totals["batteries"] += 1
+            totals["samples"] += samples
+            totals["faults"] += faults
+            if samples:
+                logger.info("Battery %s: %d samples, %d faults", battery_id, samples, faults)
+    finally:
+        if workers > 1:
+            pool.shutdown()
+
+    totals["seconds"] = round(time.perf_counter() - started, 3)
+    return totals
+
+
+# ---------------- RUN SCAN ----------------
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    parser = argparse.ArgumentParser(description="Scan mqtt_data for faults")
+    parser.add_argument("--workers", type=int, default=FAULT_WORKERS)
+    parser.add_argument("--battery", type=int, action="append", help="only scan these battery ids")
+    args = parser.parse_args()
+
+    print(run_fault_scan(os.getenv('DATABASE_URL'), args.battery, args.workers))
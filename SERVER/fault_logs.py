@@ -0,0 +1,296 @@
+"""
+Fault log routes: filtered listing with keyset pagination, SQL-side
+summary counts, CSV export and bulk create/resolve, scoped to the
+caller's company through batt_fault_log.company_id.
+"""
+import os
+from datetime import datetime, timezone
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import insert, update
+
+from auth import company_required
+from csv_export import stream_csv
+from fastjson import json_response, timestamp_text
+from fault_summary import BUCKETS, fault_summary_cache, summarize
+from fleet import recount_open_faults
+from metrics import timed
+from models import db, BattFaultLog
+from pagination import keyset_page, parse_limit
+from tenants import battery_companies
+
+fault_logs_bp = Blueprint('fault_logs', __name__, url_prefix='/api/fault-logs')
+
+FAULT_BULK_MAX_ITEMS = int(os.getenv('FAULT_BULK_MAX_ITEMS', 10000))
+
+
+# ---------------- QUERY FILTERS ----------------
+def filter_fault_logs(query, company_id):
+    """Scope a BattFaultLog query to `company_id` and apply the start/end/battery_id/fault_type request filters."""
+    query = query.filter(BattFaultLog.company_id == company_id)
+
+    start_date = request.args.get("start")
+    end_date = request.args.get("end")
+    battery_id = request.args.get("battery_id")
+    fault_type = request.args.get("fault_type")
+
+    # Start date filtering
+    if start_date:
+        try:
+            query = query.filter(BattFaultLog.detected_at >= datetime.fromisoformat(start_date))
+        except Exception:
+            pass
+
+    # End date filtering
+    if end_date:
+        try:
+            query = query.filter(BattFaultLog.detected_at <= datetime.fromisoformat(end_date))
+        except Exception:
+            pass
+
+    # Filter by battery ID
+    if battery_id and battery_id.lower() != "all":
+        try:
+            query = query.filter(BattFaultLog.batt_uid == int(battery_id))
+        except ValueError:
+            pass
+
+    # Filter by fault type
+    if fault_type and fault_type.lower() != "all":
+        query = query.filter(BattFaultLog.fault_type == fault_type)
+
+    return query
+
+
+# ---------------- FAULT LOGS ROUTE ----------------
+@fault_logs_bp.route("", methods=["GET"])
+@company_required
+def get_fault_logs(company_id):
+    query = filter_fault_logs(db.session.query(BattFaultLog), company_id)
+    query = query.with_entities(*FAULT_LOG_COLUMNS)
+
+    # Keyset pagination: only when the client asks for pages
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = parse_limit(request.args.get("limit"))
+            logs, next_cursor = keyset_page(
+                query, BattFaultLog.detected_at, BattFaultLog.fault_id, limit, request.args.get("cursor")
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        with timed("serialize"):
+            return json_response({
+                "data": serialize_fault_logs(logs),
+                "next_cursor": next_cursor
+            })
+
+    logs = query.order_by(BattFaultLog.detected_at.desc()).all()
+    with timed("serialize"):
+        return json_response(serialize_fault_logs(logs))
+
+
+@fault_logs_bp.route("/summary", methods=["GET"])
+@company_required
+def get_fault_logs_summary(company_id):
+    """Fault counts by type, severity, battery and time bucket for the list filters."""
+    bucket = (request.args.get("bucket") or "day").lower()
+    if bucket not in BUCKETS:
+        return jsonify({"error": f"Unknown bucket: {bucket}"}), 400
+
+    key = (company_id, bucket) + tuple(
+        request.args.get(name) for name in ("start", "end", "battery_id", "fault_type")
+    )
+    summary = fault_summary_cache.get_or_compute(
+        key, lambda: summarize(filter_fault_logs(db.session.query(BattFaultLog), company_id), bucket)
+    )
+    with timed("serialize"):
+        return json_response(summary)
+
+
+FAULT_LOG_COLUMNS = (
+    BattFaultLog.fault_id,
+    BattFaultLog.batt_uid,
+    BattFaultLog.fault_type,
+    BattFaultLog.severity,
+    BattFaultLog.predicted_by,
+    BattFaultLog.note,
+    BattFaultLog.resolve_text,
+    BattFaultLog.detected_at,
+)
+
+
+def serialize_fault_logs(rows):
+    return [{
+        "fault_id": fault_id,
+        "battery_id": batt_uid,
+        "fault_type": fault_type,
+        "severity": severity,
+        "predicted_by": predicted_by,
+        "note": note,
+        "resolve_text": resolve_text,
+        "detected_at": timestamp_text(detected_at)
+    } for fault_id, batt_uid, fault_type, severity, predicted_by, note, resolve_text, detected_at in rows]
+
+
+FAULT_LOG_CSV_COLUMNS = [
+    ("fault_id", BattFaultLog.fault_id),
+    ("battery_id", BattFaultLog.batt_uid),
+    ("fault_type", BattFaultLog.fault_type),
+    ("severity", BattFaultLog.severity),
+    ("predicted_by", BattFaultLog.predicted_by),
+    ("note", BattFaultLog.note),
+    ("resolve_text", BattFaultLog.resolve_text),
+    ("detected_at", BattFaultLog.detected_at),
+]
+
+
+@fault_logs_bp.route("/csv", methods=["GET"])
+@company_required
+def download_fault_logs_csv(company_id):
+    query = filter_fault_logs(db.session.query(BattFaultLog), company_id)
+    query = query.order_by(BattFaultLog.detected_at.desc(), BattFaultLog.fault_id.desc())
+    return stream_csv(query, FAULT_LOG_CSV_COLUMNS, "fault_logs.csv")
+
+
+# ---------------- BULK ROUTES ----------------
+def _bulk_list(data, key):
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{key} must be a non-empty list")
+    if len(items) > FAULT_BULK_MAX_ITEMS:
+        raise ValueError(f"At most {FAULT_BULK_MAX_ITEMS} {key} per request")
+    return items
+
+
+def _text(item, name, max_length, required=False):
+    value = item.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{name} required" if required else f"{name} must be a string")
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{name} longer than {max_length} characters")
+    return value
+
+
+def parse_fault(item, company_id, batteries):
+    """batt_fault_log row for one bulk create item. Raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Fault must be an object")
+    try:
+        battery_id = int(item.get("battery_id"))
+    except (TypeError, ValueError):
+        raise ValueError("battery_id required")
+    if battery_id not in batteries:
+        raise ValueError(f"Unknown battery: {battery_id}")
+
+    detected_at = item.get("detected_at")
+    if detected_at is None:
+        detected_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    else:
+        try:
+            detected_at = datetime.fromisoformat(detected_at)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid detected_at")
+        # Stored as naive UTC, like the fault engine's rows
+        if detected_at.tzinfo is not None:
+            detected_at = detected_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return {
+        "batt_uid": battery_id,
+        "company_id": company_id,
+        "fault_type": _text(item, "fault_type", 100, required=True),
+        "severity": _text(item, "severity", 50),
+        "predicted_by": _text(item, "predicted_by", 50) or "api",
+        "note": _text(item, "note", None),
+        "detected_at": detected_at,
+    }
+
+
+@fault_logs_bp.route("/bulk", methods=["POST"])
+@company_required
+def create_fault_logs(company_id):
+    """
+    Insert many faults in one transaction.
+
+    Body: {"faults": [{"battery_id", "fault_type", "severity"?, "predicted_by"?,
+    "note"?, "detected_at"?}, ...]}. Valid items are written with one
+    multi-row INSERT; every item gets a result in request order, "created"
+    with its fault_id or "invalid" with the reason.
+    """
+    try:
+        items = _bulk_list(request.get_json(silent=True), "faults")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    batteries = battery_companies.batteries_for(company_id)
+    results, rows, positions = [], [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(parse_fault(item, company_id, batteries))
+            positions.append(index)
+            results.append(None)
+        except ValueError as e:
+            results.append({"index": index, "status": "invalid", "error": str(e)})
+
+    if rows:
+        stmt = insert(BattFaultLog.__table__).returning(BattFaultLog.fault_id, sort_by_parameter_order=True)
+        fault_ids = db.session.execute(stmt, rows).scalars().all()
+        recount_open_faults({row["batt_uid"] for row in rows})
+        db.session.commit()
+        for index, fault_id in zip(positions, fault_ids):
+            results[index] = {"index": index, "status": "created", "fault_id": fault_id}
+        fault_summary_cache.invalidate()
+
+    with timed("serialize"):
+        return json_response({"created": len(rows), "invalid": len(items) - len(rows), "results": results})
+
+
+@fault_logs_bp.route("/resolve", methods=["POST"])
+@company_required
+def resolve_fault_logs(company_id):
+    """
+    Set resolve_text and/or note on many faults with one UPDATE.
+
+    Body: {"fault_ids": [...], "resolve_text"?, "note"?}. Each id gets a
+    result in request order: "resolved", "not_found" (missing or another
+    company's) or "invalid".
+    """
+    data = request.get_json(silent=True)
+    try:
+        items = _bulk_list(data, "fault_ids")
+        values = {name: _text(data, name, None) for name in ("resolve_text", "note")}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    values = {name: value for name, value in values.items() if value is not None}
+    if not values:
+        return jsonify({"error": "resolve_text or note required"}), 400
+
+    valid = [isinstance(item, int) and not isinstance(item, bool) for item in items]
+    fault_ids = {item for item, ok in zip(items, valid) if ok}
+
+    resolved = set()
+    if fault_ids:
+        table = BattFaultLog.__table__
+        stmt = (
+            update(table)
+            .where(table.c.fault_id.in_(fault_ids), table.c.company_id == company_id)
+            .values(**values)
+            .returning(table.c.fault_id, table.c.batt_uid)
+        )
+        updated = db.session.execute(stmt).all()
+        resolved = {fault_id for fault_id, _ in updated}
+        recount_open_faults({battery_id for _, battery_id in updated if battery_id is not None})
+        db.session.commit()
+        # Core UPDATE: the ORM after_update hook does not see it
+        fault_summary_cache.invalidate()
+
+    results = []
+    for item, ok in zip(items, valid):
+        if not ok:
+            results.append({"fault_id": item, "status": "invalid", "error": "fault_id must be an integer"})
+        else:
+            results.append({"fault_id": item, "status": "resolved" if item in resolved else "not_found"})
+
+    with timed("serialize"):
+        return json_response({"resolved": len(resolved), "results": results})
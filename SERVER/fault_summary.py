@@ -0,0 +1,141 @@
+"""
+Fault counts for the FaultLogs summary, computed in SQL.
+
+One statement (a UNION ALL of four GROUP BYs) counts the filtered faults
+by fault_type, severity, battery and time bucket, so the cost depends on
+the number of groups rather than the number of faults.
+
+Summaries are cached per (company, filters). Each entry remembers the
+fault watermark it was computed at: max(fault_id) and the number of
+faults among the FAULT_WATERMARK_LAG ids below it, which also changes
+when a fault whose id is older than the newest commits late (ids are not
+committed in order across fault engine processes). A request re-checks
+the watermark with two primary-key range lookups and only recomputes when
+faults have arrived, from any process. Updates and deletes made through
+this process invalidate the cache directly (see invalidate()); the TTL
+bounds how long those made elsewhere can go unseen.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import String, cast, event, func, literal
+
+from models import db, BattFaultLog
+
+FAULT_SUMMARY_CACHE_SIZE = int(os.getenv('FAULT_SUMMARY_CACHE_SIZE', 512))
+FAULT_SUMMARY_TTL = float(os.getenv('FAULT_SUMMARY_TTL', 300))
+# Ids below the newest fault whose late commits still change the watermark
+FAULT_WATERMARK_LAG = int(os.getenv('FAULT_WATERMARK_LAG', 1000))
+
+BUCKETS = ("hour", "day", "week", "month")
+DIMENSIONS = ("fault_type", "severity", "battery_id", "bucket")
+
+
+def bucket_expression(unit, dialect):
+    """detected_at truncated to `unit`, as 'YYYY-MM-DD HH:MM:SS' text on both dialects."""
+    column = BattFaultLog.detected_at
+    if dialect == "postgresql":
+        return func.to_char(func.date_trunc(unit, column), "YYYY-MM-DD HH24:MI:SS")
+    if unit == "week":
+        # Monday of the week, like date_trunc('week')
+        return func.datetime(column, "weekday 0", "-6 days", "start of day")
+    formats = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d 00:00:00", "month": "%Y-%m-01 00:00:00"}
+    return func.strftime(formats[unit], column)
+
+
+def summarize(query, unit):
+    """
+    Counts for a filtered BattFaultLog query.
+
+    Returns {"total", "bucket", "by_fault_type", "by_severity",
+    "by_battery", "by_time"}; breakdowns are sorted by count, except
+    by_time which is in time order.
+    """
+    keys = {
+        "fault_type": BattFaultLog.fault_type,
+        "severity": BattFaultLog.severity,
+        "battery_id": cast(BattFaultLog.batt_uid, String),
+        "bucket": bucket_expression(unit, db.engine.dialect.name),
+    }
+    query = query.order_by(None)
+    parts = [
+        query.with_entities(literal(name).label("dimension"), key.label("key"), func.count().label("count"))
+        .group_by(key)
+        for name, key in keys.items()
+    ]
+    rows = parts[0].union_all(*parts[1:]).all()
+
+    groups = {name: [] for name in DIMENSIONS}
+    for dimension, key, count in rows:
+        if dimension == "battery_id" and key is not None:
+            key = int(key)
+        groups[dimension].append({dimension: key, "count": count})
+
+    for name in ("fault_type", "severity", "battery_id"):
+        groups[name].sort(key=lambda item: -item["count"])
+    groups["bucket"].sort(key=lambda item: item["bucket"] or "")
+
+    return {
+        "total": sum(item["count"] for item in groups["fault_type"]),
+        "bucket": unit,
+        "by_fault_type": groups["fault_type"],
+        "by_severity": groups["severity"],
+        "by_battery": groups["battery_id"],
+        "by_time": groups["bucket"],
+    }
+
+
+def fault_watermark(id_lag=FAULT_WATERMARK_LAG):
+    """(max fault_id, faults with an id within `id_lag` of it)"""
+    max_id = db.session.query(func.max(BattFaultLog.fault_id)).scalar() or 0
+    recent = db.session.query(func.count(BattFaultLog.fault_id)).filter(BattFaultLog.fault_id > max_id - id_lag).scalar()
+    return max_id, recent
+
+
+class FaultSummaryCache:
+    def __init__(self, max_size=FAULT_SUMMARY_CACHE_SIZE, ttl=FAULT_SUMMARY_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (watermark, expires_at, summary)
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """Cached summary for `key` unless faults arrived since; `compute()` builds a fresh one."""
+        watermark = fault_watermark()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == watermark and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        summary = compute()
+        with self._lock:
+            self._entries[key] = (watermark, now + self.ttl, summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return summary
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+fault_summary_cache = FaultSummaryCache()
+
+
+@event.listens_for(BattFaultLog, "after_update")
+@event.listens_for(BattFaultLog, "after_delete")
+def _invalidate(mapper, connection, target):
+    fault_summary_cache.invalidate()
@@ -0,0 +1,203 @@
+"""
+Typed fields promoted out of telemetry payloads.
+
+payload_json keeps every message as the device sent it, but reading a
+metric such as SoC or cell voltages out of it means parsing JSON per row.
+Fields registered here are extracted once, at ingest, into
+mqtt_field_value: one float per (battery, field, timestamp), indexed by
+battery/name/ts and company/name/ts.
+
+Register fields in code with register_field(), or without a deploy through
+MQTT_FIELDS, a JSON object mapping a field name to the payload keys to try
+in order (null drops a default field):
+
+    MQTT_FIELDS='{"humidity": ["humidity", "rh"], "cycle_count": null}'
+
+Rows ingested before a field existed are filled in by the batched
+backfill; re-extracting a row is a no-op, so backfill and ingest may
+overlap and an interrupted backfill can simply be run again.
+
+Run with:  python fields.py [--field NAME] [--restart]
+"""
+import json
+import logging
+import math
+import os
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, MqttData, MqttFieldValue, RollupWatermark
+
+logger = logging.getLogger("bms.fields")
+
+FIELD_BACKFILL_BATCH_ROWS = int(os.getenv('FIELD_BACKFILL_BATCH_ROWS', 20000))
+BACKFILL_WATERMARK = "field_backfill"
+
+
+def _to_float(value):
+    """Numbers, booleans and numeric strings as float; None for anything else."""
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _cell_voltages(payload):
+    cells = payload.get("cell_voltages", payload.get("cells"))
+    if not isinstance(cells, list):
+        return []
+    return [v for v in map(_to_float, cells) if v is not None]
+
+
+class Field:
+    """A payload metric: the first of `keys` present, or whatever `extract(payload)` returns."""
+
+    def __init__(self, name, keys=(), extract=None):
+        self.name = name
+        self.keys = tuple(keys)
+        self.extract = extract
+
+    def value(self, payload):
+        if self.extract is not None:
+            return _to_float(self.extract(payload))
+        for key in self.keys:
+            if payload.get(key) is not None:
+                return _to_float(payload[key])
+        return None
+
+
+# ---------------- REGISTRY ----------------
+FIELDS = {}
+
+
+def register_field(name, *keys, extract=None):
+    FIELDS[name] = Field(name, keys or (name,), extract)
+    return FIELDS[name]
+
+
+register_field("soc", "soc", "SOC", "state_of_charge")
+register_field("cycle_count", "cycle_count", "cycles")
+register_field("cell_voltage_min", extract=lambda p: min(_cell_voltages(p), default=None))
+register_field("cell_voltage_max", extract=lambda p: max(_cell_voltages(p), default=None))
+register_field(
+    "cell_voltage_spread",
+    extract=lambda p: max(cells) - min(cells) if (cells := _cell_voltages(p)) else None,
+)
+
+
+def load_env_fields():
+    for name, keys in json.loads(os.getenv('MQTT_FIELDS', '{}') or '{}').items():
+        if keys is None:
+            FIELDS.pop(name, None)
+        else:
+            register_field(name, *([keys] if isinstance(keys, str) else keys))
+
+
+load_env_fields()
+
+
+# ---------------- EXTRACTION ----------------
+def extract_rows(rows, fields=None):
+    """mqtt_field_value row dicts for MqttData row dicts (ts, battery_id, company_id, payload_json)."""
+    fields = list((fields or FIELDS).values())
+    values = []
+    for row in rows:
+        payload = row.get("payload_json")
+        if not isinstance(payload, dict) or row.get("battery_id") is None:
+            continue
+        for field in fields:
+            value = field.value(payload)
+            if value is not None:
+                values.append({
+                    "ts": row["ts"],
+                    "battery_id": row["battery_id"],
+                    "company_id": row.get("company_id"),
+                    "name": field.name,
+                    "value": value,
+                })
+    return values
+
+
+def insert_field_values(values):
+    """Insert extracted values, skipping (battery_id, name, ts) that are already stored."""
+    if not values:
+        return 0
+    table = MqttFieldValue.__table__
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=["battery_id", "name", "ts"])
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=["battery_id", "name", "ts"])
+    else:
+        stmt = table.insert()
+    db.session.execute(stmt, values)
+    db.session.commit()
+    return len(values)
+
+
+# ---------------- BACKFILL ----------------
+def backfill_fields(names=None, batch_rows=FIELD_BACKFILL_BATCH_ROWS, restart=False):
+    """
+    Extract fields from rows ingested before they were registered. Needs an app context.
+
+    Walks mqtt_data in id order up to the newest row at start, committing
+    each batch with its progress in rollup_watermark; `restart` starts over
+    (for a newly registered field).
+    """
+    fields = {name: FIELDS[name] for name in names} if names else FIELDS
+    watermark = db.session.get(RollupWatermark, BACKFILL_WATERMARK)
+    if watermark is None:
+        watermark = RollupWatermark(name=BACKFILL_WATERMARK, last_id=0)
+        db.session.add(watermark)
+    if restart:
+        watermark.last_id = 0
+    db.session.commit()
+
+    last_id = watermark.last_id
+    high = db.session.query(func.max(MqttData.id)).scalar() or 0
+    totals = {"rows": 0, "values": 0}
+    columns = (MqttData.id, MqttData.ts, MqttData.battery_id, MqttData.company_id, MqttData.payload_json)
+
+    while last_id < high:
+        rows = db.session.execute(
+            select(*columns)
+            .where(MqttData.id > last_id, MqttData.id <= high)
+            .order_by(MqttData.id)
+            .limit(batch_rows)
+        ).mappings().all()
+        if not rows:
+            break
+
+        last_id = rows[-1]["id"]
+        values = extract_rows(rows, fields)
+        watermark.last_id = last_id
+        # Commits the values and the watermark together
+        insert_field_values(values)
+        db.session.commit()
+
+        totals["rows"] += len(rows)
+        totals["values"] += len(values)
+        logger.info("Backfilled fields up to id %d (%d values)", last_id, totals["values"])
+
+    return totals
+
+
+# ---------------- RUN BACKFILL ----------------
+if __name__ == '__main__':
+    import argparse
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    parser = argparse.ArgumentParser(description="Backfill typed payload fields from mqtt_data")
+    parser.add_argument("--field", action="append", choices=sorted(FIELDS), help="only these fields")
+    parser.add_argument("--restart", action="store_true", help="start from the oldest row again")
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(backfill_fields(args.field, restart=args.restart))
@@ -0,0 +1,341 @@
+"""
+Fleet health snapshot: one batt_fleet_snapshot row per battery.
+
+Building the fleet view on demand means joining products, batteries, the
+latest mqtt_data rows, open faults and the latest batt_health rows for
+every battery. Instead a refresher folds in only what arrived since its
+last pass, tracked by id watermarks in rollup_watermark:
+
+- mqtt_data: the last reading, and per-hour temperature min/max for the
+  latest 24 hours, from which the 24h range is read
+- batt_health: the latest SoC
+- batt_fault_log: batteries with new faults get their open-fault count
+  and worst severity recounted from their own open faults; the bulk
+  create/resolve endpoints do the same for the batteries they touch
+
+Ids are not always committed in order (fault engine processes, the
+anomaly detector and ingest all write), so every pass also re-reads the
+FLEET_ID_LAG ids below each watermark; folding a row twice changes
+nothing, so a row committed late is picked up within that margin.
+
+Each pass writes only the batteries that had new data, and /api/fleet
+reads one row per battery; the per-product figures are rolled up from
+those rows as they are served. The 24h temperature range has hour
+granularity.
+
+Run standalone with:  python fleet.py
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import Float, cast, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from fastjson import timestamp_text
+from models import (
+    db,
+    BattDescription,
+    BattFaultLog,
+    BattFleetSnapshot,
+    BattHealth,
+    MqttData,
+    Product,
+    RollupWatermark,
+)
+from refresher import Refresher
+
+logger = logging.getLogger("bms.fleet")
+
+FLEET_REFRESH_INTERVAL = float(os.getenv('FLEET_REFRESH_INTERVAL', 15))
+# Rows per source per refresh transaction; a backlog is worked off over several passes
+FLEET_MAX_ROWS = int(os.getenv('FLEET_MAX_ROWS', 500000))
+# Ids below each watermark re-read every pass in case they were committed after newer ones
+FLEET_ID_LAG = int(os.getenv('FLEET_ID_LAG', 1000))
+
+TEMP_WINDOW_HOURS = 24
+SEVERITY_RANK = {"low": 1, "medium": 2, "high": 3, "critical": 4}
+
+READING_COLUMNS = ("last_ts", "voltage", "current", "temperature", "temp_hours")
+
+READINGS_WATERMARK = "fleet_readings"
+HEALTH_WATERMARK = "fleet_health"
+FAULTS_WATERMARK = "fleet_faults"
+
+
+def _epoch(ts):
+    # sqlite hands back naive datetimes; every stored ts is UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def worst_severity(severities):
+    return max(severities, key=lambda s: SEVERITY_RANK.get(s, 0), default=None)
+
+
+def _upsert(values, columns):
+    """Insert snapshot rows or overwrite just `columns` of existing ones."""
+    if not values:
+        return
+    now = datetime.utcnow()
+    for value in values:
+        value["updated_at"] = now
+    table = BattFleetSnapshot.__table__
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(table)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.battery_id],
+        set_={c: stmt.excluded[c] for c in (*columns, "updated_at")},
+    ), values)
+
+
+# ---------------- FOLDING ----------------
+def fold_readings(states, rows):
+    """
+    Fold (battery_id, ts, voltage, current, temperature) rows into `states`.
+
+    states  {battery_id: {READING_COLUMNS...}}, as stored; updated in place.
+    """
+    hours = {}
+    for battery_id, ts, voltage, current, temperature in rows:
+        state = states.setdefault(battery_id, dict.fromkeys(READING_COLUMNS))
+        epoch = _epoch(ts)
+        if state["last_ts"] is None or epoch >= _epoch(state["last_ts"]):
+            state.update(last_ts=ts, voltage=voltage, current=current, temperature=temperature)
+        if temperature is None:
+            continue
+
+        if battery_id not in hours:
+            hours[battery_id] = {h: [lo, hi] for h, lo, hi in state["temp_hours"] or ()}
+        hour = int(epoch // 3600) * 3600
+        bucket = hours[battery_id].setdefault(hour, [temperature, temperature])
+        bucket[0] = min(bucket[0], temperature)
+        bucket[1] = max(bucket[1], temperature)
+
+    for battery_id, buckets in hours.items():
+        newest = max(buckets)
+        states[battery_id]["temp_hours"] = [
+            [hour, lo, hi] for hour, (lo, hi) in sorted(buckets.items())
+            if hour > newest - TEMP_WINDOW_HOURS * 3600
+        ]
+    return states
+
+
+def temperature_range(temp_hours, now=None):
+    """(min, max) over the buckets of the last 24 hours, or (None, None)."""
+    cutoff = (now or time.time()) - TEMP_WINDOW_HOURS * 3600
+    recent = [(lo, hi) for hour, lo, hi in temp_hours or () if hour + 3600 > cutoff]
+    if not recent:
+        return None, None
+    return min(lo for lo, _ in recent), max(hi for _, hi in recent)
+
+
+def recount_open_faults(battery_ids):
+    """Recount open (unresolved) faults of `battery_ids` into their snapshot rows; the caller commits."""
+    battery_ids = list(battery_ids)
+    if not battery_ids:
+        return
+    counts = {battery_id: (0, []) for battery_id in battery_ids}
+    rows = (
+        db.session.query(BattFaultLog.batt_uid, BattFaultLog.severity, func.count())
+        .filter(BattFaultLog.batt_uid.in_(battery_ids), BattFaultLog.resolve_text.is_(None))
+        .group_by(BattFaultLog.batt_uid, BattFaultLog.severity)
+    )
+    for battery_id, severity, count in rows:
+        total, severities = counts[battery_id]
+        counts[battery_id] = (total + count, severities + [severity])
+
+    _upsert([
+        {"battery_id": battery_id, "open_faults": total, "worst_severity": worst_severity(severities)}
+        for battery_id, (total, severities) in counts.items()
+    ], ("open_faults", "worst_severity"))
+
+
+# ---------------- REFRESH ----------------
+def _watermark(name):
+    watermark = db.session.get(RollupWatermark, name, with_for_update=True)
+    if watermark is None:
+        watermark = RollupWatermark(name=name, last_id=0)
+        db.session.add(watermark)
+        db.session.flush()
+    return watermark
+
+
+def _advance(watermark, id_column, max_rows, id_lag):
+    """(lo_id, hi_id] to read: the next chunk of `id_column` past `watermark` and the `id_lag` ids below it."""
+    max_id = db.session.query(func.max(id_column)).scalar() or 0
+    return max(watermark.last_id - id_lag, 0), min(max_id, watermark.last_id + max_rows)
+
+
+def _move(watermark, hi_id):
+    """Advance `watermark` to `hi_id`; returns by how many ids."""
+    advanced = max(hi_id - watermark.last_id, 0)
+    if advanced:
+        watermark.last_id = hi_id
+        watermark.updated_at = datetime.utcnow()
+    return advanced
+
+
+def refresh_fleet(max_rows=FLEET_MAX_ROWS, id_lag=FLEET_ID_LAG):
+    """
+    Fold new readings, SoC estimates and faults into the snapshot.
+
+    Returns the number of ids advanced over all sources; call until 0 to
+    catch up. Must run inside an app context.
+    """
+    advanced = 0
+
+    # Readings: last reading and hourly temperature range
+    watermark = _watermark(READINGS_WATERMARK)
+    lo_id, hi_id = _advance(watermark, MqttData.id, max_rows, id_lag)
+    if hi_id > lo_id:
+        rows = (
+            db.session.query(
+                MqttData.battery_id,
+                MqttData.ts,
+                cast(MqttData.voltage, Float),
+                cast(MqttData.current, Float),
+                cast(MqttData.temperature, Float),
+            )
+            .filter(MqttData.id > lo_id, MqttData.id <= hi_id, MqttData.battery_id.isnot(None))
+            .order_by(MqttData.id)
+            .all()
+        )
+        battery_ids = {row[0] for row in rows}
+        columns = [getattr(BattFleetSnapshot, c) for c in READING_COLUMNS]
+        states = {
+            battery_id: dict(zip(READING_COLUMNS, values))
+            for battery_id, *values in db.session.query(BattFleetSnapshot.battery_id, *columns)
+            .filter(BattFleetSnapshot.battery_id.in_(battery_ids))
+        } if battery_ids else {}
+        fold_readings(states, rows)
+        _upsert([dict(state, battery_id=battery_id) for battery_id, state in states.items()], READING_COLUMNS)
+        advanced += _move(watermark, hi_id)
+
+    # SoC: the newest batt_health row per battery
+    watermark = _watermark(HEALTH_WATERMARK)
+    lo_id, hi_id = _advance(watermark, BattHealth.measurement_id, max_rows, id_lag)
+    if hi_id > lo_id:
+        latest = {}
+        for battery_id, soc in (
+            db.session.query(BattHealth.batt_uid, cast(BattHealth.soc, Float))
+            .filter(BattHealth.measurement_id > lo_id, BattHealth.measurement_id <= hi_id,
+                    BattHealth.batt_uid.isnot(None), BattHealth.soc.isnot(None))
+            .order_by(BattHealth.measurement_id)
+        ):
+            latest[battery_id] = soc
+        _upsert([{"battery_id": b, "soc": soc} for b, soc in latest.items()], ("soc",))
+        advanced += _move(watermark, hi_id)
+
+    # Faults: recount the batteries that have new ones
+    watermark = _watermark(FAULTS_WATERMARK)
+    lo_id, hi_id = _advance(watermark, BattFaultLog.fault_id, max_rows, id_lag)
+    if hi_id > lo_id:
+        battery_ids = [
+            battery_id for (battery_id,) in
+            db.session.query(BattFaultLog.batt_uid)
+            .filter(BattFaultLog.fault_id > lo_id, BattFaultLog.fault_id <= hi_id,
+                    BattFaultLog.batt_uid.isnot(None))
+            .distinct()
+        ]
+        recount_open_faults(battery_ids)
+        advanced += _move(watermark, hi_id)
+
+    db.session.commit()
+    if advanced:
+        logger.info("Fleet snapshot advanced by %d ids", advanced)
+    return advanced
+
+
+# ---------------- READ ----------------
+def read_fleet(company_id, product_sl_no=None):
+    """
+    Snapshot of every battery of `company_id`, plus per-product rollups.
+
+    Batteries that have not reported yet are listed with empty readings.
+    """
+    query = (
+        db.session.query(
+            BattDescription.batt_uid,
+            BattDescription.product_sl_no,
+            BattDescription.status,
+            BattFleetSnapshot.last_ts,
+            BattFleetSnapshot.voltage,
+            BattFleetSnapshot.current,
+            BattFleetSnapshot.temperature,
+            BattFleetSnapshot.temp_hours,
+            BattFleetSnapshot.soc,
+            BattFleetSnapshot.open_faults,
+            BattFleetSnapshot.worst_severity,
+        )
+        .join(Product, BattDescription.product_sl_no == Product.product_sl_no)
+        .outerjoin(BattFleetSnapshot, BattFleetSnapshot.battery_id == BattDescription.batt_uid)
+        .filter(Product.company_id == company_id)
+        .order_by(BattDescription.batt_uid)
+    )
+    if product_sl_no is not None:
+        query = query.filter(BattDescription.product_sl_no == product_sl_no)
+
+    now = time.time()
+    batteries, products = [], {}
+    for (battery_id, product, status, last_ts, voltage, current, temperature,
+         temp_hours, soc, open_faults, severity) in query:
+        temp_min, temp_max = temperature_range(temp_hours, now)
+        batteries.append({
+            "battery_id": battery_id,
+            "product_sl_no": product,
+            "status": status,
+            "last_ts": timestamp_text(last_ts),
+            "voltage": voltage,
+            "current": current,
+            "temperature": temperature,
+            "temp_min_24h": temp_min,
+            "temp_max_24h": temp_max,
+            "soc": soc,
+            "open_faults": open_faults or 0,
+            "worst_severity": severity,
+        })
+
+        rollup = products.setdefault(product, {
+            "product_sl_no": product, "batteries": 0, "reporting": 0, "last_ts": None,
+            "temp_min_24h": None, "temp_max_24h": None, "soc": [],
+            "open_faults": 0, "worst_severity": None,
+        })
+        rollup["batteries"] += 1
+        rollup["open_faults"] += open_faults or 0
+        rollup["worst_severity"] = worst_severity(s for s in (rollup["worst_severity"], severity) if s)
+        if last_ts is not None:
+            rollup["reporting"] += 1
+            if rollup["last_ts"] is None or _epoch(last_ts) > _epoch(rollup["last_ts"]):
+                rollup["last_ts"] = last_ts
+        if temp_min is not None:
+            rollup["temp_min_24h"] = min(v for v in (temp_min, rollup["temp_min_24h"]) if v is not None)
+            rollup["temp_max_24h"] = max(v for v in (temp_max, rollup["temp_max_24h"]) if v is not None)
+        if soc is not None:
+            rollup["soc"].append(soc)
+
+    for rollup in products.values():
+        socs = rollup.pop("soc")
+        rollup["last_ts"] = timestamp_text(rollup["last_ts"])
+        rollup["avg_soc"] = round(sum(socs) / len(socs), 2) if socs else None
+
+    return {"batteries": batteries, "products": list(products.values())}
+
+
+class FleetRefresher(Refresher):
+    """Background thread calling refresh_fleet every FLEET_REFRESH_INTERVAL seconds."""
+
+    def __init__(self, app, interval=FLEET_REFRESH_INTERVAL):
+        super().__init__(app, refresh_fleet, interval, "fleet-refresher", logger=logger)
+
+
+# ---------------- RUN REFRESHER ----------------
+if __name__ == '__main__':
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    FleetRefresher(app).run_forever()
@@ -0,0 +1,173 @@
+"""
+Bounded TTL/LRU cache of verified JWTs.
+
+token_required used to decode the JWT and load TblUser on every request,
+and /api/auth/me loaded the company with a second query. A cache hit now
+costs a dict lookup: the entry holds the decoded claims plus a flat
+user+company snapshot loaded with one joined query.
+
+Entries expire after IDENTITY_CACHE_TTL seconds or when the token does,
+whichever comes first, and are dropped as soon as a TblUser or
+CompanyProfile row is updated or deleted in this process.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from sqlalchemy import event
+
+from models import db, CompanyProfile, TblUser
+
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', 60))
+
+
+class UserSnapshot:
+    """Read-only view of a user and their company; stands in for TblUser in views."""
+
+    __slots__ = (
+        "u_id", "username", "email", "phone", "role", "security_qn", "company_id",
+        "company_name", "company_email", "company_is_active",
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+
+def load_user_snapshot(u_id):
+    row = (
+        db.session.query(
+            TblUser.u_id,
+            TblUser.username,
+            TblUser.email,
+            TblUser.phone,
+            TblUser.role,
+            TblUser.security_qn,
+            TblUser.company_id,
+            CompanyProfile.company_name,
+            CompanyProfile.email.label("company_email"),
+            CompanyProfile.is_active.label("company_is_active"),
+        )
+        .outerjoin(CompanyProfile, TblUser.company_id == CompanyProfile.company_id)
+        .filter(TblUser.u_id == u_id)
+        .first()
+    )
+    return UserSnapshot(**row._asdict()) if row else None
+
+
+class IdentityCache:
+    def __init__(self, max_size=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, claims, snapshot)
+        self._by_user = {}              # u_id -> set(key)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, token, claims, snapshot):
+        expires_at = time.time() + self.ttl
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+
+        key = self._key(token)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, claims, snapshot)
+            self._by_user.setdefault(snapshot.u_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[2].u_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[2].u_id]
+
+    def invalidate_user(self, u_id):
+        with self._lock:
+            for key in list(self._by_user.get(u_id, ())):
+                self._remove(key)
+
+    def invalidate_company(self, company_id):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[2].company_id == company_id:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+identity_cache = IdentityCache()
+
+
+def resolve_identity(token, secret):
+    """
+    Claims and UserSnapshot for a bearer token.
+
+    Raises jwt.InvalidTokenError (incl. ExpiredSignatureError) like
+    jwt.decode; returns (claims, None) when the user no longer exists.
+    """
+    cached = identity_cache.get(token)
+    if cached is not None:
+        return cached
+
+    claims = jwt.decode(token, secret, algorithms=["HS256"])
+    snapshot = load_user_snapshot(claims.get("u_id"))
+    if snapshot is not None:
+        identity_cache.put(token, claims, snapshot)
+    return claims, snapshot
+
+
+@event.listens_for(TblUser, "after_update")
+@event.listens_for(TblUser, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    identity_cache.invalidate_user(target.u_id)
+
+
+@event.listens_for(CompanyProfile, "after_update")
+@event.listens_for(CompanyProfile, "after_delete")
+def _invalidate_company(mapper, connection, target):
+    identity_cache.invalidate_company(target.company_id)
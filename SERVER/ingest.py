@@ -0,0 +1,486 @@
+"""
+MQTT telemetry ingestion.
+
+Subscribes to the device telemetry topics, parses each message into an
+MqttData row and buffers rows in a bounded queue. A single flusher thread
+drains the queue in batches (by row count or age, whichever comes first),
+stamps each row's company_id from the cached battery -> company map and
+writes them with one multi-row INSERT or a COPY. Registered payload
+fields (see fields.py) are then extracted into mqtt_field_value, and
+listeners such as the anomaly detector (anomaly.py) see each committed batch.
+
+A failed write is retried INGEST_RETRY_ATTEMPTS times with exponential
+backoff (the queue fills meanwhile and pushes back on the subscriber). A
+batch that still fails is appended to a JSON-lines file in
+INGEST_DEAD_LETTER_DIR rather than dropped, and can be loaded later with
+--replay.
+
+Run standalone with:  python ingest.py [--replay FILE ...]
+"""
+import abc
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from io import StringIO
+
+from sqlalchemy import insert
+
+from fields import extract_rows, insert_field_values
+from models import db, MqttData
+from tenants import battery_companies
+
+logger = logging.getLogger("bms.ingest")
+
+MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
+MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
+MQTT_USERNAME = os.getenv('MQTT_USERNAME')
+MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
+MQTT_TOPICS = [t.strip() for t in os.getenv('MQTT_TOPICS', 'bms/+/telemetry').split(',') if t.strip()]
+
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 50000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 2000))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 1.0))
+# How long a producer waits on a full queue before the message is dropped
+INGEST_PUT_TIMEOUT = float(os.getenv('INGEST_PUT_TIMEOUT', 5.0))
+# 'copy' uses COPY FROM STDIN on Postgres; 'insert' uses a multi-row INSERT
+INGEST_WRITE_MODE = os.getenv('INGEST_WRITE_MODE', 'insert').lower()
+# Retries of a failed batch write; the wait doubles from INGEST_RETRY_BACKOFF up to INGEST_RETRY_BACKOFF_MAX
+INGEST_RETRY_ATTEMPTS = int(os.getenv('INGEST_RETRY_ATTEMPTS', 5))
+INGEST_RETRY_BACKOFF = float(os.getenv('INGEST_RETRY_BACKOFF', 0.5))
+INGEST_RETRY_BACKOFF_MAX = float(os.getenv('INGEST_RETRY_BACKOFF_MAX', 30.0))
+# Batches that still fail are kept here as JSON lines
+INGEST_DEAD_LETTER_DIR = os.getenv('INGEST_DEAD_LETTER_DIR', 'ingest_dead_letters')
+
+INGEST_COLUMNS = (
+    "ts", "device_id", "battery_id", "voltage", "current", "temperature", "payload_json", "company_id",
+)
+
+
+# ---------------- PAYLOAD PARSING ----------------
+def parse_timestamp(value):
+    """Epoch seconds, epoch milliseconds or an ISO string; defaults to now (UTC)."""
+    if value is None or value == "":
+        return datetime.now(timezone.utc)
+    if isinstance(value, (int, float)):
+        if value > 1e12:
+            value = value / 1000.0
+        return datetime.fromtimestamp(value, timezone.utc)
+    ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _number(payload, *keys):
+    for key in keys:
+        if payload.get(key) is not None:
+            return float(payload[key])
+    return None
+
+
+def parse_message(topic, payload):
+    """
+    Turn one MQTT message into an MqttData row dict.
+
+    Topics look like ``bms/<device_id>/telemetry``; a ``device_id`` in the
+    payload wins over the topic. Raises ValueError on unusable messages.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode("utf-8")
+    try:
+        data = json.loads(payload) if isinstance(payload, str) else dict(payload)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid JSON payload: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Payload must be a JSON object")
+
+    parts = topic.split("/")
+    device_id = data.get("device_id") or (parts[1] if len(parts) > 2 else None)
+
+    battery_id = data.get("battery_id", data.get("batteryId"))
+    if battery_id is None:
+        raise ValueError("Payload has no battery_id")
+
+    try:
+        return {
+            "ts": parse_timestamp(data.get("ts", data.get("timestamp"))),
+            "device_id": device_id,
+            "battery_id": int(battery_id),
+            "voltage": _number(data, "voltage", "v"),
+            "current": _number(data, "current", "i"),
+            "temperature": _number(data, "temperature", "temp", "t"),
+            "payload_json": data,
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid telemetry values: {e}")
+
+
+# ---------------- SUBSCRIBERS ----------------
+class Subscriber(abc.ABC):
+    """Source of (topic, payload) messages; implementations call on_message for each."""
+
+    @abc.abstractmethod
+    def start(self, on_message):
+        """Begin delivering messages to on_message(topic, payload)."""
+
+    @abc.abstractmethod
+    def stop(self):
+        """Stop delivering messages."""
+
+
+class PahoSubscriber(Subscriber):
+    """Subscriber backed by a real broker through paho-mqtt."""
+
+    def __init__(self, host=MQTT_HOST, port=MQTT_PORT, topics=None,
+                 username=MQTT_USERNAME, password=MQTT_PASSWORD, client_id="bms-ingest"):
+        self.host = host
+        self.port = port
+        self.topics = topics or MQTT_TOPICS
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self._client = None
+
+    def start(self, on_message):
+        import paho.mqtt.client as mqtt
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id)
+        if self.username:
+            client.username_pw_set(self.username, self.password)
+
+        def handle_connect(client, userdata, flags, reason_code, properties):
+            logger.info("Connected to %s:%s (%s), subscribing to %s",
+                        self.host, self.port, reason_code, self.topics)
+            for topic in self.topics:
+                client.subscribe(topic, qos=1)
+
+        def handle_message(client, userdata, msg):
+            on_message(msg.topic, msg.payload)
+
+        client.on_connect = handle_connect
+        client.on_message = handle_message
+        client.connect(self.host, self.port)
+        client.loop_start()
+        self._client = client
+
+    def stop(self):
+        if self._client is not None:
+            self._client.loop_stop()
+            self._client.disconnect()
+            self._client = None
+
+
+class FakeBroker(Subscriber):
+    """In-process broker: publish() hands messages straight to the worker."""
+
+    def __init__(self):
+        self._on_message = None
+
+    def start(self, on_message):
+        self._on_message = on_message
+
+    def stop(self):
+        self._on_message = None
+
+    def publish(self, topic, payload):
+        if self._on_message is None:
+            raise RuntimeError("FakeBroker is not started")
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+        self._on_message(topic, payload)
+
+
+# ---------------- WRITERS ----------------
+def insert_rows(rows):
+    """Multi-row INSERT of row dicts (executemany is batched into VALUES lists)."""
+    db.session.execute(insert(MqttData), rows)
+    db.session.commit()
+
+
+def copy_rows(rows):
+    """COPY FROM STDIN on Postgres; fastest way to land a large batch."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([
+            row["ts"].isoformat(),
+            row["device_id"],
+            row["battery_id"],
+            row["voltage"],
+            row["current"],
+            row["temperature"],
+            json.dumps(row["payload_json"]),
+            row.get("company_id"),
+        ])
+    buf.seek(0)
+
+    conn = db.engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY {MqttData.__tablename__} ({', '.join(INGEST_COLUMNS)}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buf,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_batch(batch, write_mode=INGEST_WRITE_MODE):
+    """Stamp company ids and write one batch; must run inside an app context."""
+    battery_companies.stamp(batch)
+    if write_mode == "copy" and db.engine.dialect.name == "postgresql":
+        copy_rows(batch)
+    else:
+        insert_rows(batch)
+
+
+# ---------------- DEAD LETTERS ----------------
+def write_dead_letters(batch, directory=INGEST_DEAD_LETTER_DIR):
+    """Append a batch that could not be written to today's dead-letter file; returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"mqtt_data-{datetime.now(timezone.utc):%Y%m%d}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        for row in batch:
+            f.write(json.dumps({**row, "ts": row["ts"].isoformat()}) + "\n")
+    return path
+
+
+def read_dead_letters(path):
+    """Row dicts from a dead-letter file, ready for write_batch()."""
+    with open(path, encoding="utf-8") as f:
+        return [{**row, "ts": parse_timestamp(row["ts"])} for row in map(json.loads, f) if row]
+
+
+# ---------------- WORKER ----------------
+class IngestWorker:
+    """
+    Bounded buffer between a Subscriber and the database.
+
+    submit() blocks for up to put_timeout when the queue is full, which pushes
+    back on the subscriber's network loop instead of growing memory; messages
+    that still do not fit are dropped and counted. Listeners registered with
+    add_listener() get every batch after it has been committed.
+    """
+
+    def __init__(self, app, subscriber=None, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, queue_size=INGEST_QUEUE_SIZE,
+                 put_timeout=INGEST_PUT_TIMEOUT, write_mode=INGEST_WRITE_MODE,
+                 retry_attempts=INGEST_RETRY_ATTEMPTS, retry_backoff=INGEST_RETRY_BACKOFF,
+                 dead_letter_dir=INGEST_DEAD_LETTER_DIR):
+        self.app = app
+        self.subscriber = subscriber or PahoSubscriber()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.write_mode = write_mode
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.dead_letter_dir = dead_letter_dir
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.listeners = []
+        self.stop_hooks = []
+        # Updated from the subscriber's network thread and the flusher; read with stats()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "received": 0,
+            "rejected": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "retries": 0,
+            "dead_lettered": 0,
+            "failed_field_batches": 0,
+            "last_batch_rows": 0,
+            "last_batch_ms": 0.0,
+            "max_batch_ms": 0.0,
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        """Snapshot of the counters."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def add_listener(self, fn):
+        """fn(rows) is called with each committed batch of row dicts."""
+        self.listeners.append(fn)
+
+    def add_stop_hook(self, fn):
+        """fn() is called in an app context after stop() has flushed the queue, e.g. to checkpoint a listener."""
+        self.stop_hooks.append(fn)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+        self._thread.start()
+        self.subscriber.start(self.on_message)
+
+    def stop(self, timeout=10.0):
+        """Stop the subscriber, then flush whatever is still queued."""
+        self.subscriber.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self.app.app_context():
+            for hook in self.stop_hooks:
+                try:
+                    hook()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Ingest stop hook %r failed", hook)
+
+    def on_message(self, topic, payload):
+        self._count("received")
+        try:
+            row = parse_message(topic, payload)
+        except ValueError as e:
+            self._count("rejected")
+            logger.debug("Rejected message on %s: %s", topic, e)
+            return
+        self.submit(row)
+
+    def submit(self, row):
+        try:
+            self.queue.put(row, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self._count("dropped")
+            logger.warning("Ingest queue full, dropped message for battery %s", row.get("battery_id"))
+            return False
+
+    def _take_batch(self):
+        """Wait for up to batch_size rows or flush_interval seconds, whichever first."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch:
+                self.flush(batch)
+        # Drain on shutdown
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self.flush(batch)
+
+    def _write_with_retries(self, batch):
+        """Write `batch`, retrying with backoff; dead-letters it and returns False when every attempt fails."""
+        delay = self.retry_backoff
+        for attempt in range(self.retry_attempts + 1):
+            try:
+                write_batch(batch, self.write_mode)
+                return True
+            except Exception:
+                db.session.rollback()
+                if attempt == self.retry_attempts:
+                    logger.exception("Giving up on batch of %d rows after %d attempts", len(batch), attempt + 1)
+                    break
+                self._count("retries")
+                logger.warning("Failed to write batch of %d rows, retrying in %.1f s",
+                               len(batch), delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, INGEST_RETRY_BACKOFF_MAX)
+
+        self._count("failed_batches")
+        try:
+            path = write_dead_letters(batch, self.dead_letter_dir)
+        except OSError:
+            logger.exception("Could not dead-letter batch of %d rows; they are lost", len(batch))
+            return False
+        self._count("dead_lettered", len(batch))
+        logger.error("Dead-lettered %d rows to %s", len(batch), path)
+        return False
+
+    def flush(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            if not self._write_with_retries(batch):
+                return False
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                stats = self._stats
+                stats["batches"] += 1
+                stats["written"] += len(batch)
+                stats["last_batch_rows"] = len(batch)
+                stats["last_batch_ms"] = round(elapsed_ms, 3)
+                stats["max_batch_ms"] = round(max(stats["max_batch_ms"], elapsed_ms), 3)
+            logger.info("Wrote %d rows in %.1f ms (queue depth %d)",
+                        len(batch), elapsed_ms, self.queue.qsize())
+
+            # The readings are already committed; a field failure only costs
+            # the typed copies, which the backfill can recreate
+            try:
+                insert_field_values(extract_rows(batch))
+            except Exception:
+                db.session.rollback()
+                self._count("failed_field_batches")
+                logger.exception("Failed to extract fields from batch of %d rows", len(batch))
+
+            for listener in self.listeners:
+                try:
+                    listener(batch)
+                except Exception:
+                    logger.exception("Ingest listener %r failed", listener)
+        return True
+
+
+# ---------------- RUN WORKER ----------------
+if __name__ == '__main__':
+    import argparse
+    from anomaly import ANOMALY_ENABLED, anomaly_detector
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    parser = argparse.ArgumentParser(description="MQTT telemetry ingestion")
+    parser.add_argument("--replay", nargs="+", metavar="FILE", help="write dead-lettered batches and exit")
+    args = parser.parse_args()
+
+    if args.replay:
+        with app.app_context():
+            for path in args.replay:
+                rows = read_dead_letters(path)
+                for i in range(0, len(rows), INGEST_BATCH_SIZE):
+                    write_batch(rows[i:i + INGEST_BATCH_SIZE])
+                print(f"{path}: {len(rows)} rows")
+        raise SystemExit(0)
+
+    worker = IngestWorker(app)
+    if ANOMALY_ENABLED:
+        worker.add_listener(anomaly_detector.update)
+        worker.add_stop_hook(anomaly_detector.stop)
+    worker.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,314 @@
+"""
+Live telemetry push over Socket.IO.
+
+Clients connect to the /telemetry namespace with a JWT and subscribe to
+batteries of their own company, or to the whole company. Ingested
+readings are coalesced per client (latest reading per battery wins) and
+flushed at most LIVE_MAX_RATE times a second, so a dashboard tab costs one
+socket and a compact array per reading.
+
+Readings reach the broadcaster in one of two ways. With INGEST_IN_PROCESS
+the ingest worker calls publish() for every batch it writes. Otherwise
+(ingest.py running as its own process) the broadcaster tails mqtt_data
+itself: every LIVE_TAIL_INTERVAL seconds, while anyone is subscribed, it
+reads the rows of subscribed batteries past the highest id it has seen,
+so pushes lag the database by at most that interval. Like the sensor
+cache this assumes ids become visible in order; LIVE_ID_LAG leaves the
+newest ids for the next pass when there are several writers.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+
+import jwt
+from flask import request
+from flask_socketio import Namespace
+from sqlalchemy import Float, cast, func
+
+from extensions import socketio
+from models import db, MqttData, TblUser
+from tenants import battery_companies
+
+JWT_SECRET = os.getenv('JWT_SECRET', 'dev_secret')
+
+LIVE_NAMESPACE = os.getenv('LIVE_NAMESPACE', '/telemetry')
+# Max events per second pushed to one client; clients may ask for less
+LIVE_MAX_RATE = float(os.getenv('LIVE_MAX_RATE', 2.0))
+
+# When ingest runs in another process, poll mqtt_data for new rows this often (seconds)
+LIVE_TAIL_INTERVAL = float(os.getenv('LIVE_TAIL_INTERVAL', 1.0))
+# Rows read per tail; a tail further behind than this skips to the newest row
+LIVE_TAIL_MAX_ROWS = int(os.getenv('LIVE_TAIL_MAX_ROWS', 5000))
+# Leave the newest N ids alone in case earlier ids are still uncommitted
+LIVE_ID_LAG = int(os.getenv('LIVE_ID_LAG', 0))
+
+# Order of values in every pushed reading
+READING_FIELDS = ["battery_id", "ts_ms", "voltage", "current", "temperature"]
+
+TAIL_COLUMNS = (
+    MqttData.id,
+    MqttData.battery_id,
+    MqttData.ts,
+    cast(MqttData.voltage, Float).label("voltage"),
+    cast(MqttData.current, Float).label("current"),
+    cast(MqttData.temperature, Float).label("temperature"),
+)
+
+logger = logging.getLogger("bms.live")
+
+
+def compact_reading(row):
+    """MqttData row dict -> [battery_id, epoch_ms, voltage, current, temperature]."""
+    ts = row["ts"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return [
+        row["battery_id"],
+        int(ts.timestamp() * 1000),
+        row["voltage"],
+        row["current"],
+        row["temperature"],
+    ]
+
+
+class LiveBroadcaster:
+    """
+    Per-client subscription index and coalescing buffer.
+
+    publish() is cheap and thread-safe so it can run as an ingest listener;
+    the actual emits happen on a socketio background task, which also runs
+    tail() unless `fed_by_ingest` is set.
+    """
+
+    def __init__(self, max_rate=LIVE_MAX_RATE, tail_interval=LIVE_TAIL_INTERVAL, tail_max_rows=LIVE_TAIL_MAX_ROWS):
+        self.max_rate = max_rate
+        self.tail_interval = tail_interval
+        self.tail_max_rows = tail_max_rows
+        self.app = None
+        self.fed_by_ingest = False
+        self._lock = threading.Lock()
+        self._by_battery = {}   # battery_id -> set(sid)
+        self._clients = {}      # sid -> {"batteries", "interval", "last_sent", "pending"}
+        self._task = None
+        self._last_id = None
+        self._tailed_at = 0.0
+
+    def add_client(self, sid, max_rate=None):
+        rate = min(max_rate or self.max_rate, self.max_rate)
+        with self._lock:
+            self._clients.setdefault(sid, {
+                "batteries": set(),
+                "interval": 1.0 / rate,
+                "last_sent": 0.0,
+                "pending": {},
+            })["interval"] = 1.0 / rate
+
+    def remove_client(self, sid):
+        with self._lock:
+            client = self._clients.pop(sid, None)
+            if client:
+                for battery_id in client["batteries"]:
+                    self._unindex(sid, battery_id)
+
+    def subscribe(self, sid, battery_ids):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            for battery_id in battery_ids:
+                client["batteries"].add(battery_id)
+                self._by_battery.setdefault(battery_id, set()).add(sid)
+
+    def unsubscribe(self, sid, battery_ids):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is None:
+                return
+            for battery_id in battery_ids:
+                client["batteries"].discard(battery_id)
+                client["pending"].pop(battery_id, None)
+                self._unindex(sid, battery_id)
+
+    def _unindex(self, sid, battery_id):
+        sids = self._by_battery.get(battery_id)
+        if sids:
+            sids.discard(sid)
+            if not sids:
+                del self._by_battery[battery_id]
+
+    def publish(self, rows):
+        """Ingest listener: keep only the newest reading per battery per client."""
+        with self._lock:
+            for row in rows:
+                sids = self._by_battery.get(row["battery_id"])
+                if not sids:
+                    continue
+                reading = compact_reading(row)
+                for sid in sids:
+                    pending = self._clients[sid]["pending"]
+                    current = pending.get(row["battery_id"])
+                    if current is None or current[1] <= reading[1]:
+                        pending[row["battery_id"]] = reading
+
+    def tail(self):
+        """Publish mqtt_data rows of subscribed batteries added since the last tail; needs an app context."""
+        with self._lock:
+            batteries = list(self._by_battery)
+        if not batteries:
+            # Nobody listening: start from the newest row once someone subscribes
+            self._last_id = None
+            return 0
+
+        hi_id = (db.session.query(func.max(MqttData.id)).scalar() or 0) - LIVE_ID_LAG
+        if self._last_id is None or hi_id - self._last_id > self.tail_max_rows:
+            # History is the REST API's job; only push what arrives from now on
+            self._last_id = hi_id
+            return 0
+        if hi_id <= self._last_id:
+            return 0
+
+        rows = (
+            db.session.query(*TAIL_COLUMNS)
+            .filter(MqttData.id > self._last_id, MqttData.id <= hi_id, MqttData.battery_id.in_(batteries))
+            .order_by(MqttData.id)
+            .all()
+        )
+        self._last_id = hi_id
+        self.publish([row._asdict() for row in rows])
+        return len(rows)
+
+    def _tail_due(self, now):
+        if self.fed_by_ingest or self.app is None or now - self._tailed_at < self.tail_interval:
+            return False
+        self._tailed_at = now
+        return True
+
+    def _due(self, now):
+        due = []
+        with self._lock:
+            for sid, client in self._clients.items():
+                if client["pending"] and now - client["last_sent"] >= client["interval"]:
+                    due.append((sid, list(client["pending"].values())))
+                    client["pending"] = {}
+                    client["last_sent"] = now
+        return due
+
+    def flush(self):
+        for sid, readings in self._due(time.monotonic()):
+            socketio.emit("readings", readings, to=sid, namespace=LIVE_NAMESPACE)
+
+    def run(self):
+        tick = min(0.05, 1.0 / self.max_rate)
+        while True:
+            if self._tail_due(time.monotonic()):
+                with self.app.app_context():
+                    try:
+                        self.tail()
+                    except Exception:
+                        db.session.rollback()
+                        logger.exception("live tail failed")
+            self.flush()
+            socketio.sleep(tick)
+
+    def start(self):
+        if self._task is None:
+            self._task = socketio.start_background_task(self.run)
+
+
+broadcaster = LiveBroadcaster()
+
+
+def _user_from_token(token):
+    if not token:
+        return None
+    try:
+        data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+    return db.session.get(TblUser, data.get("u_id"))
+
+
+class TelemetryNamespace(Namespace):
+    """
+    Connecting needs {"token": <JWT>} as auth, from a user with a company;
+    only that company's batteries can be subscribed to.
+
+    Events:
+      subscribe   {"battery_id": 3} | {"battery_ids": [...]} | {"company_id": 1}, optional "max_rate"
+      unsubscribe same shapes as subscribe
+      readings    server -> client, list of READING_FIELDS arrays
+    """
+
+    def __init__(self, namespace):
+        super().__init__(namespace)
+        self._users = {}   # sid -> (u_id, company_id)
+
+    def on_connect(self, auth=None):
+        token = (auth or {}).get("token") if isinstance(auth, dict) else None
+        user = _user_from_token(token)
+        if user is None:
+            raise ConnectionRefusedError("Missing or invalid token")
+        if user.company_id is None:
+            raise ConnectionRefusedError("No company assigned to this user")
+        self._users[request.sid] = (user.u_id, user.company_id)
+        broadcaster.add_client(request.sid)
+        broadcaster.start()
+
+    def on_disconnect(self, *args):
+        broadcaster.remove_client(request.sid)
+        self._users.pop(request.sid, None)
+
+    def _battery_ids(self, data):
+        """Battery ids named by a (un)subscribe payload, all owned by the caller's company."""
+        _, company_id = self._users.get(request.sid, (None, None))
+        if company_id is None:
+            raise PermissionError("Not authenticated")
+        allowed = battery_companies.batteries_for(company_id)
+
+        if "company_id" in data:
+            if int(data["company_id"]) != company_id:
+                raise PermissionError("Not allowed to subscribe to this company")
+            return set(allowed)
+        if "battery_ids" in data:
+            requested = {int(b) for b in data["battery_ids"]}
+        elif "battery_id" in data:
+            requested = {int(data["battery_id"])}
+        else:
+            raise ValueError("battery_id, battery_ids or company_id required")
+
+        foreign = requested - allowed
+        if foreign:
+            raise PermissionError(f"Not allowed to subscribe to batteries: {sorted(foreign)}")
+        return requested
+
+    def on_subscribe(self, data):
+        data = data or {}
+        try:
+            battery_ids = self._battery_ids(data)
+            max_rate = float(data["max_rate"]) if data.get("max_rate") else None
+        except (PermissionError, TypeError, ValueError) as e:
+            return {"error": str(e)}
+
+        if max_rate:
+            broadcaster.add_client(request.sid, max_rate)
+        broadcaster.subscribe(request.sid, battery_ids)
+        return {"subscribed": sorted(battery_ids), "fields": READING_FIELDS}
+
+    def on_unsubscribe(self, data):
+        data = data or {}
+        try:
+            battery_ids = self._battery_ids(data)
+        except (PermissionError, TypeError, ValueError) as e:
+            return {"error": str(e)}
+        broadcaster.unsubscribe(request.sid, battery_ids)
+        return {"unsubscribed": sorted(battery_ids)}
+
+
+def init_live(app):
+    """Attach Socket.IO to the app and register the telemetry namespace."""
+    socketio.init_app(app, cors_allowed_origins=app.config.get('CORS_ORIGINS', []))
+    socketio.on_namespace(TelemetryNamespace(LIVE_NAMESPACE))
+    broadcaster.app = app
+    return broadcaster
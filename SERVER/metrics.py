@@ -0,0 +1,258 @@
+"""
+Request and database instrumentation, exported in Prometheus text format.
+
+Every request is timed per route. SQLAlchemy cursor events count statements
+and DB time, both globally and for the request that ran them; statements
+slower than METRICS_SLOW_QUERY_MS are logged and counted. Code that
+serializes or authenticates wraps itself in timed("serialize") or
+timed("auth"), so a request's wall time splits into db, serialize, auth
+and the rest (ORM hydration and view logic).
+
+GET /api/metrics serves everything, plus connection-pool gauges and any
+registered collectors, to the addresses in METRICS_ALLOWED_IPS. With
+SERVER_TIMING_HEADER=true each response also carries a Server-Timing
+header with the same split.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("bms.metrics")
+
+METRICS_SLOW_QUERY_MS = float(os.getenv('METRICS_SLOW_QUERY_MS', 200))
+METRICS_ALLOWED_IPS = {
+    ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()
+}
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', 'False').lower() == 'true'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+PHASES = ("db", "serialize", "auth")
+SLOW_QUERY_LOG_SIZE = 50
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            base = _labels(self.label_names, labels)
+            sep = "," if base else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            base = _labels(self.label_names, labels)
+            lines.append(f"{self.name}{{{base}}} {value}" if base else f"{self.name} {value}")
+        return lines
+
+
+def gauge_lines(name, help_text, samples):
+    """samples: iterable of (labels dict, value)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        base = _labels(labels.keys(), labels.values())
+        lines.append(f"{name}{{{base}}} {value}" if base else f"{name} {value}")
+    return lines
+
+
+# ---------------- REGISTRY ----------------
+REQUEST_SECONDS = Histogram(
+    "bms_http_request_duration_seconds", "Wall time of HTTP requests.", ("method", "route", "status"))
+PHASE_SECONDS = Histogram(
+    "bms_http_request_phase_seconds", "Time per request spent in db, serialize or auth.", ("route", "phase"))
+REQUEST_QUERIES = Histogram(
+    "bms_http_request_queries", "SQL statements executed per request.", ("route",), QUERY_COUNT_BUCKETS)
+DB_QUERIES = Counter("bms_db_queries_total", "SQL statements executed.")
+DB_SECONDS = Counter("bms_db_query_seconds_total", "Time spent executing SQL statements.")
+DB_SLOW_QUERIES = Counter("bms_db_slow_queries_total", "Statements slower than METRICS_SLOW_QUERY_MS.", ("route",))
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+# Callables returning extra exposition lines (cache stats, ingest counters, ...)
+_collectors = []
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+# ---------------- PHASE TIMING ----------------
+@contextmanager
+def timed(phase):
+    """Add the enclosed time to the current request's `phase`; nested uses count once."""
+    if not has_request_context():
+        yield
+        return
+
+    depth = g.setdefault("_phase_depth", {})
+    if depth.get(phase):
+        depth[phase] += 1
+        try:
+            yield
+        finally:
+            depth[phase] -= 1
+        return
+
+    depth[phase] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        depth[phase] = 0
+        phases = g.setdefault("_phases", {})
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+
+
+# ---------------- SQLALCHEMY HOOKS ----------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_started")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    DB_QUERIES.inc()
+    DB_SECONDS.inc(amount=elapsed)
+
+    route = None
+    if has_request_context():
+        route = _route()
+        phases = g.setdefault("_phases", {})
+        phases["db"] = phases.get("db", 0.0) + elapsed
+        g._query_count = g.get("_query_count", 0) + 1
+
+    if elapsed * 1000 >= METRICS_SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc((route or "background",))
+        slow_queries.append({"route": route, "ms": round(elapsed * 1000, 1), "statement": statement[:500]})
+        logger.warning("Slow query (%.0f ms) on %s: %s", elapsed * 1000, route or "background", statement[:200])
+
+
+def pool_gauges(engine):
+    pool = engine.pool
+    samples = []
+    for name, attr in (("size", "size"), ("checked_in", "checkedin"),
+                       ("checked_out", "checkedout"), ("overflow", "overflow")):
+        fn = getattr(pool, attr, None)
+        if callable(fn):
+            samples.append(({"state": name}, fn()))
+    return gauge_lines("bms_db_pool_connections", "Connection pool state.", samples)
+
+
+# ---------------- FLASK WIRING ----------------
+def render_metrics(engine=None):
+    lines = []
+    for metric in (REQUEST_SECONDS, PHASE_SECONDS, REQUEST_QUERIES, DB_QUERIES, DB_SECONDS, DB_SLOW_QUERIES):
+        lines.extend(metric.render())
+    if engine is not None:
+        lines.extend(pool_gauges(engine))
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception:
+            logger.exception("Metrics collector %r failed", collector)
+    return "\n".join(lines) + "\n"
+
+
+def init_metrics(app, engine_getter):
+    """Time every request on `app` and register GET /api/metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        started = g.pop("_request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = _route()
+        phases = g.get("_phases", {})
+
+        REQUEST_SECONDS.observe((request.method, route, response.status_code), elapsed)
+        REQUEST_QUERIES.observe((route,), g.get("_query_count", 0))
+        for phase in PHASES:
+            if phase in phases:
+                PHASE_SECONDS.observe((route, phase), phases[phase])
+
+        if SERVER_TIMING_HEADER:
+            parts = [f"{phase};dur={phases[phase] * 1000:.1f}" for phase in PHASES if phase in phases]
+            parts.append(f"total;dur={elapsed * 1000:.1f}")
+            response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+    @app.route("/api/metrics", methods=["GET"])
+    def get_metrics():
+        if request.remote_addr not in METRICS_ALLOWED_IPS:
+            return jsonify({"error": "Forbidden"}), 403
+        return Response(render_metrics(engine_getter()), mimetype="text/plain; version=0.0.4")
@@ -107,6 +107,12 @@ class BattHealth(db.Model):
 
 class BattFaultLog(db.Model):
     __tablename__ = "batt_fault_log"
+    __table_args__ = (
+        db.Index("ix_batt_fault_log_batt_uid_detected_at", "batt_uid", "detected_at"),
+        db.Index("ix_batt_fault_log_detected_at_fault_id", "detected_at", "fault_id"),
+        db.Index("ix_batt_fault_log_fault_type_detected_at", "fault_type", "detected_at"),
+        db.Index("ix_batt_fault_log_company_id_detected_at_fault_id", "company_id", "detected_at", "fault_id"),
+    )
 
     fault_id = db.Column(db.Integer, primary_key=True)
     batt_uid = db.Column(db.Integer, db.ForeignKey("batt_description.batt_uid"))
@@ -116,20 +122,162 @@ class BattFaultLog(db.Model):
     predicted_by = db.Column(db.String(50))
     resolve_text = db.Column(db.Text)
     note = db.Column(db.Text)
+    # Denormalized from batt_description -> product for tenant-scoped reads (see tenants.py)
+    company_id = db.Column(db.Integer)
 
     battery = db.relationship("BattDescription", back_populates="fault_logs")
 
 class MqttData(db.Model):
+    # On Postgres this table is range-partitioned by ts (see schema.py)
     __tablename__ = "mqtt_data"
+    __table_args__ = (
+        db.Index("ix_mqtt_data_battery_id_ts", "battery_id", "ts"),
+        db.Index("ix_mqtt_data_ts_id", "ts", "id"),
+        db.Index("ix_mqtt_data_company_id_ts_id", "company_id", "ts", "id"),
+    )
 
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
     ts = db.Column(db.DateTime(timezone=True), nullable=False)
     device_id = db.Column(db.Text)
     battery_id = db.Column(db.Integer)
     voltage = db.Column(db.Numeric(6, 3))
     current = db.Column(db.Numeric(8, 3))
     temperature = db.Column(db.Numeric(6, 3))
-    payload_json = db.Column(db.JSON)
+    # Raw message; only loaded on access. Metrics worth querying are promoted
+    # into MqttFieldValue at ingest (see fields.py)
+    payload_json = db.deferred(db.Column(db.JSON))
+    # Stamped at ingest from tenants.battery_companies
+    company_id = db.Column(db.Integer)
 
     def __init__(self, **kwargs):
-        super().__init__(**kwargs)
\ No newline at end of file
+        super().__init__(**kwargs)
+
+
+class MqttFieldValue(db.Model):
+    """One payload metric of one reading, extracted into a typed column."""
+    __tablename__ = "mqtt_field_value"
+    __table_args__ = (
+        # Also the conflict target that makes re-extraction (backfill over ingest) a no-op
+        db.UniqueConstraint("battery_id", "name", "ts", name="uq_mqtt_field_value_battery_id_name_ts"),
+        db.Index("ix_mqtt_field_value_company_id_name_ts_id", "company_id", "name", "ts", "id"),
+        # Retention deletes oldest first
+        db.Index("ix_mqtt_field_value_ts_id", "ts", "id"),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    ts = db.Column(db.DateTime(timezone=True), nullable=False)
+    battery_id = db.Column(db.Integer, nullable=False)
+    company_id = db.Column(db.Integer)
+    name = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.Float)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+class RollupMixin:
+    """Per-battery aggregates of MqttData over one fixed-width time bucket."""
+
+    battery_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime(timezone=True), primary_key=True)
+    sample_count = db.Column(db.BigInteger, nullable=False, default=0)
+    last_ts = db.Column(db.DateTime(timezone=True))
+
+    voltage_min = db.Column(db.Numeric(6, 3))
+    voltage_max = db.Column(db.Numeric(6, 3))
+    voltage_sum = db.Column(db.Numeric)
+    voltage_last = db.Column(db.Numeric(6, 3))
+
+    current_min = db.Column(db.Numeric(8, 3))
+    current_max = db.Column(db.Numeric(8, 3))
+    current_sum = db.Column(db.Numeric)
+    current_last = db.Column(db.Numeric(8, 3))
+
+    temperature_min = db.Column(db.Numeric(6, 3))
+    temperature_max = db.Column(db.Numeric(6, 3))
+    temperature_sum = db.Column(db.Numeric)
+    temperature_last = db.Column(db.Numeric(6, 3))
+
+
+class MqttRollupMinute(RollupMixin, db.Model):
+    __tablename__ = "mqtt_rollup_minute"
+
+
+class MqttRollupHour(RollupMixin, db.Model):
+    __tablename__ = "mqtt_rollup_hour"
+
+
+class MqttRollupDay(RollupMixin, db.Model):
+    __tablename__ = "mqtt_rollup_day"
+
+
+class RollupWatermark(db.Model):
+    __tablename__ = "rollup_watermark"
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+
+class FaultScanCheckpoint(db.Model):
+    """How far the fault engine has scanned mqtt_data for one battery."""
+    __tablename__ = "fault_scan_checkpoint"
+
+    battery_id = db.Column(db.Integer, primary_key=True)
+    last_ts = db.Column(db.DateTime(timezone=True))
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+
+class BattSocState(db.Model):
+    """Carry-over state of the SoC estimator for one battery."""
+    __tablename__ = "batt_soc_state"
+
+    battery_id = db.Column(db.Integer, primary_key=True)
+    soc = db.Column(db.Float, nullable=False)
+    last_ts = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_current = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+
+class BattFleetSnapshot(db.Model):
+    """Current state of one battery for /api/fleet, kept up to date by fleet.py."""
+    __tablename__ = "batt_fleet_snapshot"
+
+    battery_id = db.Column(db.Integer, primary_key=True)
+    last_ts = db.Column(db.DateTime(timezone=True))
+    voltage = db.Column(db.Float)
+    current = db.Column(db.Float)
+    temperature = db.Column(db.Float)
+    # [[hour start epoch, min, max], ...] for the latest 24 hours of readings
+    temp_hours = db.Column(db.JSON)
+    soc = db.Column(db.Float)
+    open_faults = db.Column(db.Integer, nullable=False, default=0)
+    worst_severity = db.Column(db.String(50))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+
+class BattAnomalyState(db.Model):
+    """Checkpointed running statistics of the streaming anomaly detector for one battery."""
+    __tablename__ = "batt_anomaly_state"
+
+    battery_id = db.Column(db.Integer, primary_key=True)
+    samples = db.Column(db.BigInteger, nullable=False, default=0)
+    last_ts = db.Column(db.DateTime(timezone=True))
+    # anomaly.BatteryState.stats as packed float64s
+    stats = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
@@ -0,0 +1,56 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_DEFAULT_LIMIT = int(os.getenv('PAGE_DEFAULT_LIMIT', 500))
+PAGE_MAX_LIMIT = int(os.getenv('PAGE_MAX_LIMIT', 5000))
+
+
+def encode_cursor(ts, row_id):
+    """Opaque cursor for the last row of a page."""
+    raw = json.dumps([ts.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_limit(value):
+    if value is None or value == "":
+        return PAGE_DEFAULT_LIMIT
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, PAGE_MAX_LIMIT)
+
+
+def keyset_page(query, ts_col, id_col, limit, cursor=None):
+    """
+    Newest-first page of `query` ordered by (ts_col, id_col).
+
+    Seeks past the cursor with a row-value comparison instead of OFFSET, so
+    page N costs the same index range scan as page 1. Returns the rows and
+    the cursor for the next page (None when this is the last page).
+    """
+    if cursor:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(ts_col, id_col) < tuple_(cursor_ts, cursor_id))
+
+    rows = query.order_by(None).order_by(ts_col.desc(), id_col.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, ts_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
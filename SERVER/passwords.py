@@ -0,0 +1,206 @@
+"""
+Password hashing off the request workers.
+
+Hashing is deliberately slow, and a login storm used to run it inline on
+every request thread, so telemetry requests queued behind it. Hashes now
+run on a small dedicated process pool (PASSWORD_POOL_WORKERS). At most
+PASSWORD_QUEUE_MAX hash jobs may be queued or running; past that, callers
+get PasswordPoolBusy straight away and the view answers 503 instead of
+tying up a worker.
+
+Under eventlet (wsgi.py's default SERVER_WORKER) the process pool is not
+used: its manager thread and result pipes would run as green threads on
+the monkey-patched stdlib, and joining them on shutdown never returns.
+Jobs go to eventlet's native thread pool (eventlet.tpool) instead, at most
+PASSWORD_POOL_WORKERS at a time; hashlib's scrypt and pbkdf2 release the
+GIL, so the hub keeps serving while a hash runs.
+
+PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH take werkzeug's method
+strings (e.g. "scrypt:32768:8:1", "pbkdf2:sha256:600000"). A login whose
+stored hash uses other parameters gets a fresh hash computed in the same
+pool job, so hashes migrate as users log in.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+PASSWORD_POOL_WORKERS = int(os.getenv('PASSWORD_POOL_WORKERS', 2))
+PASSWORD_QUEUE_MAX = int(os.getenv('PASSWORD_QUEUE_MAX', 64))
+PASSWORD_TIMEOUT = float(os.getenv('PASSWORD_TIMEOUT', 10))
+# Seconds clients are told to wait after a 503
+PASSWORD_RETRY_AFTER = int(os.getenv('PASSWORD_RETRY_AFTER', 2))
+
+
+class PasswordPoolBusy(Exception):
+    """Too many hash jobs queued; shed the request."""
+
+
+def needs_rehash(pwhash, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH):
+    """True when `pwhash` was made with other parameters than the configured ones."""
+    stored_method, _, rest = pwhash.partition("$")
+    salt = rest.partition("$")[0]
+    return stored_method != method or len(salt) != salt_length
+
+
+# ---------------- POOL JOBS ----------------
+def _init_worker():
+    # Shutdown signals often reach the whole process group; the parent drains
+    # in-flight logins first and then stops the pool itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # ...so a worker must notice on its own when the parent dies without doing that
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        threading.Thread(target=_exit_with_parent, args=(parent.sentinel,), daemon=True).start()
+
+
+def _exit_with_parent(sentinel):
+    multiprocessing.connection.wait([sentinel])
+    os._exit(1)
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(pwhash, password, method, salt_length):
+    """(valid, upgraded hash or None)"""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method, salt_length):
+        return True, _hash(password, method, salt_length)
+    return True, None
+
+
+def _eventlet_patched():
+    eventlet = sys.modules.get("eventlet")
+    return eventlet is not None and eventlet.patcher.is_monkey_patched("thread")
+
+
+class GreenExecutor:
+    """
+    The slice of the Executor interface HashPool uses, backed by eventlet.tpool.
+
+    Each job waits in a green thread for one of `workers` running slots and
+    then runs on a native tpool thread.
+    """
+
+    def __init__(self, workers):
+        import eventlet.semaphore
+
+        self._running = eventlet.semaphore.Semaphore(workers)
+
+    def _call(self, fn, args):
+        from eventlet import tpool
+
+        with self._running:
+            return tpool.execute(fn, *args)
+
+    def submit(self, fn, *args):
+        import eventlet
+
+        return GreenFuture(eventlet.spawn(self._call, fn, args))
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        # tpool threads belong to eventlet and are shared; nothing of ours to stop
+        pass
+
+
+class GreenFuture:
+    def __init__(self, greenthread):
+        self._greenthread = greenthread
+
+    def result(self, timeout=None):
+        import eventlet
+
+        with eventlet.Timeout(timeout, FutureTimeoutError()):
+            return self._greenthread.wait()
+
+    def cancel(self):
+        return False
+
+    def add_done_callback(self, fn):
+        self._greenthread.link(lambda _: fn(self))
+
+
+class HashPool:
+    def __init__(self, workers=PASSWORD_POOL_WORKERS, queue_max=PASSWORD_QUEUE_MAX, timeout=PASSWORD_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_max)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and _eventlet_patched():
+                self._executor = GreenExecutor(self.workers)
+            elif self._executor is None:
+                # Not fork: a forked worker would inherit the server's listening
+                # socket and, under gevent, keep serving requests from its hub
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A job that timed out keeps its slot until it actually finishes, so
+        # abandoned jobs still count against PASSWORD_QUEUE_MAX
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordPoolBusy()
+
+    def shutdown(self, wait=True):
+        """Stop the workers; with wait=False they are killed rather than joined."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=wait, cancel_futures=True)
+        if not wait:
+            for process in processes:
+                process.kill()
+
+
+hash_pool = HashPool()
+
+
+def hash_password(password):
+    """Hash with the configured parameters. Raises PasswordPoolBusy."""
+    return hash_pool.run(_hash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
+
+
+def verify_password(pwhash, password):
+    """
+    Check `password` against `pwhash`. Raises PasswordPoolBusy.
+
+    Returns (valid, new_hash); new_hash is set when the stored hash should
+    be replaced because the configured parameters changed.
+    """
+    if not pwhash or password is None:
+        return False, None
+    return hash_pool.run(_verify, pwhash, password, PASSWORD_HASH_METHOD, PASSWORD_SALT_LENGTH)
@@ -0,0 +1,61 @@
+"""
+Background thread running a maintenance job on an interval.
+
+The rollup, SoC, fleet and schema refreshers all follow the same loop:
+inside an app context, call the job, and with `catch_up` keep calling it
+while it reports progress (a truthy return) so a backlog is worked off
+before sleeping for `interval` seconds. A failed run is rolled back and
+logged, and the thread carries on at the next interval.
+"""
+import logging
+import threading
+import time
+
+from models import db
+
+
+class Refresher:
+    def __init__(self, app, job, interval, name, catch_up=True, logger=None):
+        self.app = app
+        self.job = job
+        self.interval = interval
+        self.name = name
+        self.catch_up = catch_up
+        self.logger = logger or logging.getLogger(f"bms.{name}")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        """One pass of the job, repeated while it makes progress when catching up. Needs an app context."""
+        while self.job() and self.catch_up and not self._stop.is_set():
+            pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception:
+                    db.session.rollback()
+                    self.logger.exception("%s failed", self.name)
+            self._stop.wait(self.interval)
+
+    def run_forever(self):
+        """Standalone mode: run until Ctrl-C."""
+        self.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
@@ -0,0 +1,188 @@
+"""
+Minute/hour/day rollups of mqtt_data.
+
+A refresher aggregates only the rows added since the last run (tracked by
+mqtt_data.id in rollup_watermark) and merges them into each rollup table
+with INSERT ... ON CONFLICT DO UPDATE, so a refresh costs one pass over the
+new rows no matter how much history exists.
+
+The id watermark assumes mqtt_data ids become visible in order, which holds
+with the single ingest flusher; with several concurrent writers run the
+refresher with a ROLLUP_ID_LAG safety margin.
+
+Run standalone with:  python rollups.py
+"""
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import case, func, literal_column, or_, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert as pg_insert
+
+from models import (
+    db,
+    MqttData,
+    MqttRollupMinute,
+    MqttRollupHour,
+    MqttRollupDay,
+    RollupWatermark,
+)
+from refresher import Refresher
+
+logger = logging.getLogger("bms.rollups")
+
+ROLLUP_REFRESH_INTERVAL = float(os.getenv('ROLLUP_REFRESH_INTERVAL', 30))
+# Rows per refresh transaction; a backlog is worked off over several passes
+ROLLUP_MAX_ROWS = int(os.getenv('ROLLUP_MAX_ROWS', 500000))
+# Leave the newest N ids alone in case earlier ids are still uncommitted
+ROLLUP_ID_LAG = int(os.getenv('ROLLUP_ID_LAG', 0))
+# /api/graph picks the coarsest level that still yields this many buckets
+GRAPH_TARGET_POINTS = int(os.getenv('GRAPH_TARGET_POINTS', 200))
+
+WATERMARK_NAME = "mqtt_rollups"
+
+METRICS = ("voltage", "current", "temperature")
+
+# (name, bucket seconds, model), finest first
+ROLLUP_LEVELS = (
+    ("minute", 60, MqttRollupMinute),
+    ("hour", 3600, MqttRollupHour),
+    ("day", 86400, MqttRollupDay),
+)
+
+
+def _bucket_expr(seconds):
+    width = literal_column(str(seconds))
+    return func.to_timestamp(func.floor(func.extract("epoch", MqttData.ts) / width) * width)
+
+
+def _merge_into(model, seconds, lo_id, hi_id):
+    """Aggregate mqtt_data ids (lo_id, hi_id] into `model` and merge with existing buckets."""
+    bucket = _bucket_expr(seconds).label("bucket")
+    columns = [
+        MqttData.battery_id.label("battery_id"),
+        bucket,
+        func.count().label("sample_count"),
+        func.max(MqttData.ts).label("last_ts"),
+    ]
+    for name in METRICS:
+        col = getattr(MqttData, name)
+        columns += [
+            func.min(col).label(f"{name}_min"),
+            func.max(col).label(f"{name}_max"),
+            func.sum(col).label(f"{name}_sum"),
+            array_agg(aggregate_order_by(col, MqttData.ts.desc()))[1].label(f"{name}_last"),
+        ]
+
+    delta = (
+        select(*columns)
+        .where(MqttData.id > lo_id, MqttData.id <= hi_id, MqttData.battery_id.isnot(None))
+        .group_by(MqttData.battery_id, bucket)
+    )
+
+    names = [c.name for c in columns]
+    stmt = pg_insert(model.__table__).from_select(names, delta)
+    new = stmt.excluded
+    table = model.__table__.c
+    newer = or_(table.last_ts.is_(None), new.last_ts >= table.last_ts)
+
+    updates = {
+        "sample_count": table.sample_count + new.sample_count,
+        "last_ts": func.greatest(table.last_ts, new.last_ts),
+    }
+    for name in METRICS:
+        updates[f"{name}_min"] = func.least(table[f"{name}_min"], new[f"{name}_min"])
+        updates[f"{name}_max"] = func.greatest(table[f"{name}_max"], new[f"{name}_max"])
+        updates[f"{name}_sum"] = func.coalesce(table[f"{name}_sum"], 0) + func.coalesce(new[f"{name}_sum"], 0)
+        updates[f"{name}_last"] = case((newer, new[f"{name}_last"]), else_=table[f"{name}_last"])
+
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.battery_id, table.bucket],
+        set_=updates,
+    ))
+
+
+def refresh_rollups(max_rows=ROLLUP_MAX_ROWS):
+    """
+    Fold new mqtt_data rows into every rollup level in one transaction.
+
+    Returns the number of ids advanced; call again until it returns 0 to
+    catch up a backlog. Must run inside an app context.
+    """
+    watermark = db.session.get(RollupWatermark, WATERMARK_NAME, with_for_update=True)
+    if watermark is None:
+        watermark = RollupWatermark(name=WATERMARK_NAME, last_id=0)
+        db.session.add(watermark)
+        db.session.flush()
+
+    max_id = db.session.query(func.max(MqttData.id)).scalar() or 0
+    hi_id = min(max_id - ROLLUP_ID_LAG, watermark.last_id + max_rows)
+    if hi_id <= watermark.last_id:
+        db.session.rollback()
+        return 0
+
+    lo_id = watermark.last_id
+    for _, seconds, model in ROLLUP_LEVELS:
+        _merge_into(model, seconds, lo_id, hi_id)
+
+    watermark.last_id = hi_id
+    watermark.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("Rolled up mqtt_data ids %d..%d", lo_id + 1, hi_id)
+    return hi_id - lo_id
+
+
+def pick_rollup_level(start, end, target_points=GRAPH_TARGET_POINTS):
+    """Coarsest level that still gives at least target_points buckets over [start, end]."""
+    span = (end - start).total_seconds()
+    for name, seconds, model in reversed(ROLLUP_LEVELS):
+        if span / seconds >= target_points:
+            return name, seconds, model
+    return ROLLUP_LEVELS[0]
+
+
+def _as_float(value):
+    return float(value) if value is not None else None
+
+
+def read_rollup(model, start, end, battery_id=None, battery_ids=None):
+    """Rollup rows in [start, end] for one battery, or for `battery_ids` (all when None)."""
+    query = db.session.query(model).filter(model.bucket >= start, model.bucket <= end)
+    if battery_id is not None:
+        query = query.filter(model.battery_id == battery_id)
+    if battery_ids is not None:
+        if not battery_ids:
+            return []
+        query = query.filter(model.battery_id.in_(battery_ids))
+
+    data = []
+    for row in query.order_by(model.battery_id, model.bucket).all():
+        item = {
+            "timestamp": row.bucket.isoformat(sep=" ", timespec="seconds"),
+            "batteryId": str(row.battery_id),
+            "count": row.sample_count,
+        }
+        for name in METRICS:
+            total = getattr(row, f"{name}_sum")
+            item[f"{name}_min"] = _as_float(getattr(row, f"{name}_min"))
+            item[f"{name}_max"] = _as_float(getattr(row, f"{name}_max"))
+            item[f"{name}_avg"] = float(total) / row.sample_count if total is not None and row.sample_count else None
+            item[f"{name}_last"] = _as_float(getattr(row, f"{name}_last"))
+        data.append(item)
+    return data
+
+
+class RollupRefresher(Refresher):
+    """Background thread calling refresh_rollups every ROLLUP_REFRESH_INTERVAL seconds."""
+
+    def __init__(self, app, interval=ROLLUP_REFRESH_INTERVAL):
+        super().__init__(app, refresh_rollups, interval, "rollup-refresher", logger=logger)
+
+
+# ---------------- RUN REFRESHER ----------------
+if __name__ == '__main__':
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    RollupRefresher(app).run_forever()
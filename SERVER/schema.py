@@ -0,0 +1,375 @@
+"""
+Managed schema for the telemetry tables.
+
+On Postgres, mqtt_data is range-partitioned by ts into monthly partitions
+(mqtt_data_pYYYYMM) plus a default partition that catches stray timestamps.
+Future partitions are created ahead of time, and retention drops whole
+partitions instead of running DELETE; only the few stray rows in the
+default partition are deleted, in batches. Other databases get the plain
+model tables from db.create_all().
+
+Commands:
+  python schema.py create      create tables, partitions and missing indexes
+  python schema.py partition   convert an existing unpartitioned mqtt_data
+  python schema.py maintain    premake partitions and apply retention once
+  python schema.py backfill    stamp company_id on telemetry and fault rows
+                               written before tenant scoping
+"""
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import Index, MetaData, PrimaryKeyConstraint, Table, column, func, inspect, select, text
+from sqlalchemy import table as table_clause
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import db, BattDescription, BattFaultLog, MqttData, MqttFieldValue, Product
+from refresher import Refresher
+
+logger = logging.getLogger("bms.schema")
+
+# Monthly partitions created ahead of the current month
+PARTITION_PREMAKE_MONTHS = int(os.getenv('PARTITION_PREMAKE_MONTHS', 3))
+# Whole months of telemetry to keep; 0 keeps everything
+MQTT_RETENTION_MONTHS = int(os.getenv('MQTT_RETENTION_MONTHS', 0))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv('PARTITION_MAINTENANCE_INTERVAL', 3600))
+# Rows per UPDATE when backfilling company_id; each batch commits on its own
+BACKFILL_BATCH_ROWS = int(os.getenv('BACKFILL_BATCH_ROWS', 50000))
+# Rows per DELETE when retention prunes rows rather than partitions; each batch commits on its own
+RETENTION_DELETE_BATCH_ROWS = int(os.getenv('RETENTION_DELETE_BATCH_ROWS', 50000))
+
+PARENT = MqttData.__tablename__
+DEFAULT_PARTITION = f"{PARENT}_default"
+_PARTITION_RE = re.compile(rf"^{PARENT}_p(\d{{4}})(\d{{2}})$")
+
+
+# ---------------- HELPERS ----------------
+def is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def month_floor(dt):
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(dt, months):
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month.year:04d}{month.month:02d}"
+
+
+def partitioned_table():
+    """
+    The mqtt_data table as declared on the model, re-shaped for partitioning.
+
+    Postgres requires the partition key in every unique constraint, so the
+    primary key becomes (id, ts). Built from the model columns so new
+    columns and indexes are picked up automatically.
+    """
+    metadata = MetaData()
+    columns = []
+    for column in MqttData.__table__.columns:
+        copy = column._copy()
+        copy.primary_key = False
+        if column.name == "id":
+            copy.autoincrement = True
+            copy.nullable = False
+        columns.append(copy)
+
+    table = Table(
+        PARENT, metadata, *columns,
+        PrimaryKeyConstraint("id", "ts", name=f"{PARENT}_pkey"),
+        postgresql_partition_by="RANGE (ts)",
+    )
+    for index in MqttData.__table__.indexes:
+        Index(index.name, *[table.c[c.name] for c in index.columns], unique=index.unique)
+    return table
+
+
+def is_partitioned(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": PARENT}).first() is not None
+
+
+def list_partitions(conn):
+    """Monthly partitions attached to mqtt_data as {month_start: name}."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name AND pg_table_is_visible(p.oid)"
+    ), {"name": PARENT}).scalars()
+
+    partitions = {}
+    for name in rows:
+        match = _PARTITION_RE.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+# ---------------- PARTITION MANAGEMENT ----------------
+def create_partition(conn, month):
+    """
+    Create and attach the partition for `month`.
+
+    Rows for that month that already landed in the default partition are
+    moved over first, otherwise ATTACH would fail its constraint check.
+    """
+    name = partition_name(month)
+    lo, hi = month.isoformat(), add_months(month, 1).isoformat()
+
+    conn.execute(text(
+        f'CREATE TABLE "{name}" (LIKE "{PARENT}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    ))
+    conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE ts >= :lo AND ts < :hi RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved'
+    ), {"lo": lo, "hi": hi})
+    conn.execute(text(
+        f"ALTER TABLE \"{PARENT}\" ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{lo}') TO ('{hi}')"
+    ))
+    logger.info("Created partition %s [%s, %s)", name, lo, hi)
+    return name
+
+
+def ensure_partitions(ahead=PARTITION_PREMAKE_MONTHS, since=None):
+    """Make sure partitions exist from `since` (default: this month) through `ahead` months."""
+    if not is_postgres():
+        return []
+
+    now = month_floor(datetime.now(timezone.utc))
+    month = month_floor(since) if since else now
+    last = add_months(now, ahead)
+
+    created = []
+    with db.engine.begin() as conn:
+        existing = list_partitions(conn)
+        while month <= last:
+            if month not in existing:
+                created.append(create_partition(conn, month))
+            month = add_months(month, 1)
+    return created
+
+
+def delete_older_than(name, cutoff, batch_rows=RETENTION_DELETE_BATCH_ROWS):
+    """Delete rows of table `name` (with id and ts columns) older than `cutoff`, `batch_rows` per transaction."""
+    rows = table_clause(name, column("id"), column("ts"))
+    oldest = select(rows.c.id).where(rows.c.ts < cutoff).limit(batch_rows).scalar_subquery()
+    deleted = 0
+    while True:
+        with db.engine.begin() as conn:
+            count = conn.execute(rows.delete().where(rows.c.id.in_(oldest))).rowcount
+        deleted += count
+        if count < batch_rows:
+            break
+    if deleted:
+        logger.info("Deleted %d %s rows before %s", deleted, name, cutoff.date())
+    return deleted
+
+
+def apply_retention(months=MQTT_RETENTION_MONTHS):
+    """
+    Drop monthly partitions that ended more than `months` whole months ago.
+
+    Rows that old in the default partition and in the unpartitioned
+    mqtt_field_value are deleted, so stray timestamps and extracted fields
+    do not outlive the retention period either.
+    """
+    if not is_postgres() or months <= 0:
+        return []
+
+    cutoff = add_months(month_floor(datetime.now(timezone.utc)), -months)
+    dropped = []
+    with db.engine.begin() as conn:
+        for month, name in sorted(list_partitions(conn).items()):
+            if month < cutoff:
+                conn.execute(text(f'DROP TABLE "{name}"'))
+                dropped.append(name)
+                logger.info("Dropped partition %s (retention %d months)", name, months)
+        has_default = inspect(conn).has_table(DEFAULT_PARTITION)
+    if has_default:
+        delete_older_than(DEFAULT_PARTITION, cutoff)
+    delete_older_than(MqttFieldValue.__tablename__, cutoff)
+    return dropped
+
+
+def maintain_partitions():
+    return ensure_partitions(), apply_retention()
+
+
+# ---------------- SCHEMA CREATION ----------------
+def create_missing_columns():
+    """Nullable columns declared on the models that an older database does not have yet."""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+                col_type = column.type.compile(dialect=db.engine.dialect)
+                # On Postgres this also adds the column to every partition
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+
+def create_missing_indexes():
+    """Indexes declared on the models that an older database does not have yet."""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    conn.execute(CreateIndex(index))
+                    logger.info("Created index %s", index.name)
+
+
+def _create_partitioned_parent(conn):
+    table = partitioned_table()
+    conn.execute(CreateTable(table))
+    for index in table.indexes:
+        conn.execute(CreateIndex(index))
+    conn.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARENT}" DEFAULT'))
+
+
+def create_schema():
+    """Create every table; on Postgres mqtt_data is created partitioned. Needs an app context."""
+    if is_postgres() and not inspect(db.engine).has_table(PARENT):
+        with db.engine.begin() as conn:
+            _create_partitioned_parent(conn)
+        ensure_partitions()
+
+    db.create_all()
+    create_missing_columns()
+    create_missing_indexes()
+
+
+def partition_existing_table(keep_legacy=False):
+    """
+    One-off conversion of an unpartitioned mqtt_data into the partitioned layout.
+
+    Runs in one transaction: the old table is renamed, the partitioned parent
+    and monthly partitions covering its data are created, rows are copied and
+    the id sequence is moved past the highest copied id.
+    """
+    if not is_postgres():
+        raise RuntimeError("Partitioning is only supported on PostgreSQL")
+
+    legacy = f"{PARENT}_legacy"
+    with db.engine.begin() as conn:
+        if is_partitioned(conn):
+            logger.info("%s is already partitioned", PARENT)
+            return False
+
+        conn.execute(text(f'ALTER TABLE "{PARENT}" RENAME TO "{legacy}"'))
+        conn.execute(text(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{PARENT}_pkey" TO "{legacy}_pkey"'))
+        conn.execute(text(f'ALTER SEQUENCE IF EXISTS "{PARENT}_id_seq" RENAME TO "{legacy}_id_seq"'))
+        for index in MqttData.__table__.indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+
+        _create_partitioned_parent(conn)
+
+        first_ts, last_ts = conn.execute(text(f'SELECT min(ts), max(ts) FROM "{legacy}"')).one()
+        now = month_floor(datetime.now(timezone.utc))
+        month = month_floor(first_ts) if first_ts else now
+        last = max(month_floor(last_ts) if last_ts else now, add_months(now, PARTITION_PREMAKE_MONTHS))
+        while month <= last:
+            create_partition(conn, month)
+            month = add_months(month, 1)
+
+        names = ", ".join(f'"{c.name}"' for c in MqttData.__table__.columns)
+        conn.execute(text(f'INSERT INTO "{PARENT}" ({names}) SELECT {names} FROM "{legacy}"'))
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{PARENT}', 'id'), "
+            f'COALESCE((SELECT max(id) FROM "{PARENT}"), 0) + 1, false)'
+        ))
+        if not keep_legacy:
+            conn.execute(text(f'DROP TABLE "{legacy}"'))
+
+    logger.info("Converted %s to monthly partitions", PARENT)
+    return True
+
+
+# ---------------- TENANT BACKFILL ----------------
+def _backfill_table(model, key, battery_column, batch_rows):
+    """Stamp company_id in primary-key ranges of `batch_rows` so no UPDATE holds locks for long."""
+    company = (
+        select(Product.company_id)
+        .join(BattDescription, BattDescription.product_sl_no == Product.product_sl_no)
+        .where(BattDescription.batt_uid == battery_column)
+        .scalar_subquery()
+    )
+    lo, hi = db.session.execute(
+        select(func.min(key), func.max(key)).where(model.company_id.is_(None))
+    ).one()
+    if lo is None:
+        return 0
+
+    updated = 0
+    table = model.__table__
+    for start in range(lo, hi + 1, batch_rows):
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                table.update()
+                .where(key >= start, key < start + batch_rows, model.company_id.is_(None))
+                .values(company_id=company)
+            )
+        updated += result.rowcount
+    logger.info("Stamped company_id on %d %s rows", updated, table.name)
+    return updated
+
+
+def backfill_company_ids(batch_rows=BACKFILL_BATCH_ROWS):
+    """company_id for telemetry and fault rows written before it was stamped at ingest."""
+    return {
+        MqttData.__tablename__: _backfill_table(MqttData, MqttData.id, MqttData.battery_id, batch_rows),
+        BattFaultLog.__tablename__: _backfill_table(
+            BattFaultLog, BattFaultLog.fault_id, BattFaultLog.batt_uid, batch_rows),
+    }
+
+
+class SchemaMaintainer(Refresher):
+    """Background thread running maintain_partitions every PARTITION_MAINTENANCE_INTERVAL seconds."""
+
+    def __init__(self, app, interval=PARTITION_MAINTENANCE_INTERVAL):
+        super().__init__(app, maintain_partitions, interval, "schema-maintainer", catch_up=False, logger=logger)
+
+
+# ---------------- COMMANDS ----------------
+if __name__ == '__main__':
+    import argparse
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    parser = argparse.ArgumentParser(description="Manage the BMS database schema")
+    parser.add_argument("command", choices=["create", "partition", "maintain", "backfill"])
+    parser.add_argument("--keep-legacy", action="store_true",
+                        help="keep mqtt_data_legacy after 'partition'")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == "create":
+            create_schema()
+        elif args.command == "partition":
+            partition_existing_table(keep_legacy=args.keep_legacy)
+        elif args.command == "backfill":
+            print(backfill_company_ids())
+        else:
+            created, dropped = maintain_partitions()
+            print(f"created={created} dropped={dropped}")
@@ -0,0 +1,201 @@
+"""
+In-memory latest reading per battery.
+
+Fed by the ingest worker (see ingest.IngestWorker.add_listener) and warmed
+from the database with a single DISTINCT ON (battery_id) query, so
+/api/sensor never scans mqtt_data on the request path.
+
+When ingest runs in another process the cache tails mqtt_data instead:
+at most every SENSOR_CACHE_MAX_AGE seconds one request fetches the rows
+past the highest id it has seen (a primary key range scan), while
+concurrent requests keep serving what is cached. Like the rollups, this
+assumes ids become visible in order; SENSOR_ID_LAG leaves the newest ids
+for the next pass when there are several writers.
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import timezone
+
+from sqlalchemy import func
+
+from models import db, MqttData
+
+# Recent readings kept per battery for /api/sensor/logs
+SENSOR_LOG_SIZE = int(os.getenv('SENSOR_LOG_SIZE', 60))
+# When nothing feeds the cache in-process, catch up with mqtt_data after this many seconds
+SENSOR_CACHE_MAX_AGE = float(os.getenv('SENSOR_CACHE_MAX_AGE', 1.0))
+# Rows read per catch-up; a cache further behind than this is warmed again
+SENSOR_CATCHUP_MAX_ROWS = int(os.getenv('SENSOR_CATCHUP_MAX_ROWS', 50000))
+# Leave the newest N ids alone in case earlier ids are still uncommitted
+SENSOR_ID_LAG = int(os.getenv('SENSOR_ID_LAG', 0))
+
+READING_COLUMNS = (
+    MqttData.battery_id, MqttData.ts, MqttData.voltage,
+    MqttData.current, MqttData.temperature, MqttData.device_id,
+)
+
+
+def _as_float(value):
+    return float(value) if value is not None else None
+
+
+def make_reading(battery_id, ts, voltage, current, temperature, device_id=None):
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return {
+        "batteryId": battery_id,
+        "deviceId": device_id,
+        "timestamp": ts.isoformat(sep=" ", timespec="seconds"),
+        "ts": ts,
+        "voltage": _as_float(voltage),
+        "current": _as_float(current),
+        "temperature": _as_float(temperature),
+    }
+
+
+def public_reading(reading):
+    return {k: v for k, v in reading.items() if k != "ts"}
+
+
+class LatestReadingCache:
+    def __init__(self, log_size=SENSOR_LOG_SIZE, max_age=SENSOR_CACHE_MAX_AGE,
+                 catchup_max_rows=SENSOR_CATCHUP_MAX_ROWS, id_lag=SENSOR_ID_LAG):
+        self.log_size = log_size
+        self.max_age = max_age
+        self.catchup_max_rows = catchup_max_rows
+        self.id_lag = id_lag
+        self.fed_by_ingest = False
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()   # one warm/catch-up at a time
+        self._latest = {}   # battery_id -> reading
+        self._recent = {}   # battery_id -> deque of readings, oldest first
+        self._warmed_at = None
+        self._last_id = 0   # mqtt_data rows up to here are folded in
+
+    def update(self, rows):
+        """Ingest listener: fold a committed batch of MqttData row dicts in."""
+        with self._lock:
+            for row in rows:
+                reading = make_reading(
+                    row["battery_id"], row["ts"], row["voltage"],
+                    row["current"], row["temperature"], row.get("device_id"),
+                )
+                self._put(reading)
+
+    def _put(self, reading):
+        battery_id = reading["batteryId"]
+        recent = self._recent.get(battery_id)
+        if recent is None:
+            recent = self._recent[battery_id] = deque(maxlen=self.log_size)
+        recent.append(reading)
+
+        current = self._latest.get(battery_id)
+        if current is None or current["ts"] <= reading["ts"]:
+            self._latest[battery_id] = reading
+
+    def _max_id(self):
+        return (db.session.query(func.max(MqttData.id)).scalar() or 0) - self.id_lag
+
+    def warm(self):
+        """Load the newest row per battery; must run inside an app context."""
+        # Rows past last_id are left to the next catch-up
+        last_id = self._max_id()
+        if db.engine.dialect.name == "postgresql":
+            rows = (
+                db.session.query(*READING_COLUMNS)
+                .filter(MqttData.id <= last_id)
+                .distinct(MqttData.battery_id)
+                .order_by(MqttData.battery_id, MqttData.ts.desc())
+                .all()
+            )
+        else:
+            newest = (
+                db.session.query(MqttData.battery_id, func.max(MqttData.ts).label("ts"))
+                .filter(MqttData.id <= last_id)
+                .group_by(MqttData.battery_id)
+                .subquery()
+            )
+            rows = (
+                db.session.query(*READING_COLUMNS)
+                .join(newest, (MqttData.battery_id == newest.c.battery_id) & (MqttData.ts == newest.c.ts))
+                .filter(MqttData.id <= last_id)
+                .all()
+            )
+
+        with self._lock:
+            for row in rows:
+                if row.battery_id is None:
+                    continue
+                reading = make_reading(*row)
+                current = self._latest.get(row.battery_id)
+                if current is None or current["ts"] < reading["ts"]:
+                    self._put(reading)
+            self._last_id = max(self._last_id, last_id)
+            self._warmed_at = time.monotonic()
+
+    def catch_up(self):
+        """Fold in mqtt_data rows added since the last warm/catch-up; must run inside an app context."""
+        hi_id = self._max_id()
+        if hi_id <= self._last_id:
+            self._warmed_at = time.monotonic()
+            return 0
+        if hi_id - self._last_id > self.catchup_max_rows:
+            self.warm()
+            return 0
+
+        rows = (
+            db.session.query(*READING_COLUMNS)
+            .filter(MqttData.id > self._last_id, MqttData.id <= hi_id)
+            .order_by(MqttData.id)
+            .all()
+        )
+        with self._lock:
+            for row in rows:
+                if row.battery_id is not None:
+                    self._put(make_reading(*row))
+            self._last_id = hi_id
+            self._warmed_at = time.monotonic()
+        return len(rows)
+
+    def ensure_fresh(self):
+        """Warm on first use, and catch up periodically when no ingest listener feeds us."""
+        if self._warmed_at is None:
+            with self._refreshing:
+                if self._warmed_at is None:
+                    self.warm()
+        elif not self.fed_by_ingest and time.monotonic() - self._warmed_at > self.max_age:
+            # Whoever gets here first refreshes; the rest serve the cached readings
+            if self._refreshing.acquire(blocking=False):
+                try:
+                    self.catch_up()
+                finally:
+                    self._refreshing.release()
+
+    def latest(self, battery_id=None, batteries=None):
+        """Newest reading for `battery_id`, or for every battery; `batteries` limits what is visible."""
+        with self._lock:
+            if battery_id is not None:
+                reading = self._latest.get(battery_id)
+                visible = batteries is None or battery_id in batteries
+                return [public_reading(reading)] if reading and visible else []
+            return [
+                public_reading(r) for bid, r in sorted(self._latest.items())
+                if batteries is None or bid in batteries
+            ]
+
+    def recent(self, battery_id=None, batteries=None):
+        with self._lock:
+            if battery_id is not None:
+                if batteries is not None and battery_id not in batteries:
+                    return []
+                return [public_reading(r) for r in self._recent.get(battery_id, ())]
+            return {
+                str(bid): [public_reading(r) for r in readings]
+                for bid, readings in sorted(self._recent.items())
+                if batteries is None or bid in batteries
+            }
+
+
+sensor_cache = LatestReadingCache()
@@ -0,0 +1,260 @@
+"""
+State-of-charge and remaining-time estimation into batt_health.
+
+Each run reads only the mqtt_data rows past an id watermark, for the whole
+fleet at once, sorted by battery. Coulomb counting is done with NumPy
+across all batteries in one pass: a trapezoid integral of current over
+time, summed per battery with np.add.reduceat. A battery whose last sample
+is at rest (|I| below SOC_REST_CURRENT) is pulled towards the SoC implied by
+its open-circuit voltage. Per-battery state (soc, last ts, last current)
+lives in batt_soc_state, so nothing is ever recomputed from the start.
+
+Like the rollups, the watermark assumes ids become visible in order; with
+several concurrent writers run with a SOC_ID_LAG safety margin, since a
+sample skipped past by the watermark is never integrated.
+
+Sign convention: positive current discharges the battery unless
+SOC_CURRENT_SIGN=-1.
+
+Run standalone with:  python soc_estimator.py
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import Float, cast, func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, BattDescription, BattHealth, BattSocState, MqttData, RollupWatermark
+from refresher import Refresher
+
+logger = logging.getLogger("bms.soc")
+
+SOC_REFRESH_INTERVAL = float(os.getenv('SOC_REFRESH_INTERVAL', 60))
+SOC_MAX_ROWS = int(os.getenv('SOC_MAX_ROWS', 1000000))
+# Leave the newest N ids alone in case earlier ids are still uncommitted
+SOC_ID_LAG = int(os.getenv('SOC_ID_LAG', 0))
+SOC_CURRENT_SIGN = float(os.getenv('SOC_CURRENT_SIGN', 1))
+# Gaps longer than this are not integrated (device offline)
+SOC_MAX_GAP = float(os.getenv('SOC_MAX_GAP', 300))
+SOC_REST_CURRENT = float(os.getenv('SOC_REST_CURRENT', 0.5))
+# How far one rested update moves SoC towards the OCV estimate
+SOC_OCV_WEIGHT = float(os.getenv('SOC_OCV_WEIGHT', 0.2))
+SOC_DEFAULT_CAPACITY_AH = float(os.getenv('SOC_DEFAULT_CAPACITY_AH', 100))
+SOC_DEFAULT_NOMINAL_V = float(os.getenv('SOC_DEFAULT_NOMINAL_V', 12.8))
+
+WATERMARK_NAME = "soc_estimator"
+
+# Open-circuit voltage -> SoC for a 12.8 V LiFePO4 pack; scaled by nominal voltage
+OCV_VOLTS = np.array([10.0, 12.0, 12.8, 12.9, 13.0, 13.1, 13.2, 13.3, 13.4, 13.6])
+OCV_SOC = np.array([0.0, 0.09, 0.14, 0.17, 0.30, 0.40, 0.70, 0.90, 0.99, 1.0])
+
+SEVERITY_LEVELS = ((0.10, "critical"), (0.20, "high"), (0.40, "medium"))
+
+
+def ocv_soc(voltage, nominal):
+    return np.interp(voltage * (SOC_DEFAULT_NOMINAL_V / nominal), OCV_VOLTS, OCV_SOC)
+
+
+def severity(soc):
+    for limit, level in SEVERITY_LEVELS:
+        if soc < limit:
+            return level
+    return "normal"
+
+
+def _epoch(ts):
+    # sqlite hands back naive datetimes; every stored ts is UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def _as_array(values, default):
+    return np.array([default if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def estimate(batch, states, specs):
+    """
+    Advance SoC for every battery in `batch`.
+
+    batch   dict of equal-length arrays sorted by (battery, ts): battery,
+            ts (epoch s), current, voltage, temperature
+    states  {battery_id: (soc, last_ts_epoch, last_current)}
+    specs   {battery_id: (capacity_ah, nominal_v)}
+
+    Returns a list of result dicts, one per battery.
+    """
+    battery, ts = batch["battery"], batch["ts"]
+    current = np.nan_to_num(batch["current"]) * SOC_CURRENT_SIGN
+    voltage = batch["voltage"]
+
+    starts = np.flatnonzero(np.r_[True, battery[1:] != battery[:-1]])
+    ends = np.r_[starts[1:], battery.size] - 1
+    ids = battery[starts]
+
+    # Trapezoid charge (A*s) between consecutive samples of the same battery
+    dt = np.diff(ts)
+    same = battery[1:] == battery[:-1]
+    step = np.where(same & (dt > 0) & (dt <= SOC_MAX_GAP), 0.5 * (current[1:] + current[:-1]) * dt, 0.0)
+    charge = np.add.reduceat(np.r_[0.0, step], starts)
+
+    # Previous state for each group, or NaN for batteries seen for the first time
+    prev = np.array([states.get(int(b), (np.nan, np.nan, np.nan)) for b in ids], dtype=np.float64).reshape(-1, 3)
+    prev_soc, prev_ts, prev_i = prev[:, 0], prev[:, 1], prev[:, 2]
+    bridge_dt = ts[starts] - prev_ts
+    bridge_ok = ~np.isnan(prev_ts) & (bridge_dt > 0) & (bridge_dt <= SOC_MAX_GAP)
+    charge += np.where(bridge_ok, 0.5 * (current[starts] + np.nan_to_num(prev_i)) * np.nan_to_num(bridge_dt), 0.0)
+
+    spec = np.array([specs.get(int(b), (SOC_DEFAULT_CAPACITY_AH, SOC_DEFAULT_NOMINAL_V)) for b in ids],
+                    dtype=np.float64).reshape(-1, 2)
+    capacity, nominal = spec[:, 0], spec[:, 1]
+
+    first_v = np.nan_to_num(voltage[starts], nan=nominal)
+    soc0 = np.where(np.isnan(prev_soc), ocv_soc(first_v, nominal), prev_soc)
+    soc = np.clip(soc0 - charge / (capacity * 3600.0), 0.0, 1.0)
+
+    # OCV correction when the battery is resting at the end of the batch
+    last_v = voltage[ends]
+    rested = (np.abs(current[ends]) < SOC_REST_CURRENT) & ~np.isnan(last_v)
+    soc = np.where(rested, soc + SOC_OCV_WEIGHT * (ocv_soc(np.nan_to_num(last_v), nominal) - soc), soc)
+
+    # Average discharge current over the batch for time-to-empty
+    counts = ends - starts + 1
+    avg_i = np.add.reduceat(current, starts) / counts
+
+    results = []
+    for k, battery_id in enumerate(ids):
+        remaining = None
+        if avg_i[k] > SOC_REST_CURRENT:
+            remaining = timedelta(hours=float(soc[k] * capacity[k] / avg_i[k]))
+        end = ends[k]
+        results.append({
+            "battery_id": int(battery_id),
+            "soc": float(soc[k]),
+            "last_ts": float(ts[end]),
+            "last_current": float(current[end] * SOC_CURRENT_SIGN),
+            "voltage": None if np.isnan(voltage[end]) else float(voltage[end]),
+            "temperature": None if np.isnan(batch["temperature"][end]) else float(batch["temperature"][end]),
+            "remaining": remaining,
+        })
+    return results
+
+
+def _load_batch(lo_id, hi_id):
+    rows = (
+        db.session.query(
+            MqttData.battery_id,
+            MqttData.ts,
+            cast(MqttData.current, Float),
+            cast(MqttData.voltage, Float),
+            cast(MqttData.temperature, Float),
+        )
+        .filter(MqttData.id > lo_id, MqttData.id <= hi_id, MqttData.battery_id.isnot(None))
+        .order_by(MqttData.battery_id, MqttData.ts, MqttData.id)
+        .all()
+    )
+    n = len(rows)
+    return {
+        "battery": np.fromiter((r[0] for r in rows), dtype=np.int64, count=n),
+        "ts": np.fromiter((_epoch(r[1]) for r in rows), dtype=np.float64, count=n),
+        "current": _as_array((r[2] for r in rows), np.nan),
+        "voltage": _as_array((r[3] for r in rows), np.nan),
+        "temperature": _as_array((r[4] for r in rows), np.nan),
+    }
+
+
+def _save_states(results):
+    values = [{
+        "battery_id": r["battery_id"],
+        "soc": r["soc"],
+        "last_ts": datetime.fromtimestamp(r["last_ts"], timezone.utc),
+        "last_current": r["last_current"],
+        "updated_at": datetime.utcnow(),
+    } for r in results]
+
+    table = BattSocState.__table__
+    if db.engine.dialect.name == "postgresql":
+        stmt = pg_insert(table)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.battery_id],
+            set_={c: stmt.excluded[c] for c in ("soc", "last_ts", "last_current", "updated_at")},
+        ), values)
+    else:
+        db.session.execute(table.delete().where(table.c.battery_id.in_([v["battery_id"] for v in values])))
+        db.session.execute(insert(table), values)
+
+
+def refresh_soc(max_rows=SOC_MAX_ROWS):
+    """
+    Fold new samples into every battery's SoC and write one batt_health row each.
+
+    Returns the number of ids advanced; call until 0 to catch up. Must run
+    inside an app context.
+    """
+    watermark = db.session.get(RollupWatermark, WATERMARK_NAME, with_for_update=True)
+    if watermark is None:
+        watermark = RollupWatermark(name=WATERMARK_NAME, last_id=0)
+        db.session.add(watermark)
+        db.session.flush()
+
+    max_id = db.session.query(func.max(MqttData.id)).scalar() or 0
+    hi_id = min(max_id - SOC_ID_LAG, watermark.last_id + max_rows)
+    if hi_id <= watermark.last_id:
+        db.session.rollback()
+        return 0
+
+    lo_id = watermark.last_id
+    batch = _load_batch(lo_id, hi_id)
+    if batch["battery"].size:
+        ids = np.unique(batch["battery"]).tolist()
+        states = {
+            s.battery_id: (s.soc, _epoch(s.last_ts), s.last_current if s.last_current is not None else np.nan)
+            for s in db.session.query(BattSocState).filter(BattSocState.battery_id.in_(ids))
+        }
+        specs = {
+            b.batt_uid: (float(b.batt_capacity or SOC_DEFAULT_CAPACITY_AH),
+                         float(b.batt_voltage or SOC_DEFAULT_NOMINAL_V))
+            for b in db.session.query(
+                BattDescription.batt_uid, BattDescription.batt_capacity, BattDescription.batt_voltage
+            ).filter(BattDescription.batt_uid.in_(ids))
+        }
+
+        results = estimate(batch, states, specs)
+        _save_states(results)
+
+        # batt_health.batt_uid references batt_description
+        health = [{
+            "batt_uid": r["battery_id"],
+            "batt_volt": r["voltage"],
+            "batt_current": r["last_current"],
+            "batt_temp": r["temperature"],
+            "soc": round(r["soc"] * 100, 2),
+            "batt_remaining_time": r["remaining"],
+            "batt_severity": severity(r["soc"]),
+        } for r in results if r["battery_id"] in specs]
+        if health:
+            db.session.execute(insert(BattHealth), health)
+
+    watermark.last_id = hi_id
+    watermark.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("SoC updated from mqtt_data ids %d..%d", lo_id + 1, hi_id)
+    return hi_id - lo_id
+
+
+class SocRefresher(Refresher):
+    """Background thread calling refresh_soc every SOC_REFRESH_INTERVAL seconds."""
+
+    def __init__(self, app, interval=SOC_REFRESH_INTERVAL):
+        super().__init__(app, refresh_soc, interval, "soc-refresher", logger=logger)
+
+
+# ---------------- RUN ESTIMATOR ----------------
+if __name__ == '__main__':
+    from main import create_app
+
+    app = create_app()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    SocRefresher(app).run_forever()
@@ -0,0 +1,358 @@
+"""
+Telemetry read routes: raw/downsampled/delta datalogs, the latest-reading
+sensor cache, rollup-backed graphs, typed payload fields, the fleet
+snapshot and CSV export.
+
+Every route is scoped to the caller's company: datalogs through the
+denormalized mqtt_data.company_id, the caches and rollups through the
+company's battery set from tenants.battery_companies.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import Float, cast, func
+
+from auth import company_required
+from csv_export import stream_csv
+from downsampling import (
+    DATALOG_MAX_POINTS,
+    LTTB_OVERSAMPLE,
+    bucketed_datalogs,
+    lttb_datalogs,
+    parse_resolution,
+    pick_bucket_seconds,
+)
+from fastjson import dumps, json_response, timestamp_text
+from fields import FIELDS
+from fleet import read_fleet
+from metrics import timed
+from models import db, MqttData, MqttFieldValue
+from pagination import keyset_page, parse_limit
+from rollups import pick_rollup_level, read_rollup
+from sensor_cache import sensor_cache
+from tenants import battery_companies
+from wire import WIRE_FORMATS, binary_datalogs, columnar_datalogs, wire_response
+
+telemetry_bp = Blueprint('telemetry', __name__, url_prefix='/api')
+
+
+# ---------------- QUERY FILTERS ----------------
+def filter_datalogs(query, company_id, model=MqttData):
+    """Scope a `model` query to `company_id` and apply the start/end/battery_id request filters."""
+    query = query.filter(model.company_id == company_id)
+
+    start_date = request.args.get("start")
+    end_date = request.args.get("end")
+    battery_id = request.args.get("battery_id")
+
+    if start_date:
+        try:
+            query = query.filter(model.ts >= datetime.fromisoformat(start_date))
+        except Exception:
+            pass
+
+    if end_date:
+        try:
+            query = query.filter(model.ts <= datetime.fromisoformat(end_date))
+        except Exception:
+            pass
+
+    if battery_id and battery_id.lower() != "all":
+        try:
+            query = query.filter(model.battery_id == int(battery_id))
+        except ValueError:
+            pass
+
+    return query
+
+
+# ---------------- DATALOG ROUTE ----------------
+@telemetry_bp.route("/datalogs", methods=["GET"])
+@company_required
+def get_datalogs(company_id):
+    query = filter_datalogs(db.session.query(MqttData), company_id)
+
+    # Downsampled mode: aggregate per battery and time bucket in SQL
+    if request.args.get("resolution") or request.args.get("max_points"):
+        return get_datalogs_downsampled(query)
+
+    fmt = request.args.get("format", "json").lower()
+    if fmt not in WIRE_FORMATS:
+        return jsonify({"error": f"Unknown format: {fmt}"}), 400
+
+    # Plain column tuples: no ORM hydration, no payload_json, floats from the driver
+    query = query.with_entities(*DATALOG_COLUMNS)
+
+    # Delta mode: only rows after the client's watermark
+    if "since_id" in request.args or "since_ts" in request.args:
+        return get_datalogs_delta(query, fmt)
+
+    # Keyset pagination: only when the client asks for pages
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = parse_limit(request.args.get("limit"))
+            logs, next_cursor = keyset_page(
+                query, MqttData.ts, MqttData.id, limit, request.args.get("cursor")
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return render_datalogs(logs, fmt, {"next_cursor": next_cursor})
+
+    logs = query.order_by(MqttData.ts.desc()).all()
+    return render_datalogs(logs, fmt)
+
+
+DELTA_MAX_ROWS = int(os.getenv('DELTA_MAX_ROWS', 10000))
+
+
+def get_datalogs_delta(query, fmt):
+    """
+    Rows newer than since_id (preferred) or since_ts, oldest first.
+
+    Returns the new watermark alongside the rows. When the watermark has
+    aged out of retention or more than DELTA_MAX_ROWS rows arrived since,
+    no rows are sent and "reset" tells the client to reload its window.
+    """
+    try:
+        since_id = int(request.args["since_id"]) if request.args.get("since_id") else None
+        since_ts = datetime.fromisoformat(request.args["since_ts"]) if request.args.get("since_ts") else None
+    except ValueError:
+        return jsonify({"error": "Invalid since_id or since_ts"}), 400
+    if since_id is None and since_ts is None:
+        return jsonify({"error": "since_id or since_ts required"}), 400
+    # Ingest stamps ts in UTC: read a naive since_ts as UTC and convert any other offset
+    if since_ts is not None:
+        since_ts = since_ts.replace(tzinfo=timezone.utc) if since_ts.tzinfo is None else since_ts.astimezone(timezone.utc)
+
+    if since_id is not None:
+        oldest = db.session.query(func.min(MqttData.id)).scalar()
+        aged_out = oldest is not None and since_id < oldest - 1
+        query = query.filter(MqttData.id > since_id).order_by(MqttData.id)
+    else:
+        # Compared in SQL, so the driver's datetime flavour never meets since_ts in Python
+        aged_out = bool(db.session.query(func.min(MqttData.ts) > since_ts).scalar())
+        query = query.filter(MqttData.ts > since_ts).order_by(MqttData.ts, MqttData.id)
+
+    rows = [] if aged_out else query.limit(DELTA_MAX_ROWS + 1).all()
+    reset = aged_out or len(rows) > DELTA_MAX_ROWS
+    if reset:
+        rows = []
+
+    watermark = {
+        "since_id": max((r.id for r in rows), default=since_id),
+        "since_ts": max((r.ts for r in rows), default=since_ts),
+    }
+    watermark["since_ts"] = timestamp_text(watermark["since_ts"])
+    return render_datalogs(rows, fmt, {"watermark": watermark, "reset": reset})
+
+
+DATALOG_COLUMNS = (
+    MqttData.id,
+    MqttData.ts,
+    cast(MqttData.current, Float).label("current"),
+    cast(MqttData.temperature, Float).label("temperature"),
+    cast(MqttData.voltage, Float).label("voltage"),
+    MqttData.battery_id,
+)
+
+
+def render_datalogs(rows, fmt, envelope=None):
+    """
+    Encode datalog rows as json/columnar/binary with ETag and compression.
+
+    `envelope` fields (cursor, watermark, ...) wrap the rows in JSON formats
+    and become X-* headers for binary.
+    """
+    with timed("serialize"):
+        return _render_datalogs(rows, fmt, envelope)
+
+
+def _render_datalogs(rows, fmt, envelope):
+    if fmt == "binary":
+        headers = {}
+        for key, value in (envelope or {}).items():
+            name = "X-" + key.replace("_", "-").title()
+            headers[name] = dumps(value).decode() if isinstance(value, (dict, bool)) else value
+        headers = {k: v for k, v in headers.items() if v is not None}
+        return wire_response(binary_datalogs(rows), fmt, headers=headers)
+
+    data = columnar_datalogs(rows) if fmt == "columnar" else serialize_datalogs(rows)
+    if envelope is not None:
+        data = {"data": data, **envelope}
+    return wire_response(data, fmt)
+
+
+def serialize_datalogs(rows):
+    return [{
+        "timestamp": timestamp_text(ts),
+        "current": current,
+        "temperature": temperature,
+        "voltage": voltage,
+        "batteryId": str(battery_id)
+    } for _, ts, current, temperature, voltage, battery_id in rows]
+
+
+def get_datalogs_downsampled(query):
+    """Bucketed min/max/avg/last per battery, optionally reduced further with LTTB."""
+    reducer = (request.args.get("reducer") or "").lower()
+    if reducer not in ("", "none", "lttb"):
+        return jsonify({"error": f"Unknown reducer: {reducer}"}), 400
+
+    try:
+        resolution = parse_resolution(request.args.get("resolution"))
+        max_points = int(request.args.get("max_points") or DATALOG_MAX_POINTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    max_points = max(1, min(max_points, DATALOG_MAX_POINTS))
+
+    first_ts, last_ts = query.with_entities(
+        func.min(MqttData.ts), func.max(MqttData.ts)
+    ).order_by(None).one()
+    if first_ts is None:
+        return jsonify({"resolution": None, "reducer": reducer or None, "data": []}), 200
+
+    # LTTB picks from a finer grid so it has real peaks to choose between
+    oversample = LTTB_OVERSAMPLE if reducer == "lttb" else 1
+    if resolution is None:
+        resolution = pick_bucket_seconds(first_ts, last_ts, max_points * oversample)
+    else:
+        # An explicit resolution may not ask for more than DATALOG_MAX_POINTS buckets either
+        resolution = max(resolution, pick_bucket_seconds(first_ts, last_ts, DATALOG_MAX_POINTS * oversample))
+
+    data = bucketed_datalogs(query, resolution)
+
+    if reducer == "lttb":
+        try:
+            data = lttb_datalogs(data, max_points, request.args.get("lttb_field", "voltage"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    return wire_response({"resolution": resolution, "reducer": reducer or None, "data": data})
+
+
+# ---------------- FIELD ROUTE ----------------
+@telemetry_bp.route("/datalogs/fields", methods=["GET"])
+@company_required
+def get_field_values(company_id):
+    """Typed payload fields, e.g. ?field=soc,cell_voltage_min; same filters and paging as /datalogs."""
+    names = [name for name in (request.args.get("field") or "").split(",") if name]
+    unknown = [name for name in names if name not in FIELDS]
+    if not names or unknown:
+        return jsonify({"error": f"Unknown field: {','.join(unknown)}" if unknown else "field required",
+                        "fields": sorted(FIELDS)}), 400
+
+    query = filter_datalogs(db.session.query(MqttFieldValue), company_id, MqttFieldValue)
+    query = query.filter(MqttFieldValue.name.in_(names)).with_entities(
+        MqttFieldValue.id, MqttFieldValue.ts, MqttFieldValue.battery_id,
+        MqttFieldValue.name, MqttFieldValue.value,
+    )
+
+    envelope = {}
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = parse_limit(request.args.get("limit"))
+            rows, envelope["next_cursor"] = keyset_page(
+                query, MqttFieldValue.ts, MqttFieldValue.id, limit, request.args.get("cursor")
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        rows = query.order_by(MqttFieldValue.ts.desc()).all()
+
+    with timed("serialize"):
+        data = [{
+            "timestamp": timestamp_text(ts),
+            "batteryId": str(battery_id),
+            "field": name,
+            "value": value,
+        } for _, ts, battery_id, name, value in rows]
+        return wire_response({"data": data, **envelope} if envelope else data)
+
+
+# ---------------- FLEET ROUTE ----------------
+@telemetry_bp.route("/fleet", methods=["GET"])
+@company_required
+def get_fleet(company_id):
+    """Snapshot of every battery of the company with per-product rollups; ?product=<product_sl_no> narrows it."""
+    product = request.args.get("product")
+    try:
+        product = int(product) if product and product.lower() != "all" else None
+    except ValueError:
+        return jsonify({"error": f"Invalid product: {product}"}), 400
+
+    fleet = read_fleet(company_id, product)
+    with timed("serialize"):
+        return json_response(fleet)
+
+
+# ---------------- SENSOR ROUTES ----------------
+def _battery_id_arg():
+    battery_id = request.args.get("battery_id")
+    if battery_id and battery_id.lower() != "all":
+        return int(battery_id)
+    return None
+
+
+@telemetry_bp.route("/sensor", methods=["GET"])
+@company_required
+def get_sensor(company_id):
+    """Latest reading per battery, served from the in-memory cache."""
+    try:
+        battery_id = _battery_id_arg()
+    except ValueError:
+        return jsonify({"error": "Invalid battery_id"}), 400
+
+    sensor_cache.ensure_fresh()
+    return jsonify(sensor_cache.latest(battery_id, battery_companies.batteries_for(company_id))), 200
+
+
+@telemetry_bp.route("/sensor/logs", methods=["GET"])
+@company_required
+def get_sensor_logs(company_id):
+    """Last SENSOR_LOG_SIZE readings per battery seen by the cache."""
+    try:
+        battery_id = _battery_id_arg()
+    except ValueError:
+        return jsonify({"error": "Invalid battery_id"}), 400
+
+    sensor_cache.ensure_fresh()
+    return jsonify(sensor_cache.recent(battery_id, battery_companies.batteries_for(company_id))), 200
+
+
+# ---------------- GRAPH ROUTE ----------------
+@telemetry_bp.route("/graph", methods=["GET"])
+@company_required
+def get_graph(company_id):
+    """Chart aggregates from the coarsest rollup that still resolves the range."""
+    try:
+        battery_id = _battery_id_arg()
+        end = datetime.fromisoformat(request.args["end"]) if request.args.get("end") else datetime.utcnow()
+        start = datetime.fromisoformat(request.args["start"]) if request.args.get("start") else end - timedelta(days=1)
+    except ValueError:
+        return jsonify({"error": "Invalid battery_id, start or end"}), 400
+    if start > end:
+        return jsonify({"error": "start must be before end"}), 400
+
+    level, seconds, model = pick_rollup_level(start, end)
+    data = read_rollup(model, start, end, battery_id, battery_companies.batteries_for(company_id))
+    return wire_response({"resolution": level, "bucket_seconds": seconds, "data": data})
+
+
+DATALOG_CSV_COLUMNS = [
+    ("id", MqttData.id),
+    ("timestamp", MqttData.ts),
+    ("device_id", MqttData.device_id),
+    ("battery_id", MqttData.battery_id),
+    ("voltage", MqttData.voltage),
+    ("current", MqttData.current),
+    ("temperature", MqttData.temperature),
+]
+
+
+@telemetry_bp.route("/datalogs/csv", methods=["GET"])
+@company_required
+def download_datalogs_csv(company_id):
+    query = filter_datalogs(db.session.query(MqttData), company_id)
+    query = query.order_by(MqttData.ts.desc(), MqttData.id.desc())
+    return stream_csv(query, DATALOG_CSV_COLUMNS, "datalogs.csv")
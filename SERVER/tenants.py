@@ -0,0 +1,106 @@
+"""
+Battery -> company map used to scope telemetry to a tenant.
+
+Resolving a reading's company means walking mqtt_data.battery_id ->
+batt_description -> product -> company, which is too slow per request.
+Instead mqtt_data and batt_fault_log carry a denormalized company_id,
+stamped at write time from this map, and tenant queries read only their
+own (company_id, ts) index range.
+
+The map is one join query. It is reloaded every TENANT_MAP_MAX_AGE
+seconds, after any BattDescription or Product change in this process, and
+when an unknown battery shows up (at most once per TENANT_MAP_MISS_INTERVAL
+seconds, so a misconfigured device cannot hammer the database).
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, select
+
+from models import db, BattDescription, Product
+
+TENANT_MAP_MAX_AGE = float(os.getenv('TENANT_MAP_MAX_AGE', 300))
+TENANT_MAP_MISS_INTERVAL = float(os.getenv('TENANT_MAP_MISS_INTERVAL', 10))
+
+
+def battery_company_query():
+    """(batt_uid, company_id) for every battery that belongs to a product."""
+    return (
+        select(BattDescription.batt_uid, Product.company_id)
+        .join(Product, BattDescription.product_sl_no == Product.product_sl_no)
+    )
+
+
+class BatteryCompanyMap:
+    def __init__(self, max_age=TENANT_MAP_MAX_AGE, miss_interval=TENANT_MAP_MISS_INTERVAL):
+        self.max_age = max_age
+        self.miss_interval = miss_interval
+        self._lock = threading.Lock()
+        self._company = {}       # battery_id -> company_id
+        self._batteries = {}     # company_id -> frozenset(battery_id)
+        self._loaded_at = None
+        self.reloads = 0
+
+    def load(self, conn=None):
+        """Reload from the database; needs an app context unless `conn` is given."""
+        rows = (conn or db.session).execute(battery_company_query()).all()
+        company = {battery_id: company_id for battery_id, company_id in rows}
+        batteries = {}
+        for battery_id, company_id in company.items():
+            batteries.setdefault(company_id, set()).add(battery_id)
+
+        with self._lock:
+            self._company = company
+            self._batteries = {cid: frozenset(ids) for cid, ids in batteries.items()}
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_fresh(self, missing=()):
+        loaded_at = self._loaded_at
+        age = time.monotonic() - loaded_at if loaded_at is not None else None
+        if age is None or age > self.max_age or (missing and age > self.miss_interval):
+            self.load()
+
+    def company_for(self, battery_id):
+        self._ensure_fresh()
+        if battery_id not in self._company:
+            self._ensure_fresh(missing=(battery_id,))
+        return self._company.get(battery_id)
+
+    def batteries_for(self, company_id):
+        self._ensure_fresh()
+        return self._batteries.get(company_id, frozenset())
+
+    def stamp(self, rows, key="battery_id"):
+        """Set row["company_id"] on each row dict; None for batteries with no company."""
+        self._ensure_fresh()
+        company = self._company
+        missing = [row[key] for row in rows if row[key] not in company]
+        if missing:
+            self._ensure_fresh(missing)
+            company = self._company
+        for row in rows:
+            row["company_id"] = company.get(row[key])
+        return rows
+
+    def stats(self):
+        with self._lock:
+            return {"batteries": len(self._company), "companies": len(self._batteries), "reloads": self.reloads}
+
+
+battery_companies = BatteryCompanyMap()
+
+
+@event.listens_for(BattDescription, "after_insert")
+@event.listens_for(BattDescription, "after_update")
+@event.listens_for(BattDescription, "after_delete")
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _invalidate(mapper, connection, target):
+    battery_companies.invalidate()
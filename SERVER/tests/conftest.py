@@ -0,0 +1,65 @@
+"""
+Shared fixtures: one app on a throwaway sqlite database, seeded with two
+companies that each own one product and two batteries.
+"""
+import os
+import sys
+
+# Settings are read at import time
+os.environ.setdefault("SOCKETIO_ASYNC_MODE", "threading")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test")
+os.environ.setdefault("ANOMALY_ENABLED", "False")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from auth import create_jwt  # noqa: E402
+from main import create_app  # noqa: E402
+from models import db, BattDescription, CompanyProfile, Product, TblUser  # noqa: E402
+from tenants import battery_companies  # noqa: E402
+
+# company_id -> its battery ids
+FLEETS = {1: (101, 102), 2: (201, 202)}
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    path = tmp_path_factory.mktemp("db") / "bms.db"
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", "TESTING": True})
+    with app.app_context():
+        db.create_all()
+        for company_id, battery_ids in FLEETS.items():
+            db.session.add(CompanyProfile(company_id=company_id, company_name=f"Company {company_id}"))
+            db.session.add(Product(product_sl_no=company_id, company_id=company_id))
+            db.session.add_all(BattDescription(batt_uid=b, product_sl_no=company_id) for b in battery_ids)
+            db.session.add(TblUser(username=f"user{company_id}", email=f"user{company_id}@example.com",
+                                   password="-", company_id=company_id))
+        db.session.add(TblUser(username="nocompany", email="nocompany@example.com", password="-"))
+        db.session.commit()
+        battery_companies.invalidate()
+    return app
+
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture()
+def tokens(app):
+    """username -> JWT"""
+    with app.app_context():
+        return {user.username: create_jwt(user) for user in TblUser.query.all()}
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture()
+def headers(tokens):
+    """username -> Authorization header"""
+    return {username: {"Authorization": f"Bearer {token}"} for username, token in tokens.items()}
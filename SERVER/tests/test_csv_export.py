@@ -0,0 +1,102 @@
+import csv
+from datetime import datetime, timedelta
+from io import StringIO
+
+import pytest
+
+import csv_export
+from csv_export import stream_csv
+from models import db, BattFaultLog, MqttData
+
+T0 = datetime(2026, 1, 1, 12)
+
+
+def read_csv(text):
+    return list(csv.reader(StringIO(text)))
+
+
+@pytest.fixture()
+def datalogs(app_context):
+    db.session.add_all([
+        MqttData(battery_id=101, company_id=1, device_id="dev-a", ts=T0, voltage=50.5, current=-1.25, temperature=30),
+        MqttData(battery_id=102, company_id=1, device_id="dev, b", ts=T0 + timedelta(minutes=1), voltage=51),
+        MqttData(battery_id=101, company_id=1, device_id="dev-a", ts=T0 + timedelta(minutes=2), voltage=52),
+        MqttData(battery_id=201, company_id=2, device_id="dev-c", ts=T0 + timedelta(minutes=1), voltage=9),
+    ])
+    db.session.commit()
+    yield
+    db.session.query(MqttData).delete()
+    db.session.commit()
+
+
+@pytest.fixture()
+def fault_logs(app_context):
+    db.session.add_all([
+        BattFaultLog(batt_uid=101, company_id=1, fault_type="Over Voltage", severity="high",
+                     predicted_by="rule", note='says "hi"', detected_at=T0),
+        BattFaultLog(batt_uid=102, company_id=1, fault_type="Over Temp", detected_at=T0 + timedelta(hours=1)),
+        BattFaultLog(batt_uid=201, company_id=2, fault_type="Over Voltage", detected_at=T0),
+    ])
+    db.session.commit()
+    yield
+    db.session.query(BattFaultLog).delete()
+    db.session.commit()
+
+
+def test_stream_csv_flushes_in_chunks(app, datalogs, monkeypatch):
+    monkeypatch.setattr(csv_export, "CSV_CHUNK_SIZE", 2)
+    query = db.session.query(MqttData).filter(MqttData.company_id == 1).order_by(MqttData.id)
+    with app.test_request_context():
+        response = stream_csv(query, [("battery_id", MqttData.battery_id), ("device_id", MqttData.device_id)], "x.csv")
+        chunks = list(response.response)
+
+    assert response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"] == "attachment; filename=x.csv"
+    # Header plus two rows, then the last row
+    assert len(chunks) == 2
+    assert read_csv("".join(chunks)) == [["battery_id", "device_id"], ["101", "dev-a"], ["102", "dev, b"], ["101", "dev-a"]]
+
+
+def test_datalogs_csv(client, headers, datalogs):
+    response = client.get("/api/datalogs/csv", headers=headers["user1"])
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == "attachment; filename=datalogs.csv"
+    header, *rows = read_csv(response.get_data(as_text=True))
+    assert header == ["id", "timestamp", "device_id", "battery_id", "voltage", "current", "temperature"]
+    # Newest first, company 2's row left out
+    assert [row[1:] for row in rows] == [
+        ["2026-01-01 12:02:00", "dev-a", "101", "52.000", "", ""],
+        ["2026-01-01 12:01:00", "dev, b", "102", "51.000", "", ""],
+        ["2026-01-01 12:00:00", "dev-a", "101", "50.500", "-1.250", "30.000"],
+    ]
+
+
+def test_datalogs_csv_filters(client, headers, datalogs):
+    response = client.get("/api/datalogs/csv", headers=headers["user1"],
+                          query_string={"battery_id": 101, "start": "2026-01-01T12:01:00"})
+    rows = read_csv(response.get_data(as_text=True))[1:]
+    assert [(row[1], row[3]) for row in rows] == [("2026-01-01 12:02:00", "101")]
+
+    response = client.get("/api/datalogs/csv", headers=headers["user2"], query_string={"battery_id": 101})
+    assert read_csv(response.get_data(as_text=True))[1:] == []
+
+
+def test_fault_logs_csv(client, headers, fault_logs):
+    response = client.get("/api/fault-logs/csv", headers=headers["user1"])
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == "attachment; filename=fault_logs.csv"
+    header, *rows = read_csv(response.get_data(as_text=True))
+    assert header == ["fault_id", "battery_id", "fault_type", "severity", "predicted_by", "note",
+                      "resolve_text", "detected_at"]
+    assert [row[1:] for row in rows] == [
+        ["102", "Over Temp", "", "", "", "", "2026-01-01 13:00:00"],
+        ["101", "Over Voltage", "high", "rule", 'says "hi"', "", "2026-01-01 12:00:00"],
+    ]
+
+    response = client.get("/api/fault-logs/csv", headers=headers["user2"], query_string={"fault_type": "Over Temp"})
+    assert read_csv(response.get_data(as_text=True))[1:] == []
+
+
+def test_csv_requires_a_token(client):
+    assert client.get("/api/datalogs/csv").status_code == 401
+    assert client.get("/api/fault-logs/csv").status_code == 401
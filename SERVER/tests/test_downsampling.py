@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from downsampling import lttb_datalogs, lttb_indices, parse_resolution, pick_bucket_seconds
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("30", 30), ("30s", 30), ("5min", 300), ("5m", 300), (" 1H ", 3600), ("2d", 172800), (None, None), ("", None),
+])
+def test_parse_resolution(value, seconds):
+    assert parse_resolution(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["0", "0s", "-5", "5w", "h", "1.5h"])
+def test_parse_resolution_rejects(value):
+    with pytest.raises(ValueError):
+        parse_resolution(value)
+
+
+@pytest.mark.parametrize("span, max_points, seconds", [
+    (timedelta(0), 100, 1),
+    (timedelta(hours=1), 3600, 1),
+    (timedelta(hours=1), 100, 60),
+    (timedelta(days=1), 200, 600),
+    (timedelta(days=3650), 100, 37 * 86400),
+])
+def test_pick_bucket_seconds(span, max_points, seconds):
+    assert pick_bucket_seconds(T0, T0 + span, max_points) == seconds
+
+
+def test_lttb_keeps_ends_and_peaks():
+    xs = list(range(100))
+    ys = [0.0] * 100
+    ys[40] = 10.0
+    indices = lttb_indices(xs, ys, 10)
+    assert len(indices) == 10
+    assert indices[0] == 0 and indices[-1] == 99
+    assert 40 in indices
+    assert indices == sorted(indices)
+
+
+@pytest.mark.parametrize("threshold, indices", [(0, []), (1, [4]), (2, [0, 4]), (5, [0, 1, 2, 3, 4]), (9, [0, 1, 2, 3, 4])])
+def test_lttb_small_thresholds(threshold, indices):
+    assert lttb_indices(range(5), [1.0] * 5, threshold) == indices
+
+
+def bucket(i, voltage):
+    return {"timestamp": (T0 + timedelta(minutes=i)).isoformat(sep=" "), "batteryId": "1", "voltage_avg": voltage}
+
+
+def test_lttb_datalogs_respects_max_points():
+    buckets = [bucket(i, float(i % 7)) for i in range(50)]
+    assert len(lttb_datalogs(buckets, 2)) == 2
+    assert len(lttb_datalogs(buckets, 10)) == 10
+
+
+def test_lttb_datalogs_keeps_gaps():
+    buckets = [bucket(i, None if 20 <= i < 30 else 1.0) for i in range(50)]
+    data = lttb_datalogs(buckets, 10)
+    assert len(data) <= 10
+    values = [item["voltage_avg"] for item in data]
+    # One empty bucket marks the gap, and none counts as 0
+    assert values.count(None) == 1
+    assert 0.0 not in values
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import fault_engine
+from fault_engine import DEFAULT_RULES, _run_lengths, evaluate, lookback_rows, run_fault_scan, scan_battery
+from models import db, BattFaultLog, FaultScanCheckpoint, MqttData
+
+T0 = datetime(2026, 1, 1, 12)
+
+RULES = {
+    "over_voltage": DEFAULT_RULES["over_voltage"],
+    "stuck": {"fault_type": "Sensor Stuck", "severity": "low", "metrics": ["voltage"], "samples": 4, "epsilon": 1e-6},
+}
+
+
+def window(voltage, ts=None, current=None, temperature=None):
+    n = len(voltage)
+    return {
+        "ts": np.asarray(ts if ts is not None else range(n), dtype=float),
+        "voltage": np.asarray(voltage, dtype=float),
+        "current": np.asarray(current if current is not None else [0.0] * n, dtype=float),
+        "temperature": np.asarray(temperature if temperature is not None else [25.0] * n, dtype=float),
+    }
+
+
+def test_run_lengths():
+    same = np.array([True, True, False, True, True, True, False])
+    assert _run_lengths(same).tolist() == [1, 2, 0, 1, 2, 3, 0]
+    assert _run_lengths(np.array([], dtype=bool)).tolist() == []
+
+
+@pytest.mark.parametrize("name, values, expected", [
+    ("over_voltage", {"voltage": [12, 15, 15, 12, 15]}, [1, 4]),
+    ("under_voltage", {"voltage": [12, 10, 12]}, [1]),
+    ("overcurrent", {"current": [0, -120, 120, 0]}, [1]),
+    ("over_temperature", {"temperature": [25, 61, 25, np.nan]}, [1]),
+    # 1 V in one second, then the same step over four seconds
+    ("dv_dt", {"voltage": [12, 12, 13, 14], "ts": [0, 1, 2, 6]}, [2]),
+    # A repeated timestamp is not an infinite rate
+    ("dv_dt", {"voltage": [12, 13], "ts": [5, 5]}, []),
+])
+def test_threshold_and_rate_rules(name, values, expected):
+    n = len(next(iter(values.values())))
+    values.setdefault("voltage", [12.0] * n)
+    events = evaluate(window(**values), {name: DEFAULT_RULES[name]})
+    assert events == [(index, name) for index in expected]
+
+
+def test_stuck_rule_needs_samples_equal_readings():
+    rules = {"stuck": RULES["stuck"]}
+    assert evaluate(window([1, 2, 2, 2, 3]), rules) == []
+    # Flagged on the sample that completes the run, once per run
+    assert evaluate(window([1, 2, 2, 2, 2, 2, 3]), rules) == [(4, "stuck")]
+
+
+def test_evaluate_skips_runs_starting_in_carried_rows():
+    w = window([15, 15, 12, 12, 15])
+    assert evaluate(w, RULES) == [(0, "over_voltage"), (4, "over_voltage")]
+    # The first run started in the previous window and was reported there
+    assert evaluate(w, RULES, skip=2) == [(4, "over_voltage")]
+
+
+def test_lookback_rows():
+    assert lookback_rows(RULES) == 4
+    assert lookback_rows({"over_voltage": RULES["over_voltage"]}) == 2
+
+
+@pytest.fixture()
+def engine(app_context):
+    yield db.engine
+    for model in (MqttData, BattFaultLog, FaultScanCheckpoint):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def add_samples(battery_id, start, voltages):
+    db.session.add_all(
+        MqttData(battery_id=battery_id, company_id=1, ts=T0 + timedelta(seconds=start + i), voltage=v)
+        for i, v in enumerate(voltages)
+    )
+    db.session.commit()
+
+
+def faults():
+    return [(f.fault_type, f.detected_at, f.company_id)
+            for f in db.session.query(BattFaultLog).order_by(BattFaultLog.detected_at)]
+
+
+def test_scan_battery_carries_runs_across_windows(engine):
+    # Over-voltage at 2-4 spans windows [0-2] and [3-5]; the stuck run 6-9
+    # is only complete in window [9], seen through the carried tail
+    add_samples(101, 0, [12.0, 12.1, 15.0, 15.0, 15.1, 12.2, 12.3, 12.3, 12.3, 12.3])
+    assert scan_battery(101, RULES, window_rows=3, engine=engine) == (101, 10, 2)
+    assert faults() == [
+        ("High Voltage", T0 + timedelta(seconds=2), 1),
+        ("Sensor Stuck", T0 + timedelta(seconds=9), 1),
+    ]
+    checkpoint = db.session.get(FaultScanCheckpoint, 101)
+    assert checkpoint.last_ts.replace(tzinfo=None) == T0 + timedelta(seconds=9)
+
+
+def test_scan_battery_resumes_from_checkpoint(engine):
+    add_samples(101, 0, [12.0, 15.0, 15.0, 12.3, 12.3, 12.3])
+    assert scan_battery(101, RULES, window_rows=4, engine=engine) == (101, 6, 1)
+    assert scan_battery(101, RULES, window_rows=4, engine=engine) == (101, 0, 0)
+
+    # The stuck run completes after the checkpoint; the voltage spike is new
+    add_samples(101, 6, [12.3, 15.5])
+    assert scan_battery(101, RULES, window_rows=4, engine=engine) == (101, 2, 2)
+    assert [fault[:2] for fault in faults()] == [
+        ("High Voltage", T0 + timedelta(seconds=1)),
+        ("Sensor Stuck", T0 + timedelta(seconds=6)),
+        ("High Voltage", T0 + timedelta(seconds=7)),
+    ]
+
+
+def test_run_fault_scan(app, engine, monkeypatch):
+    monkeypatch.setattr(fault_engine, "load_rules", lambda: RULES)
+    add_samples(101, 0, [12.0, 15.0, 12.0])
+    add_samples(102, 0, [12.0, 12.5])
+    totals = run_fault_scan(app.config["SQLALCHEMY_DATABASE_URI"], workers=1)
+    assert {k: totals[k] for k in ("batteries", "samples", "faults")} == {"batteries": 4, "samples": 5, "faults": 1}
+
+    totals = run_fault_scan(app.config["SQLALCHEMY_DATABASE_URI"], batteries=[101], workers=1)
+    assert (totals["batteries"], totals["samples"], totals["faults"]) == (1, 0, 0)
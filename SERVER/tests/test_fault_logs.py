@@ -0,0 +1,67 @@
+import pytest
+
+from models import db, BattFaultLog, BattFleetSnapshot
+
+
+@pytest.fixture()
+def clean(app_context):
+    yield
+    for model in (BattFaultLog, BattFleetSnapshot):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def create(client, headers, faults):
+    return client.post("/api/fault-logs/bulk", json={"faults": faults}, headers=headers)
+
+
+def test_bulk_create_mixed_items(client, headers, clean):
+    response = create(client, headers["user1"], [
+        {"battery_id": 101, "fault_type": "Over Voltage", "severity": "high"},
+        {"battery_id": 201, "fault_type": "Over Voltage"},          # another company's battery
+        {"battery_id": 102},                                        # no fault_type
+        "not an object",
+        {"battery_id": 102, "fault_type": "Over Temp", "detected_at": "2026-01-01T10:00:00+02:00"},
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["created"], body["invalid"]) == (2, 3)
+    assert [r["status"] for r in body["results"]] == ["created", "invalid", "invalid", "invalid", "created"]
+    assert body["results"][1]["error"] == "Unknown battery: 201"
+
+    rows = {f.fault_id: f for f in db.session.query(BattFaultLog)}
+    created = rows[body["results"][4]["fault_id"]]
+    assert created.company_id == 1 and created.batt_uid == 102 and created.predicted_by == "api"
+    assert created.detected_at.isoformat() == "2026-01-01T08:00:00"
+    assert db.session.get(BattFleetSnapshot, 101).open_faults == 1
+
+
+@pytest.mark.parametrize("body", [{}, {"faults": []}, {"faults": {"battery_id": 101}}])
+def test_bulk_create_rejects_bad_bodies(client, headers, clean, body):
+    assert client.post("/api/fault-logs/bulk", json=body, headers=headers["user1"]).status_code == 400
+
+
+def test_resolve_classifies_every_item(client, headers, clean):
+    mine = create(client, headers["user1"], [{"battery_id": 101, "fault_type": "Over Voltage"}] * 2)
+    theirs = create(client, headers["user2"], [{"battery_id": 201, "fault_type": "Over Voltage"}])
+    mine_ids = [r["fault_id"] for r in mine.get_json()["results"]]
+    their_id = theirs.get_json()["results"][0]["fault_id"]
+
+    items = [mine_ids[0], their_id, 999999, True, [mine_ids[1]], {"id": mine_ids[1]}, "1", 1.0]
+    response = client.post("/api/fault-logs/resolve", json={"fault_ids": items, "resolve_text": "fixed"},
+                           headers=headers["user1"])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["resolved"] == 1
+    assert [r["status"] for r in body["results"]] == [
+        "resolved", "not_found", "not_found", "invalid", "invalid", "invalid", "invalid", "invalid",
+    ]
+
+    resolved = {f.fault_id: f.resolve_text for f in db.session.query(BattFaultLog)}
+    assert resolved == {mine_ids[0]: "fixed", mine_ids[1]: None, their_id: None}
+    assert db.session.get(BattFleetSnapshot, 101).open_faults == 1
+
+
+@pytest.mark.parametrize("body", [{"fault_ids": [1]}, {"fault_ids": [], "note": "x"}, {"fault_ids": [1], "note": 5}])
+def test_resolve_rejects_bad_bodies(client, headers, clean, body):
+    assert client.post("/api/fault-logs/resolve", json=body, headers=headers["user1"]).status_code == 400
@@ -0,0 +1,30 @@
+from fault_summary import FaultSummaryCache, fault_watermark
+from models import db, BattFaultLog
+
+
+def add_fault(fault_id):
+    db.session.add(BattFaultLog(fault_id=fault_id, batt_uid=101, fault_type="Over Voltage", company_id=1))
+    db.session.commit()
+
+
+def test_late_commit_below_max_id_recomputes(app_context):
+    cache = FaultSummaryCache()
+    computed = []
+
+    def compute():
+        computed.append(db.session.query(BattFaultLog).count())
+        return computed[-1]
+
+    add_fault(1)
+    add_fault(3)
+    assert cache.get_or_compute("k", compute) == 2
+    assert cache.get_or_compute("k", compute) == 2
+    assert len(computed) == 1
+
+    # Same max(fault_id), one more fault
+    add_fault(2)
+    assert fault_watermark()[0] == 3
+    assert cache.get_or_compute("k", compute) == 3
+
+    db.session.query(BattFaultLog).delete()
+    db.session.commit()
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from fleet import refresh_fleet, read_fleet
+from models import db, BattFaultLog, BattFleetSnapshot, RollupWatermark
+
+
+@pytest.fixture()
+def clean(app_context):
+    yield
+    for model in (BattFaultLog, BattFleetSnapshot, RollupWatermark):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def add_fault(fault_id, battery_id, severity="medium"):
+    db.session.add(BattFaultLog(fault_id=fault_id, batt_uid=battery_id, fault_type="Over Voltage",
+                                severity=severity, company_id=1))
+    db.session.commit()
+
+
+def open_faults(battery_id):
+    return {b["battery_id"]: b for b in read_fleet(1)["batteries"]}[battery_id]
+
+
+def test_fault_committed_below_the_watermark_is_counted(clean):
+    add_fault(1, 101)
+    add_fault(3, 101)
+    refresh_fleet()
+    assert open_faults(102)["open_faults"] == 0
+
+    # Id 2 was allocated before 3 but committed after the refresh
+    add_fault(2, 102, "critical")
+    refresh_fleet()
+    assert open_faults(102)["open_faults"] == 1
+    assert open_faults(102)["worst_severity"] == "critical"
+    assert open_faults(101)["open_faults"] == 2
+
+
+def test_without_lag_a_late_fault_is_missed(clean):
+    add_fault(1, 101)
+    add_fault(3, 101)
+    refresh_fleet(id_lag=0)
+    add_fault(2, 102)
+    assert refresh_fleet(id_lag=0) == 0
+    assert open_faults(102)["open_faults"] == 0
+
+
+def test_last_ts_uses_the_api_timestamp_format(clean):
+    db.session.add_all([
+        BattFleetSnapshot(battery_id=101, last_ts=datetime(2026, 1, 1, 12, 0, 5, 250000)),
+        BattFleetSnapshot(battery_id=102, last_ts=datetime(2026, 1, 1, 12, 0, 9)),
+    ])
+    db.session.commit()
+    fleet = read_fleet(1)
+    assert [b["last_ts"] for b in fleet["batteries"]] == ["2026-01-01 12:00:05", "2026-01-01 12:00:09"]
+    assert fleet["products"][0]["last_ts"] == "2026-01-01 12:00:09"
+
+    db.session.query(BattFleetSnapshot).delete()
+    db.session.commit()
+    assert read_fleet(1)["products"][0]["last_ts"] is None
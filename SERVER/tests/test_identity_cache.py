@@ -0,0 +1,116 @@
+import jwt
+import pytest
+
+import identity_cache as identity_cache_module
+from auth import JWT_SECRET
+from identity_cache import IdentityCache, UserSnapshot, identity_cache, resolve_identity
+from models import db, CompanyProfile, TblUser
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(identity_cache_module.time, "time", clock)
+    return clock
+
+
+def snapshot(u_id, company_id=1):
+    return UserSnapshot(u_id=u_id, username=f"u{u_id}", company_id=company_id)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = IdentityCache(ttl=60)
+    cache.put("a", {"u_id": 1}, snapshot(1))
+    clock.now += 59
+    assert cache.get("a")[1].u_id == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5}
+
+
+def test_token_expiry_caps_the_ttl(clock):
+    cache = IdentityCache(ttl=60)
+    cache.put("a", {"u_id": 1, "exp": clock.now + 10}, snapshot(1))
+    clock.now += 11
+    assert cache.get("a") is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = IdentityCache(max_size=2)
+    cache.put("a", {}, snapshot(1))
+    cache.put("b", {}, snapshot(2))
+    assert cache.get("a") is not None
+    cache.put("c", {}, snapshot(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+    # Re-putting a token replaces its entry rather than growing the cache
+    cache.put("c", {}, snapshot(3))
+    assert cache.stats()["size"] == 2
+
+
+def test_invalidate_user_and_company(clock):
+    cache = IdentityCache()
+    cache.put("a1", {}, snapshot(1, company_id=1))
+    cache.put("a2", {}, snapshot(1, company_id=1))
+    cache.put("b", {}, snapshot(2, company_id=1))
+    cache.put("c", {}, snapshot(3, company_id=2))
+
+    cache.invalidate_user(1)
+    assert [cache.get(t) is not None for t in ("a1", "a2", "b", "c")] == [False, False, True, True]
+    cache.invalidate_company(1)
+    assert [cache.get(t) is not None for t in ("b", "c")] == [False, True]
+
+
+@pytest.fixture()
+def cached(app_context, tokens):
+    identity_cache.clear()
+    for username in ("user1", "user2"):
+        resolve_identity(tokens[username], JWT_SECRET)
+    assert identity_cache.stats()["size"] == 2
+    yield tokens
+    identity_cache.clear()
+
+
+def test_resolve_identity_hits_the_cache(cached):
+    claims, user = resolve_identity(cached["user1"], JWT_SECRET)
+    assert (user.username, user.company_name) == ("user1", "Company 1")
+    assert identity_cache.stats()["hits"] >= 1
+
+
+def test_user_update_drops_their_tokens(cached):
+    user = TblUser.query.filter_by(username="user1").one()
+    user.phone = "555-0100"
+    db.session.commit()
+    assert identity_cache.get(cached["user1"]) is None
+    assert identity_cache.get(cached["user2"]) is not None
+    assert resolve_identity(cached["user1"], JWT_SECRET)[1].phone == "555-0100"
+
+
+def test_company_update_drops_its_users_tokens(cached):
+    company = db.session.get(CompanyProfile, 2)
+    company.company_name = "Renamed"
+    db.session.commit()
+    try:
+        assert identity_cache.get(cached["user2"]) is None
+        assert identity_cache.get(cached["user1"]) is not None
+        assert resolve_identity(cached["user2"], JWT_SECRET)[1].company_name == "Renamed"
+    finally:
+        company.company_name = "Company 2"
+        db.session.commit()
+
+
+def test_unknown_user_is_not_cached(app_context):
+    identity_cache.clear()
+    token = jwt.encode({"u_id": 999999}, JWT_SECRET, algorithm="HS256")
+    assert resolve_identity(token, JWT_SECRET) == ({"u_id": 999999}, None)
+    assert identity_cache.stats()["size"] == 0
@@ -0,0 +1,104 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+import ingest
+from anomaly import AnomalyDetector
+from ingest import FakeBroker, IngestWorker, Subscriber, read_dead_letters
+from main import ingest_metrics
+from models import db, BattAnomalyState, MqttData
+
+
+@pytest.fixture()
+def worker(app, tmp_path):
+    worker = IngestWorker(app, subscriber=FakeBroker(), retry_attempts=2, retry_backoff=0,
+                          dead_letter_dir=str(tmp_path))
+    yield worker
+    with app.app_context():
+        db.session.query(MqttData).delete()
+        db.session.commit()
+
+
+def row(voltage=48.0):
+    return {"ts": datetime(2026, 1, 1, tzinfo=timezone.utc), "device_id": "d1", "battery_id": 101,
+            "voltage": voltage, "current": 1.0, "temperature": 25.0, "payload_json": {"voltage": voltage}}
+
+
+def failing(times):
+    calls = []
+    insert_rows = ingest.insert_rows
+
+    def write(rows):
+        calls.append(len(rows))
+        if len(calls) <= times:
+            raise RuntimeError("database unavailable")
+        insert_rows(rows)
+    return write, calls
+
+
+def test_flush_retries_a_failed_write(app, worker, monkeypatch):
+    write, calls = failing(2)
+    monkeypatch.setattr(ingest, "insert_rows", write)
+    assert worker.flush([row()])
+    assert len(calls) == 3
+    assert worker.stats()["retries"] == 2 and worker.stats()["failed_batches"] == 0
+    with app.app_context():
+        assert db.session.query(MqttData).count() == 1
+
+
+def test_flush_dead_letters_after_the_last_attempt(app, worker, tmp_path, monkeypatch):
+    write, calls = failing(3)
+    monkeypatch.setattr(ingest, "insert_rows", write)
+    assert not worker.flush([row(48.0), row(48.5)])
+    assert len(calls) == 3
+    assert worker.stats()["failed_batches"] == 1 and worker.stats()["dead_lettered"] == 2
+
+    [path] = tmp_path.iterdir()
+    rows = read_dead_letters(path)
+    assert [r["voltage"] for r in rows] == [48.0, 48.5]
+    assert rows[0]["ts"] == row()["ts"]
+
+
+def test_subscriber_must_implement_start_and_stop():
+    class Partial(Subscriber):
+        def start(self, on_message):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_counters_from_several_threads_add_up(worker):
+    # Malformed messages only touch the counters
+    def receive():
+        for _ in range(2000):
+            worker.on_message("bms/d1/telemetry", b"not json")
+
+    threads = [threading.Thread(target=receive) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = worker.stats()
+    assert stats["received"] == stats["rejected"] == 8000
+
+
+def test_ingest_metrics(worker):
+    worker._count("dead_lettered", 7)
+    assert "bms_ingest_dead_lettered_rows 7" in ingest_metrics(worker)
+
+
+def test_stop_runs_hooks_after_the_queue_is_flushed(app, worker):
+    detector = AnomalyDetector(checkpoint_interval=3600)
+    worker.add_listener(detector.update)
+    worker.add_stop_hook(detector.stop)
+    worker.start()
+    worker.subscriber.publish("bms/d1/telemetry", {"battery_id": 101, "voltage": 48.0, "ts": 1767225600})
+    worker.stop()
+
+    with app.app_context():
+        state = db.session.get(BattAnomalyState, 101)
+        assert state is not None and state.samples == 1
+        db.session.delete(state)
+        db.session.commit()
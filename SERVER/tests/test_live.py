@@ -0,0 +1,86 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FLEETS
+from extensions import socketio
+from live import LIVE_NAMESPACE, LiveBroadcaster
+from models import db, MqttData
+
+T0 = datetime(2026, 1, 1, 12)
+
+
+def connect(app, token=None):
+    return socketio.test_client(app, namespace=LIVE_NAMESPACE, auth={"token": token} if token else None)
+
+
+def subscribe(client, payload):
+    return client.emit("subscribe", payload, namespace=LIVE_NAMESPACE, callback=True)
+
+
+@pytest.mark.parametrize("token", [None, "not-a-jwt"])
+def test_connect_without_valid_token_is_refused(app, token):
+    assert not connect(app, token).is_connected(LIVE_NAMESPACE)
+
+
+def test_connect_without_company_is_refused(app, tokens):
+    assert not connect(app, tokens["nocompany"]).is_connected(LIVE_NAMESPACE)
+
+
+def test_subscribe_to_own_batteries(app, tokens):
+    client = connect(app, tokens["user1"])
+    assert client.is_connected(LIVE_NAMESPACE)
+    assert subscribe(client, {"battery_ids": list(FLEETS[1])})["subscribed"] == sorted(FLEETS[1])
+    assert subscribe(client, {"company_id": 1})["subscribed"] == sorted(FLEETS[1])
+    client.disconnect(namespace=LIVE_NAMESPACE)
+
+
+def test_cannot_subscribe_to_another_company(app, tokens):
+    client = connect(app, tokens["user2"])
+    first_company_battery = FLEETS[1][0]
+
+    for payload in ({"battery_id": first_company_battery},
+                    {"battery_ids": [FLEETS[2][0], first_company_battery]},
+                    {"company_id": 1}):
+        ack = subscribe(client, payload)
+        assert "error" in ack and "subscribed" not in ack
+
+    client.disconnect(namespace=LIVE_NAMESPACE)
+
+
+def test_tail_publishes_new_rows_of_subscribed_batteries(app_context):
+    broadcaster = LiveBroadcaster()
+    broadcaster.add_client("sid")
+    assert broadcaster.tail() == 0            # nobody subscribed yet
+
+    broadcaster.subscribe("sid", {101})
+    db.session.add(MqttData(battery_id=101, company_id=1, ts=T0, voltage=50))
+    db.session.commit()
+    assert broadcaster.tail() == 0            # first tail only sets the watermark
+    assert broadcaster._due(time.monotonic()) == []
+
+    db.session.add_all([
+        MqttData(battery_id=101, company_id=1, ts=T0 + timedelta(seconds=1), voltage=51, current=2, temperature=30),
+        MqttData(battery_id=101, company_id=1, ts=T0 + timedelta(seconds=2), voltage=52, current=2, temperature=30),
+        MqttData(battery_id=201, company_id=2, ts=T0 + timedelta(seconds=2), voltage=9),
+    ])
+    db.session.commit()
+    assert broadcaster.tail() == 2
+    epoch_ms = int((T0 + timedelta(seconds=2)).replace(tzinfo=timezone.utc).timestamp() * 1000)
+    assert broadcaster._due(time.monotonic()) == [("sid", [[101, epoch_ms, 52.0, 2.0, 30.0]])]
+    assert broadcaster.tail() == 0
+
+    db.session.query(MqttData).delete()
+    db.session.commit()
+
+
+def test_tail_only_runs_when_not_fed_by_ingest(app):
+    broadcaster = LiveBroadcaster(tail_interval=1.0)
+    assert not broadcaster._tail_due(100.0)   # no app yet
+    broadcaster.app = app
+    assert broadcaster._tail_due(100.0)
+    assert not broadcaster._tail_due(100.5)
+    assert broadcaster._tail_due(101.0)
+    broadcaster.fed_by_ingest = True
+    assert not broadcaster._tail_due(200.0)
@@ -0,0 +1,92 @@
+import re
+
+from flask import g
+
+import metrics
+from metrics import Counter, Histogram, gauge_lines, timed
+
+# name{labels} value, per the Prometheus text format
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? -?[0-9.e+-]+$')
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("h", "Help.", ("route",), buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 5.0):
+        histogram.observe(("/a",), value)
+    assert histogram.render() == [
+        "# HELP h Help.",
+        "# TYPE h histogram",
+        'h_bucket{route="/a",le="0.01"} 1',
+        'h_bucket{route="/a",le="0.1"} 3',
+        'h_bucket{route="/a",le="1.0"} 3',
+        'h_bucket{route="/a",le="+Inf"} 4',
+        'h_sum{route="/a"} 5.105000',
+        'h_count{route="/a"} 4',
+    ]
+
+
+def test_counter_and_gauge_lines():
+    counter = Counter("c_total", "Help.", ("route",))
+    counter.inc(("/a",))
+    counter.inc(("/a",), amount=2)
+    assert counter.render()[2:] == ['c_total{route="/a"} 3']
+
+    unlabelled = Counter("u_total", "Help.")
+    unlabelled.inc()
+    assert unlabelled.render()[2:] == ["u_total 1"]
+
+    assert gauge_lines("g", "Help.", [({}, 1), ({"path": 'a"b\\c\n'}, 2)]) == [
+        "# HELP g Help.", "# TYPE g gauge", "g 1", 'g{path="a\\"b\\\\c\\n"} 2',
+    ]
+
+
+def test_nested_timed_counts_once(app):
+    with app.test_request_context():
+        with timed("serialize"):
+            with timed("serialize"):
+                pass
+        with timed("serialize"):
+            pass
+        assert set(g._phases) == {"serialize"}
+        assert g._phase_depth == {"serialize": 0}
+
+
+def test_metrics_endpoint_allows_only_listed_addresses(client):
+    assert client.get("/api/metrics").status_code == 200
+    response = client.get("/api/metrics", environ_base={"REMOTE_ADDR": "10.1.2.3"})
+    assert response.status_code == 403
+
+
+def test_metrics_exposition_format(client, headers):
+    client.get("/api/sensor", headers=headers["user1"])
+    response = client.get("/api/metrics")
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert text.endswith("\n")
+
+    declared = set()
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            continue
+        if line.startswith("# TYPE "):
+            name, kind = line.split()[2:]
+            assert kind in ("counter", "gauge", "histogram")
+            declared.add(name)
+            continue
+        assert SAMPLE.match(line), line
+        # Every sample follows the TYPE line of its family
+        name = re.split(r"[{ ]", line)[0]
+        assert name in declared or re.sub(r"_(bucket|sum|count)$", "", name) in declared, line
+
+    assert 'bms_http_request_duration_seconds_count{method="GET",route="/api/sensor",status="200"}' in text
+    assert "bms_identity_cache_entries" in text and "bms_db_pool_connections" in text
+
+
+def test_server_timing_header(client, headers, monkeypatch):
+    assert "Server-Timing" not in client.get("/api/sensor", headers=headers["user1"]).headers
+
+    monkeypatch.setattr(metrics, "SERVER_TIMING_HEADER", True)
+    timing = client.get("/api/sensor", headers=headers["user1"]).headers["Server-Timing"]
+    phases = [part.split(";")[0] for part in timing.split(", ")]
+    assert phases[-1] == "total" and "auth" in phases
+    assert all(re.fullmatch(r"[a-z]+;dur=\d+\.\d", part) for part in timing.split(", "))
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, MqttData
+from pagination import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT, decode_cursor, encode_cursor, keyset_page, parse_limit
+
+T0 = datetime(2026, 1, 1)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(T0, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (T0, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "garbage", encode_cursor(T0, 1)[:-3], "WyJ4IiwgMV0"])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_parse_limit():
+    assert parse_limit(None) == PAGE_DEFAULT_LIMIT
+    assert parse_limit("10") == 10
+    assert parse_limit(str(PAGE_MAX_LIMIT + 1)) == PAGE_MAX_LIMIT
+    with pytest.raises(ValueError):
+        parse_limit("0")
+
+
+def test_keyset_pages_cover_every_row_once(app_context):
+    # Pairs of rows share a timestamp, so the id breaks ties
+    db.session.add_all(MqttData(battery_id=101, ts=T0 + timedelta(seconds=i // 2), voltage=i) for i in range(7))
+    db.session.commit()
+    query = db.session.query(MqttData.id, MqttData.ts)
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = keyset_page(query, MqttData.ts, MqttData.id, 3, cursor)
+        seen += [row.id for row in rows]
+        if cursor is None:
+            break
+    expected = [row.id for row in query.order_by(MqttData.ts.desc(), MqttData.id.desc())]
+    assert seen == expected and len(seen) == 7
+
+    db.session.query(MqttData).delete()
+    db.session.commit()
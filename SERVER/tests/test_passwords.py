@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from passwords import HashPool, PasswordPoolBusy
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class InlineFuture:
+    """Stands in for a pool future that is still running after the caller gave up."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self._callbacks = []
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise FutureTimeoutError()
+
+    def cancel(self):
+        return False
+
+    def add_done_callback(self, fn):
+        self._callbacks.append(fn)
+
+    def finish(self):
+        self.done.set()
+        for fn in self._callbacks:
+            fn(self)
+
+
+class StuckExecutor:
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.futures.append(InlineFuture())
+        return self.futures[-1]
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    pool = HashPool(workers=1, queue_max=1, timeout=0.01)
+    pool._executor = StuckExecutor()
+
+    with pytest.raises(PasswordPoolBusy):
+        pool.run(time.sleep, 1)
+    # Still running: the queue is full
+    with pytest.raises(PasswordPoolBusy):
+        pool.run(time.sleep, 1)
+    assert pool.rejected == 1
+
+    pool._executor.futures[0].finish()
+    with pytest.raises(PasswordPoolBusy):
+        pool.run(time.sleep, 1)
+    assert pool.rejected == 1
+
+
+EVENTLET_SCRIPT = """
+import eventlet
+import wsgi
+from passwords import GreenExecutor, hash_password, hash_pool, verify_password
+
+ticks = []
+ticker = eventlet.spawn(lambda: [ticks.append(eventlet.sleep(0.01)) for _ in range(1000)])
+pwhash = hash_password("secret")
+assert verify_password(pwhash, "secret") == (True, None)
+assert verify_password(pwhash, "wrong") == (False, None)
+assert isinstance(hash_pool._executor, GreenExecutor)
+# The hub kept running other green threads while the hashes ran
+assert len(ticks) > 3, len(ticks)
+ticker.kill()
+hash_pool.shutdown(wait=wsgi.SERVER_WORKER == "threading")
+print("stopped")
+"""
+
+
+def test_pool_starts_and_stops_under_eventlet():
+    pytest.importorskip("eventlet")
+    env = dict(os.environ, SERVER_WORKER="eventlet", DATABASE_URL="sqlite://",
+               PASSWORD_HASH_METHOD="pbkdf2:sha256:600000")
+    env.pop("SOCKETIO_ASYNC_MODE", None)
+    result = subprocess.run([sys.executable, "-c", EVENTLET_SCRIPT], cwd=SERVER_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "stopped"
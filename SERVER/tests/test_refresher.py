@@ -0,0 +1,37 @@
+import threading
+
+from refresher import Refresher
+
+
+def test_catches_up_while_the_job_makes_progress(app):
+    # pop() returns 3, 2, 1 (progress), then 0 (caught up)
+    backlog = [0, 1, 2, 3]
+    refresher = Refresher(app, backlog.pop, interval=60, name="test-refresher")
+    with app.app_context():
+        refresher.run_once()
+    assert backlog == []
+
+
+def test_without_catch_up_the_job_runs_once_per_interval(app):
+    calls = []
+    refresher = Refresher(app, lambda: calls.append(1) or True, interval=60, name="test-refresher", catch_up=False)
+    with app.app_context():
+        refresher.run_once()
+    assert calls == [1]
+
+
+def test_a_failing_job_does_not_stop_the_thread(app):
+    ran = threading.Event()
+    calls = []
+
+    def job():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        ran.set()
+
+    refresher = Refresher(app, job, interval=0.01, name="test-refresher")
+    refresher.start()
+    assert ran.wait(5)
+    refresher.stop()
+    assert refresher._thread is None
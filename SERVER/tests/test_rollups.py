@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import rollups
+from models import db, MqttData, MqttRollupHour, RollupWatermark
+from rollups import ROLLUP_LEVELS, WATERMARK_NAME, pick_rollup_level, read_rollup, refresh_rollups
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.mark.parametrize("span, level", [
+    (timedelta(minutes=30), "minute"),        # too short for 200 of anything: finest level
+    (timedelta(hours=3, minutes=20), "minute"),
+    (timedelta(hours=199), "minute"),
+    (timedelta(hours=200), "hour"),
+    (timedelta(days=199), "hour"),
+    (timedelta(days=200), "day"),
+    (timedelta(days=3650), "day"),
+])
+def test_pick_rollup_level(span, level):
+    assert pick_rollup_level(T0, T0 + span)[0] == level
+
+
+def test_pick_rollup_level_target_points():
+    name, seconds, model = pick_rollup_level(T0, T0 + timedelta(days=2), target_points=24)
+    assert (name, seconds, model) == ROLLUP_LEVELS[1]
+
+
+@pytest.fixture()
+def merges(app_context, monkeypatch):
+    """The Postgres-only merge, recorded as (seconds, lo_id, hi_id)."""
+    calls = []
+    monkeypatch.setattr(rollups, "_merge_into", lambda model, seconds, lo, hi: calls.append((seconds, lo, hi)))
+    db.session.add_all(MqttData(battery_id=101, company_id=1, ts=T0 + timedelta(seconds=i)) for i in range(10))
+    db.session.commit()
+    first_id = db.session.query(MqttData.id).order_by(MqttData.id).first()[0]
+    db.session.add(RollupWatermark(name=WATERMARK_NAME, last_id=first_id - 1))
+    db.session.commit()
+    yield calls, first_id - 1
+    for model in (MqttData, RollupWatermark):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def watermark():
+    return db.session.get(RollupWatermark, WATERMARK_NAME).last_id
+
+
+def test_refresh_works_off_a_backlog_in_slices(merges):
+    calls, start = merges
+    assert refresh_rollups(max_rows=4) == 4
+    assert calls == [(seconds, start, start + 4) for _, seconds, _ in ROLLUP_LEVELS]
+    assert refresh_rollups(max_rows=4) == 4
+    assert refresh_rollups(max_rows=4) == 2
+    assert refresh_rollups(max_rows=4) == 0
+    assert watermark() == start + 10
+    assert [(lo, hi) for seconds, lo, hi in calls if seconds == 60] == [
+        (start, start + 4), (start + 4, start + 8), (start + 8, start + 10),
+    ]
+
+
+def test_refresh_leaves_the_id_lag(merges, monkeypatch):
+    calls, start = merges
+    monkeypatch.setattr(rollups, "ROLLUP_ID_LAG", 3)
+    assert refresh_rollups() == 7
+    assert watermark() == start + 7
+    assert refresh_rollups() == 0
+
+    monkeypatch.setattr(rollups, "ROLLUP_ID_LAG", 20)
+    assert refresh_rollups() == 0
+    assert watermark() == start + 7
+    assert len(calls) == len(ROLLUP_LEVELS)
+
+
+def test_read_rollup_scoping(app_context):
+    db.session.add_all(
+        MqttRollupHour(battery_id=battery_id, bucket=T0 + timedelta(hours=h), sample_count=2,
+                       voltage_min=12, voltage_max=13, voltage_sum=25, voltage_last=13)
+        for battery_id in (101, 201) for h in range(3)
+    )
+    db.session.commit()
+    try:
+        rows = read_rollup(MqttRollupHour, T0 + timedelta(hours=1), T0 + timedelta(hours=2), battery_ids={101})
+        assert [(r["timestamp"], r["batteryId"]) for r in rows] == [
+            ("2026-01-01 01:00:00", "101"), ("2026-01-01 02:00:00", "101"),
+        ]
+        assert (rows[0]["voltage_avg"], rows[0]["voltage_last"], rows[0]["current_avg"]) == (12.5, 13.0, None)
+        assert read_rollup(MqttRollupHour, T0, T0 + timedelta(hours=2), battery_ids=set()) == []
+        assert {r["batteryId"] for r in read_rollup(MqttRollupHour, T0, T0 + timedelta(hours=2))} == {"101", "201"}
+    finally:
+        db.session.query(MqttRollupHour).delete()
+        db.session.commit()
@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta, timezone
+
+from models import db, MqttData
+from schema import add_months, delete_older_than, month_floor
+
+T0 = datetime(2026, 1, 1)
+
+
+def test_month_arithmetic():
+    assert month_floor(datetime(2026, 3, 17, 12, tzinfo=timezone.utc)) == datetime(2026, 3, 1, tzinfo=timezone.utc)
+    assert add_months(datetime(2026, 11, 1), 3) == datetime(2027, 2, 1, tzinfo=timezone.utc)
+    assert add_months(datetime(2026, 1, 1), -1) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+
+
+def test_delete_older_than_works_in_batches(app_context):
+    db.session.add_all(MqttData(battery_id=101, ts=T0 + timedelta(days=i), voltage=48.0) for i in range(10))
+    db.session.commit()
+
+    assert delete_older_than(MqttData.__tablename__, T0 + timedelta(days=7), batch_rows=3) == 7
+    assert [row.ts for row in db.session.query(MqttData.ts).order_by(MqttData.ts)] == [
+        T0 + timedelta(days=i) for i in (7, 8, 9)
+    ]
+    db.session.query(MqttData).delete()
+    db.session.commit()
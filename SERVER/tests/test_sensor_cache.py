@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, MqttData
+from sensor_cache import LatestReadingCache
+
+T0 = datetime(2026, 1, 1)
+
+
+def add_readings(battery_id, volts, start=0):
+    db.session.add_all(
+        MqttData(battery_id=battery_id, ts=T0 + timedelta(seconds=start + i), voltage=v, current=1.0, temperature=25.0)
+        for i, v in enumerate(volts)
+    )
+    db.session.commit()
+
+
+@pytest.fixture()
+def readings(app_context):
+    yield
+    db.session.query(MqttData).delete()
+    db.session.commit()
+
+
+def test_catch_up_folds_in_every_new_row(readings):
+    add_readings(101, [48.0, 48.1])
+    cache = LatestReadingCache(max_age=0)
+    cache.ensure_fresh()
+    assert [r["voltage"] for r in cache.recent(101)] == [48.1]
+
+    add_readings(101, [48.2, 48.3, 48.4], start=2)
+    add_readings(102, [50.0])
+    cache.ensure_fresh()
+
+    assert [r["voltage"] for r in cache.recent(101)] == [48.1, 48.2, 48.3, 48.4]
+    assert [r["voltage"] for r in cache.latest()] == [48.4, 50.0]
+
+
+def test_far_behind_cache_is_warmed_again(readings):
+    cache = LatestReadingCache(max_age=0, catchup_max_rows=2)
+    cache.ensure_fresh()
+    add_readings(101, [48.0, 48.1, 48.2])
+    cache.ensure_fresh()
+    # Only the newest reading per battery, as after a restart
+    assert [r["voltage"] for r in cache.recent(101)] == [48.2]
+
+
+def test_fed_cache_does_not_query(readings):
+    cache = LatestReadingCache(max_age=0)
+    cache.fed_by_ingest = True
+    cache.ensure_fresh()
+    add_readings(101, [48.0])
+    cache.ensure_fresh()
+    assert cache.latest(101) == []
@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+
+from fastjson import dumps
+from fault_logs import serialize_fault_logs
+from telemetry import serialize_datalogs
+
+TS = datetime(2026, 1, 2, 3, 4, 5, 678000)
+
+
+def test_datalog_timestamps_keep_the_api_format():
+    [row] = serialize_datalogs([(1, TS, 1.5, 25.0, 48.0, 101)])
+    assert row["timestamp"] == "2026-01-02 03:04:05"
+    assert b'"timestamp":"2026-01-02 03:04:05"' in dumps([row])
+
+    [row] = serialize_datalogs([(1, TS.replace(tzinfo=timezone.utc), 1.5, 25.0, 48.0, 101)])
+    assert row["timestamp"] == "2026-01-02 03:04:05+00:00"
+
+
+def test_fault_log_detected_at_keeps_the_api_format():
+    [row] = serialize_fault_logs([(1, 101, "Over Voltage", "high", "rule", None, None, TS)])
+    assert row["detected_at"] == "2026-01-02 03:04:05"
+    [row] = serialize_fault_logs([(1, 101, "Over Voltage", "high", "rule", None, None, None)])
+    assert row["detected_at"] is None
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import soc_estimator
+from models import db, BattHealth, BattSocState, MqttData, RollupWatermark
+from soc_estimator import WATERMARK_NAME, estimate, ocv_soc, refresh_soc
+
+CAPACITY = 100.0
+SPECS = {1: (CAPACITY, 12.8), 2: (CAPACITY, 12.8)}
+
+
+def batch(battery, ts, current, voltage, temperature=None):
+    return {
+        "battery": np.asarray(battery, dtype=np.int64),
+        "ts": np.asarray(ts, dtype=float),
+        "current": np.asarray(current, dtype=float),
+        "voltage": np.asarray(voltage, dtype=float),
+        "temperature": np.asarray(temperature if temperature is not None else [25.0] * len(battery), dtype=float),
+    }
+
+
+def hour(battery, current, voltage, start=0):
+    """A minute-by-minute hour of constant current."""
+    ts = np.arange(start, start + 3601, 60)
+    return [battery] * ts.size, ts, [current] * ts.size, [voltage] * ts.size
+
+
+def test_coulomb_counting():
+    # 10 A for an hour out of 100 Ah; the previous state is too old to bridge
+    result, = estimate(batch(*hour(1, 10, 13.0)), {1: (0.8, -1000.0, 10.0)}, SPECS)
+    assert result["soc"] == pytest.approx(0.7)
+    assert result["remaining"] == timedelta(hours=7)
+    assert (result["last_ts"], result["last_current"], result["voltage"]) == (3600.0, 10.0, 13.0)
+
+
+def test_bridges_from_previous_state_and_skips_gaps():
+    # 100 s bridged from the stored sample, then a gap longer than SOC_MAX_GAP
+    result, = estimate(batch([1, 1], [0, 3600], [10, 10], [13.0, 13.0]), {1: (0.8, -100.0, 10.0)}, SPECS)
+    assert result["soc"] == pytest.approx(0.8 - 10 * 100 / (CAPACITY * 3600))
+
+
+def test_charging_is_clipped_at_full():
+    result, = estimate(batch(*hour(1, -50, 13.5)), {1: (0.9, np.nan, np.nan)}, SPECS)
+    assert result["soc"] == 1.0
+    assert result["remaining"] is None
+
+
+def test_first_sample_seeds_soc_from_ocv():
+    result, = estimate(batch([1], [0], [10], [13.2]), {}, SPECS)
+    assert result["soc"] == pytest.approx(ocv_soc(13.2, 12.8))
+
+
+def test_ocv_correction_when_resting():
+    # Pulled SOC_OCV_WEIGHT of the way to the OCV estimate (0.7 at 13.2 V)
+    result, = estimate(batch([1, 1], [0, 10], [0, 0], [13.2, 13.2]), {1: (0.5, np.nan, np.nan)}, SPECS)
+    assert result["soc"] == pytest.approx(0.5 + soc_estimator.SOC_OCV_WEIGHT * (0.7 - 0.5))
+
+    # Scaled by nominal voltage: 26.4 V on a 25.6 V pack reads like 13.2 V
+    result, = estimate(batch([1], [0], [0], [26.4]), {1: (0.5, np.nan, np.nan)}, {1: (CAPACITY, 25.6)})
+    assert result["soc"] == pytest.approx(0.5 + soc_estimator.SOC_OCV_WEIGHT * (0.7 - 0.5))
+
+    # No correction while current flows or without a voltage
+    for current, voltage in ((10, 13.2), (0, np.nan)):
+        result, = estimate(batch([1], [0], [current], [voltage]), {1: (0.5, np.nan, np.nan)}, SPECS)
+        assert result["soc"] == pytest.approx(0.5)
+
+
+def test_batteries_are_integrated_separately():
+    first, second = hour(1, 10, 13.0), hour(2, 20, 13.0, start=3660)
+    results = estimate(
+        batch(*(a + b for a, b in zip(map(list, first), map(list, second)))),
+        {1: (0.8, np.nan, np.nan), 2: (0.8, np.nan, np.nan)},
+        SPECS,
+    )
+    assert [r["battery_id"] for r in results] == [1, 2]
+    # 10 A for an hour, then 20 A for the next; nothing across the battery boundary
+    assert [r["soc"] for r in results] == pytest.approx([0.7, 0.6])
+
+
+@pytest.fixture()
+def samples(app_context):
+    t0 = datetime(2026, 1, 1, 12)
+    db.session.add_all(
+        MqttData(battery_id=101, company_id=1, ts=t0 + timedelta(seconds=i), current=10, voltage=13.0)
+        for i in range(4)
+    )
+    db.session.commit()
+    yield [row.id for row in db.session.query(MqttData.id).order_by(MqttData.id)]
+    for model in (BattHealth, BattSocState, RollupWatermark, MqttData):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def test_refresh_soc_leaves_the_id_lag_for_later(samples, monkeypatch):
+    monkeypatch.setattr(soc_estimator, "SOC_ID_LAG", 2)
+    assert refresh_soc() == len(samples) - 2
+    assert db.session.get(RollupWatermark, WATERMARK_NAME).last_id == samples[-3]
+    assert refresh_soc() == 0
+
+    monkeypatch.setattr(soc_estimator, "SOC_ID_LAG", 0)
+    assert refresh_soc() == 2
+    assert db.session.get(RollupWatermark, WATERMARK_NAME).last_id == samples[-1]
+    state = db.session.get(BattSocState, 101)
+    assert state.last_current == 10
+    assert db.session.query(BattHealth).filter(BattHealth.batt_uid == 101).count() == 2
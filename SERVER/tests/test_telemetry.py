@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import telemetry
+from models import db, MqttData
+
+T0 = datetime(2026, 1, 1, 12)
+
+
+@pytest.fixture()
+def datalogs(app_context):
+    """Five rows a minute apart for company 1, one for company 2 in between."""
+    rows = [MqttData(battery_id=101, company_id=1, ts=T0 + timedelta(minutes=i), voltage=50 + i) for i in range(5)]
+    rows.insert(2, MqttData(battery_id=201, company_id=2, ts=T0 + timedelta(minutes=1, seconds=30), voltage=1))
+    db.session.add_all(rows)
+    db.session.commit()
+    yield [row.id for row in rows if row.company_id == 1]
+    db.session.query(MqttData).delete()
+    db.session.commit()
+
+
+def delta(client, headers, **params):
+    response = client.get("/api/datalogs", query_string=params, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_delta_since_id(client, headers, datalogs):
+    body = delta(client, headers["user1"], since_id=datalogs[1])
+    assert [row["voltage"] for row in body["data"]] == [52, 53, 54]
+    assert body["reset"] is False
+    assert body["watermark"] == {"since_id": datalogs[-1], "since_ts": "2026-01-01 12:04:00"}
+
+    body = delta(client, headers["user1"], since_id=datalogs[-1])
+    assert body["data"] == [] and body["reset"] is False
+    assert body["watermark"]["since_id"] == datalogs[-1]
+
+
+@pytest.mark.parametrize("since_ts", ["2026-01-01T12:02:00", "2026-01-01T14:02:00+02:00"])
+def test_delta_since_ts_naive_or_aware(client, headers, datalogs, since_ts):
+    body = delta(client, headers["user1"], since_ts=since_ts)
+    assert [row["voltage"] for row in body["data"]] == [53, 54]
+    assert [row["timestamp"] for row in body["data"]] == ["2026-01-01 12:03:00", "2026-01-01 12:04:00"]
+    assert body["reset"] is False
+    assert body["watermark"]["since_ts"] == "2026-01-01 12:04:00"
+
+
+def test_delta_empty_keeps_watermark(client, headers, datalogs):
+    body = delta(client, headers["user1"], since_ts="2026-01-01T13:00:00")
+    assert body["data"] == [] and body["reset"] is False
+    assert body["watermark"]["since_ts"] == "2026-01-01 13:00:00+00:00"
+
+
+@pytest.mark.parametrize("params", [{"since_id": 0}, {"since_ts": "2025-12-31T12:00:00+00:00"}])
+def test_delta_resets_when_watermark_aged_out(client, headers, datalogs, params):
+    # Rows below the watermark are gone: the client must reload its window
+    db.session.query(MqttData).filter(MqttData.id == datalogs[0]).delete()
+    db.session.commit()
+    body = delta(client, headers["user1"], **params)
+    assert body["data"] == [] and body["reset"] is True
+
+
+def test_delta_resets_past_max_rows(client, headers, datalogs, monkeypatch):
+    monkeypatch.setattr(telemetry, "DELTA_MAX_ROWS", 2)
+    body = delta(client, headers["user1"], since_id=datalogs[0])
+    assert body["data"] == [] and body["reset"] is True
+    assert body["watermark"]["since_id"] == datalogs[0]
+
+
+@pytest.mark.parametrize("params", [{"since_id": "x"}, {"since_ts": "yesterday"}, {"since_id": ""}])
+def test_delta_rejects_bad_watermarks(client, headers, datalogs, params):
+    response = client.get("/api/datalogs", query_string=params, headers=headers["user1"])
+    assert response.status_code == 400
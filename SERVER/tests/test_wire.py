@@ -0,0 +1,73 @@
+import gzip
+import math
+import struct
+from array import array
+from datetime import datetime, timezone
+
+import pytest
+
+from wire import BINARY_MAGIC, binary_datalogs, columnar_datalogs, negotiate_encoding, wire_response
+
+TS = datetime(2026, 1, 1, tzinfo=timezone.utc)
+ROWS = [(1, TS, 1.5, 25.0, 48.0, 101), (2, TS, None, 26.0, 48.5, None)]
+
+
+def test_columnar_datalogs():
+    data = columnar_datalogs(ROWS)
+    assert data["fields"] == ["timestamp", "batteryId", "voltage", "current", "temperature"]
+    assert data["timestamp"] == [TS.timestamp() * 1000] * 2
+    assert data["batteryId"] == [101, None]
+    assert data["current"] == [1.5, None]
+
+
+def test_binary_datalogs_layout():
+    body = binary_datalogs(ROWS)
+    assert body[:4] == BINARY_MAGIC
+    count = struct.unpack_from("<I", body, 4)[0]
+    assert count == 2
+
+    offset = 8
+    blocks = []
+    for typecode in "difff":
+        block = array(typecode)
+        block.frombytes(body[offset:offset + count * block.itemsize])
+        offset += count * block.itemsize
+        blocks.append(list(block))
+    assert offset == len(body)
+
+    ts_ms, battery, voltage, current, temperature = blocks
+    assert ts_ms == [TS.timestamp() * 1000] * 2
+    assert battery == [101, -1]
+    assert voltage == [48.0, 48.5]
+    assert current[0] == 1.5 and math.isnan(current[1])
+
+
+@pytest.mark.parametrize("header, encoding", [
+    (None, None), ("", None), ("gzip", "gzip"), ("gzip;q=0, deflate", None), ("deflate, GZIP ; q=0.5", "gzip"),
+])
+def test_negotiate_encoding(header, encoding):
+    assert negotiate_encoding(header) == encoding
+
+
+def test_wire_response_etag_and_304(app):
+    payload = [{"voltage": 48.0}]
+    with app.test_request_context():
+        response = wire_response(payload)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and etag.startswith('W/"')
+
+    with app.test_request_context(headers={"If-None-Match": etag}):
+        assert wire_response(payload).status_code == 304
+    with app.test_request_context(headers={"If-None-Match": etag}):
+        assert wire_response([{"voltage": 48.1}]).status_code == 200
+
+
+def test_wire_response_compresses_large_bodies(app):
+    payload = [{"voltage": 48.0, "i": i} for i in range(200)]
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = wire_response(payload)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()).startswith(b'[{"voltage":48.0')
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        assert "Content-Encoding" not in wire_response([1]).headers
@@ -0,0 +1,137 @@
+"""
+Compact encodings and HTTP caching for telemetry responses.
+
+Formats (``?format=``):
+  json      one object per row (default)
+  columnar  one JSON array per field
+  binary    application/octet-stream, little-endian, 8-byte aligned:
+              "BMS1"  uint32 count
+              float64[count]  timestamp (epoch ms)
+              int32[count]    battery id
+              float32[count]  voltage, then current, then temperature
+            so a browser can wrap each block in a typed array without copying.
+
+wire_response() adds an ETag, answers If-None-Match with 304 and
+compresses with brotli or gzip according to Accept-Encoding.
+"""
+import gzip
+import hashlib
+import math
+import struct
+import sys
+from array import array
+
+from flask import Response, request
+
+from fastjson import dumps
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+WIRE_FORMATS = ("json", "columnar", "binary")
+BINARY_MAGIC = b"BMS1"
+BINARY_MIMETYPE = "application/octet-stream"
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+def _epoch_ms(ts):
+    return ts.timestamp() * 1000.0
+
+
+def _nan(value):
+    return math.nan if value is None else value
+
+
+def columnar_datalogs(rows):
+    """DATALOG_COLUMNS tuples -> {"fields": [...], <field>: [values...]}"""
+    ts_ms, battery, voltage, current, temperature = [], [], [], [], []
+    for _, ts, c, t, v, b in rows:
+        ts_ms.append(_epoch_ms(ts))
+        battery.append(b)
+        voltage.append(v)
+        current.append(c)
+        temperature.append(t)
+    return {
+        "fields": ["timestamp", "batteryId", "voltage", "current", "temperature"],
+        "timestamp": ts_ms,
+        "batteryId": battery,
+        "voltage": voltage,
+        "current": current,
+        "temperature": temperature,
+    }
+
+
+def binary_datalogs(rows):
+    """DATALOG_COLUMNS tuples -> packed little-endian blocks (see module docstring)."""
+    ts_ms, battery = array("d"), array("i")
+    voltage, current, temperature = array("f"), array("f"), array("f")
+    for _, ts, c, t, v, b in rows:
+        ts_ms.append(_epoch_ms(ts))
+        battery.append(b if b is not None else -1)
+        voltage.append(_nan(v))
+        current.append(_nan(c))
+        temperature.append(_nan(t))
+
+    blocks = [ts_ms, battery, voltage, current, temperature]
+    if sys.byteorder != "little":
+        for block in blocks:
+            block.byteswap()
+
+    return BINARY_MAGIC + struct.pack("<I", len(ts_ms)) + b"".join(b.tobytes() for b in blocks)
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, or None for identity."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.strip().replace(" ", "")
+        try:
+            q = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def wire_response(payload, fmt="json", headers=None):
+    """
+    Encode `payload` in the requested format and wrap it in a cacheable response.
+
+    `payload` is bytes for binary, otherwise any JSON-serializable object.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        body, mimetype = bytes(payload), BINARY_MIMETYPE if fmt == "binary" else "application/json"
+    else:
+        body, mimetype = dumps(payload), "application/json"
+
+    # Weak: the same entity is served under different Content-Encodings
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    response_headers = {
+        "ETag": f'W/"{etag}"',
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    response_headers.update(headers or {})
+
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=response_headers)
+
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        if encoding == "br":
+            body = brotli.compress(body, quality=4)
+        else:
+            body = gzip.compress(body, compresslevel=5)
+        response_headers["Content-Encoding"] = encoding
+
+    return Response(body, status=200, mimetype=mimetype, headers=response_headers)
@@ -0,0 +1,169 @@
+"""
+Production entry point:  python wsgi.py
+
+This is the only supported way to run the server. serve() starts the
+background services and installs the drain-on-signal handlers, so
+importing `wsgi:app` into another server (gunicorn, uWSGI) would run
+without either.
+
+SERVER_WORKER picks the concurrency model: "eventlet" (default) or
+"gevent" run every request and socket as a green thread in one process;
+"threading" uses a real thread per request. Scale out with more processes
+behind a sticky-session load balancer (Socket.IO needs it), keeping
+processes x (DB_POOL_SIZE + DB_MAX_OVERFLOW) under Postgres
+max_connections; see config.engine_options().
+
+On SIGTERM/SIGINT the process drains: /api/health turns 503 so the load
+balancer stops routing here, new requests get 503, in-flight requests get
+up to DRAIN_TIMEOUT seconds to finish, then background services stop,
+pools are closed and the server exits.
+"""
+import os
+
+SERVER_WORKER = os.getenv('SERVER_WORKER', 'eventlet').lower()
+
+# Patch the standard library before anything imports socket or threading
+if SERVER_WORKER == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SERVER_WORKER == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif SERVER_WORKER != 'threading':
+    raise RuntimeError(f"Unknown SERVER_WORKER: {SERVER_WORKER}")
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', SERVER_WORKER)
+
+import logging
+import signal
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from extensions import socketio
+from main import create_app, start_background_services
+from models import db
+from passwords import hash_pool
+
+logger = logging.getLogger("bms.server")
+
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 25))
+DRAIN_RETRY_AFTER = int(os.getenv('DRAIN_RETRY_AFTER', 5))
+# Concurrent green threads per process (eventlet only)
+SERVER_MAX_CONNECTIONS = int(os.getenv('SERVER_MAX_CONNECTIONS', 2000))
+
+
+class Drain:
+    """Counts in-flight requests and turns new ones away once draining."""
+
+    def __init__(self, app):
+        self.draining = False
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        app.before_request(self._enter)
+        app.teardown_request(self._leave)
+        app.add_url_rule("/api/health", "health", self.health)
+
+    def _enter(self):
+        if request.endpoint == "health":
+            return None
+        if self.draining:
+            return (
+                jsonify({"error": "Server is shutting down"}),
+                503,
+                {"Retry-After": str(DRAIN_RETRY_AFTER), "Connection": "close"},
+            )
+        with self._lock:
+            self.in_flight += 1
+        g._drain_counted = True
+
+    def _leave(self, exc):
+        if g.pop("_drain_counted", False):
+            with self._lock:
+                self.in_flight -= 1
+
+    def health(self):
+        if self.draining:
+            return jsonify({"status": "draining"}), 503
+        return jsonify({"status": "ok"}), 200
+
+    def wait(self, timeout=DRAIN_TIMEOUT):
+        """Stop admitting requests and wait for in-flight ones; returns how many were left."""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.in_flight
+
+
+app = create_app()
+drain = Drain(app)
+_drained = threading.Event()
+
+
+def shutdown(services):
+    left = drain.wait()
+    if left:
+        logger.warning("Drain timed out with %d requests in flight", left)
+
+    for service in services:
+        try:
+            service.stop()
+        except Exception:
+            logger.exception("Failed to stop %r", service)
+    # Under gevent joining the pool's manager thread never returns; under
+    # eventlet hashing runs on eventlet.tpool and there is nothing to join
+    hash_pool.shutdown(wait=SERVER_WORKER == 'threading')
+    with app.app_context():
+        db.engine.dispose()
+
+    logger.info("Drained; exiting")
+    if SERVER_WORKER == 'eventlet':
+        # The hub re-raises SystemExit from a green thread in the server loop
+        raise SystemExit
+    if SERVER_WORKER == 'gevent':
+        socketio.wsgi_server.stop()
+        return
+    # Signal handlers run in the main thread; the next one breaks the server loop
+    _drained.set()
+    os.kill(os.getpid(), signal.SIGINT)
+
+
+def serve():
+    services = start_background_services(app)
+
+    def on_signal(signum, frame):
+        if _drained.is_set():
+            raise KeyboardInterrupt
+        if drain.draining:
+            return
+        logger.info("Received signal %d; draining", signum)
+        drain.draining = True
+        # Under eventlet this handler may run inside the hub, which must not block
+        socketio.start_background_task(shutdown, services)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    options = {}
+    if SERVER_WORKER == 'eventlet':
+        options["max_size"] = SERVER_MAX_CONNECTIONS
+    elif SERVER_WORKER == 'threading':
+        options["allow_unsafe_werkzeug"] = True
+
+    try:
+        socketio.run(
+            app,
+            host=os.getenv("FLASK_RUN_HOST", "0.0.0.0"),
+            port=int(os.getenv("FLASK_RUN_PORT", 8000)),
+            log_output=os.getenv('ACCESS_LOG', 'False').lower() == 'true',
+            **options
+        )
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+# ---------------- RUN SERVER ----------------
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    serve()